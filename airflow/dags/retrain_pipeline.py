@@ -43,7 +43,7 @@ with DAG(
 
     redeploy_model = BashOperator(
         task_id='redeploy_model',
-        bash_command='curl -X POST http://api:5000/reload || echo "No redeploy endpoint available."'
+        bash_command='python3 /opt/airflow/scripts/redeploy_model.py'
     )
 
     insert_metadata >> download_images >> retrain_model >> save_model >> redeploy_model
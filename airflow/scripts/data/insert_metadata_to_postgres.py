@@ -1,56 +1,131 @@
+import os
+import time
+
 import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+# Templates of URLs
+SOURCE_URL_TEMPLATE = "https://raw.githubusercontent.com/btphan95/greenr-airflow/refs/heads/master/data/{label}/{index:08d}.jpg"
+S3_URL_TEMPLATE = "https://mlops-plants-data.s3.amazonaws.com/{label}/{index:08d}.jpg"
+
+# Labels and number of images per label
+DATASET_LABELS = [label.strip() for label in os.getenv("DATASET_LABELS", "dandelion,grass").split(",") if label.strip()]
+IMAGES_PER_LABEL = int(os.getenv("IMAGES_PER_LABEL", "200"))
+
+# Rows sent per INSERT statement
+INSERT_PAGE_SIZE = int(os.getenv("INSERT_PAGE_SIZE", "1000"))
+
+UNIQUE_INDEX = "plants_data_url_s3_key"
+LABEL_CHECK = "plants_data_label_check"
+
+
+def connect_postgres():
+    # Configuration of the connection to PostgreSQL, same settings as download.py
+    return psycopg2.connect(
+        dbname=os.getenv("POSTGRES_DB"),
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        host=os.getenv("POSTGRES_HOST", "postgres"),
+        port=os.getenv("POSTGRES_PORT", "5432"),
+    )
+
+
+def create_schema(cursor, labels=DATASET_LABELS):
+    # Create a table if not exist
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS plants_data (
+            id SERIAL PRIMARY KEY,
+            url_source TEXT NOT NULL,
+            url_s3 TEXT NOT NULL,
+            label TEXT NOT NULL
+        );
+        """
+    )
+
+    # Label constraint rebuilt on every run, so it follows DATASET_LABELS
+    # (same name as the inline CHECK of tables created by earlier versions)
+    cursor.execute(
+        sql.SQL("SELECT DISTINCT label FROM plants_data WHERE label NOT IN ({labels}) ORDER BY label;").format(
+            labels=sql.SQL(", ").join(sql.Literal(label) for label in labels)
+        )
+    )
+    stray = [label for (label,) in cursor.fetchall()]
+    if stray:
+        raise ValueError(
+            f"plants_data still has rows labelled {', '.join(stray)}, which are not in DATASET_LABELS "
+            f"({', '.join(labels)}): add them back or delete those rows first"
+        )
+    cursor.execute(sql.SQL("ALTER TABLE plants_data DROP CONSTRAINT IF EXISTS {};").format(sql.Identifier(LABEL_CHECK)))
+    cursor.execute(
+        sql.SQL("ALTER TABLE plants_data ADD CONSTRAINT {} CHECK (label IN ({labels}));").format(
+            sql.Identifier(LABEL_CHECK),
+            labels=sql.SQL(", ").join(sql.Literal(label) for label in labels),
+        )
+    )
 
-# Configuration of the connection to PostgreSQL on Docker
-conn = psycopg2.connect(
-    dbname="plants_db",
-    user="postgres",
-    password="postgres",
-    host="postgres",
-    port="5432"
-)
-cursor = conn.cursor()
-
-# Create a table if not exist
-cursor.execute(
-    """
-    CREATE TABLE IF NOT EXISTS plants_data (
-        id SERIAL PRIMARY KEY,
-        url_source TEXT NOT NULL,
-        url_s3 TEXT NOT NULL,
-        label TEXT CHECK(label IN ('dandelion', 'grass')) NOT NULL
-    );
-"""
-)
-
-# Teplates of URLs
-source_url_template = "https://raw.githubusercontent.com/btphan95/greenr-airflow/refs/heads/master/data/{label}/{index:08d}.jpg"
-s3_url_template = "https://mlops-plants-data.s3.amazonaws.com/{label}/{index:08d}.jpg"
-
-# Labels and index
-labels = ["dandelion", "grass"]
-num_images = 200  # 200 imágenes por categoría
-
-# Insert data on PostgreSQL
-for label in labels:
-    for index in range(num_images):
-        url_source = source_url_template.format(label=label, index=index)
-        url_s3 = s3_url_template.format(label=label, index=index)
-
-        # Verificar si ya existe para no duplicar
+    # Unique index on url_s3, after removing duplicates left by earlier runs
+    cursor.execute("SELECT to_regclass(%s) IS NULL;", (UNIQUE_INDEX,))
+    if cursor.fetchone()[0]:
+        cursor.execute(
+            """
+            DELETE FROM plants_data a USING plants_data b
+            WHERE a.url_s3 = b.url_s3 AND a.id > b.id;
+            """
+        )
+        print(f"Removed {cursor.rowcount} duplicate rows before creating the unique index.")
         cursor.execute(
-            "SELECT 1 FROM plants_data WHERE url_s3 = %s LIMIT 1;", (url_s3,)
+            sql.SQL("CREATE UNIQUE INDEX IF NOT EXISTS {} ON plants_data (url_s3);").format(
+                sql.Identifier(UNIQUE_INDEX)
+            )
         )
-        exists = cursor.fetchone()
 
-        if not exists:
-            cursor.execute(
-                "INSERT INTO plants_data (url_source, url_s3, label) VALUES (%s, %s, %s)",
-                (url_source, url_s3, label)
+
+def metadata_rows(labels=DATASET_LABELS, num_images=IMAGES_PER_LABEL):
+    for label in labels:
+        for index in range(num_images):
+            yield (
+                SOURCE_URL_TEMPLATE.format(label=label, index=index),
+                S3_URL_TEMPLATE.format(label=label, index=index),
+                label,
             )
 
-# Save changes and and close conexion
-conn.commit()
-cursor.close()
-conn.close()
 
-print("Completed.")
+def insert_metadata(cursor, rows, page_size=INSERT_PAGE_SIZE):
+    """Insert the rows in batches, skipping existing url_s3. Returns the number inserted."""
+    inserted = execute_values(
+        cursor,
+        """
+        INSERT INTO plants_data (url_source, url_s3, label) VALUES %s
+        ON CONFLICT (url_s3) DO NOTHING
+        RETURNING id;
+        """,
+        rows,
+        page_size=page_size,
+        fetch=True,
+    )
+    return len(inserted)
+
+
+def main():
+    start = time.perf_counter()
+    rows = list(metadata_rows(DATASET_LABELS, IMAGES_PER_LABEL))
+    conn = connect_postgres()
+    try:
+        # Single transaction: schema, index and all the rows
+        with conn, conn.cursor() as cursor:
+            create_schema(cursor, DATASET_LABELS)
+            inserted = insert_metadata(cursor, rows)
+    finally:
+        conn.close()
+
+    print(
+        f"Completed: {inserted} rows inserted, {len(rows) - inserted} already present "
+        f"({time.perf_counter() - start:.1f} s)."
+    )
+    return inserted
+
+
+if __name__ == "__main__":
+    main()
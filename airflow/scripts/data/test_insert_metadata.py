@@ -0,0 +1,93 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from insert_metadata_to_postgres import create_schema, insert_metadata, main, metadata_rows
+
+
+@pytest.fixture
+def cursor():
+    return MagicMock()
+
+
+def _statements(cursor):
+    return [str(call.args[0]) for call in cursor.execute.call_args_list]
+
+
+def test_metadata_rows():
+    rows = list(metadata_rows(["dandelion", "grass"], 3))
+    assert len(rows) == 6
+    assert rows[0] == (
+        "https://raw.githubusercontent.com/btphan95/greenr-airflow/refs/heads/master/data/dandelion/00000000.jpg",
+        "https://mlops-plants-data.s3.amazonaws.com/dandelion/00000000.jpg",
+        "dandelion",
+    )
+    assert rows[-1][2] == "grass"
+
+
+def test_create_schema_adds_unique_index_once(cursor, capsys):
+    # Index absent : doublons supprimés puis index créé
+    cursor.fetchone.return_value = (True,)
+    create_schema(cursor)
+    statements = _statements(cursor)
+    assert any("DELETE FROM plants_data" in s for s in statements)
+    assert "duplicate rows" in capsys.readouterr().out
+    assert any("CREATE UNIQUE INDEX" in s for s in statements)
+
+    # Index présent : rien à faire
+    cursor.reset_mock()
+    cursor.fetchone.return_value = (False,)
+    create_schema(cursor)
+    assert not any("CREATE UNIQUE INDEX" in s for s in _statements(cursor))
+
+
+def test_create_schema_rebuilds_label_check(cursor):
+    cursor.fetchone.return_value = (False,)
+    create_schema(cursor, ["dandelion", "grass", "clover"])
+
+    calls = [call.args[0] for call in cursor.execute.call_args_list]
+    drop = next(i for i, s in enumerate(calls) if "DROP CONSTRAINT" in str(s))
+    add = next(i for i, s in enumerate(calls) if "ADD CONSTRAINT" in str(s))
+    assert drop < add
+    assert "plants_data_label_check" in repr(calls[add]) and "clover" in repr(calls[add])
+
+
+def test_create_schema_reports_labels_still_in_use(cursor):
+    cursor.fetchall.return_value = [("clover",)]
+
+    with pytest.raises(ValueError, match="clover"):
+        create_schema(cursor, ["dandelion", "grass"])
+    # La contrainte existante n'est pas touchée
+    assert not any("CONSTRAINT" in repr(call.args[0]) for call in cursor.execute.call_args_list)
+
+
+@patch("insert_metadata_to_postgres.execute_values")
+def test_insert_metadata_is_a_bulk_upsert(mock_execute_values, cursor):
+    rows = list(metadata_rows(["dandelion"], 5))
+    mock_execute_values.return_value = [(1,), (2,)]
+
+    assert insert_metadata(cursor, rows, page_size=2) == 2
+
+    mock_execute_values.assert_called_once()
+    args, kwargs = mock_execute_values.call_args
+    assert "ON CONFLICT (url_s3) DO NOTHING" in args[1]
+    assert args[2] == rows
+    assert kwargs["page_size"] == 2
+    # Aucune requête ligne par ligne
+    cursor.execute.assert_not_called()
+
+
+@patch("insert_metadata_to_postgres.execute_values", return_value=[(1,)] * 10)
+@patch("insert_metadata_to_postgres.connect_postgres")
+def test_main_commits_in_one_transaction(mock_connect, mock_execute_values):
+    conn = mock_connect.return_value
+    conn.cursor.return_value.__enter__.return_value.fetchone.return_value = (False,)
+
+    with patch("insert_metadata_to_postgres.IMAGES_PER_LABEL", 5), patch(
+        "insert_metadata_to_postgres.DATASET_LABELS", ["dandelion", "grass"]
+    ):
+        assert main() == 10
+
+    conn.__enter__.assert_called_once()
+    assert len(mock_execute_values.call_args.args[2]) == 10
+    conn.close.assert_called_once()
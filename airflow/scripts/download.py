@@ -1,68 +1,491 @@
+import hashlib
 import os
-import requests
-from tqdm import tqdm
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import psycopg2
+import requests
+import urllib3
 from minio import Minio
-from io import BytesIO
-
-# Connexion PostgreSQL
-conn = psycopg2.connect(
-    dbname=os.getenv("POSTGRES_DB"),
-    user=os.getenv("POSTGRES_USER"),
-    password=os.getenv("POSTGRES_PASSWORD"),
-    host=os.getenv("POSTGRES_HOST"),
-    port=os.getenv("POSTGRES_PORT"),
-)
-cursor = conn.cursor()
-
-# Connexion MinIO
-client = Minio(
-    os.getenv("MLFLOW_S3_ENDPOINT_URL").replace(
-        "http://", ""
-    ),  # Enlève le protocole pour Minio
-    access_key=os.getenv("AWS_ACCESS_KEY_ID"),
-    secret_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-    secure=False,
-)
+from PIL import Image
+from psycopg2.extras import execute_values
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+from urllib3.util.retry import Retry
 
 # Bucket d’images
-bucket_name = "images"
-if not client.bucket_exists(bucket_name):
-    client.make_bucket(bucket_name)
+BUCKET_NAME = "images"
+
+# Téléchargements simultanés, tentatives et délai d'attente par requête
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "16"))
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+DOWNLOAD_BACKOFF = float(os.getenv("DOWNLOAD_BACKOFF", "0.5"))
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "5"))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Taille des parts d'un upload multipart (5 Mo minimum), et taille au-delà de laquelle une
+# image en cours de traitement est gardée sur disque plutôt qu'en mémoire
+UPLOAD_PART_SIZE = int(os.getenv("UPLOAD_PART_SIZE", str(8 * 1024 * 1024)))
+
+# Lignes lues et mises à jour par lot dans plants_data
+DOWNLOAD_BATCH_SIZE = int(os.getenv("DOWNLOAD_BATCH_SIZE", "500"))
+
+# Taille des morceaux lus pendant le calcul de l'empreinte sha256
+COPY_CHUNK_SIZE = 64 * 1024
+
+# Distance de Hamming maximale entre les dHash de deux quasi-doublons (sur 64 bits)
+NEAR_DUPLICATE_DISTANCE = int(os.getenv("NEAR_DUPLICATE_DISTANCE", "5"))
+
+# Colonnes de plants_data mises à jour après chaque lot
+STATUS_COLUMNS = ("id", "status", "size", "etag", "error", "sha256", "dhash", "duplicate_of", "near_duplicate_of")
+
+
+def connect_postgres():
+    # Connexion PostgreSQL
+    return psycopg2.connect(
+        dbname=os.getenv("POSTGRES_DB"),
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        host=os.getenv("POSTGRES_HOST"),
+        port=os.getenv("POSTGRES_PORT"),
+    )
+
+
+def create_retry(retries=DOWNLOAD_RETRIES, backoff=DOWNLOAD_BACKOFF):
+    # Nouvelle tentative avec attente exponentielle sur erreur réseau ou 5xx
+    return Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None,
+        raise_on_status=False,
+    )
+
+
+def create_minio_client(max_connections=DOWNLOAD_WORKERS):
+    # Connexion MinIO, avec un pool de connexions partagé par tous les threads
+    http_client = urllib3.PoolManager(
+        maxsize=max_connections,
+        timeout=urllib3.Timeout(connect=DOWNLOAD_TIMEOUT, read=60),
+        retries=create_retry(),
+    )
+    return Minio(
+        os.getenv("MLFLOW_S3_ENDPOINT_URL").replace(
+            "http://", ""
+        ),  # Enlève le protocole pour Minio
+        access_key=os.getenv("AWS_ACCESS_KEY_ID"),
+        secret_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+        secure=False,
+        http_client=http_client,
+    )
+
+
+def create_session(pool_size=DOWNLOAD_WORKERS, retries=DOWNLOAD_RETRIES, backoff=DOWNLOAD_BACKOFF):
+    # Session HTTP partagée : connexions réutilisées entre les images d'un même hôte
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=create_retry(retries, backoff),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def sha256_copy(stream, target, chunk_size=COPY_CHUNK_SIZE):
+    """Copy a stream into a file object by chunks, returning its sha256 hex digest."""
+    digest = hashlib.sha256()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return digest.hexdigest()
+        digest.update(chunk)
+        target.write(chunk)
+
+
+def dhash(image_file, hash_size=8):
+    """64-bit difference hash of an image file, or None if it cannot be decoded."""
+    try:
+        with Image.open(image_file) as img:
+            # Décodage JPEG à échelle réduite : seule une vignette 9x8 en niveaux de gris est utile
+            img.draft("L", (hash_size * 8, hash_size * 8))
+            pixels = img.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR).tobytes()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = row * (hash_size + 1) + col
+            value = value << 1 | (pixels[left] > pixels[left + 1])
+    return value
+
+
+def to_bigint(value):
+    # Colonne BIGINT signée côté PostgreSQL
+    return value - (1 << 64) if value is not None and value >= 1 << 63 else value
+
+
+def from_bigint(value):
+    return value & ((1 << 64) - 1) if value is not None else None
+
+
+class ContentIndex:
+    """Thread-safe index of the image hashes already ingested.
+
+    Exact duplicates share a sha256. Near-duplicates have dHashes at most
+    `max_distance` bits apart: hashes are cut into max_distance + 1 bands, and
+    two hashes that close share at least one band, so only the hashes of a
+    matching band are compared.
+    """
+
+    def __init__(self, known=(), max_distance=NEAR_DUPLICATE_DISTANCE):
+        self.lock = threading.Lock()
+        self.max_distance = max_distance
+        bounds = [64 * i // (max_distance + 1) for i in range(max_distance + 2)]
+        self.masks = [(low, (1 << (high - low)) - 1) for low, high in zip(bounds, bounds[1:])]
+        self.bands = [defaultdict(list) for _ in self.masks]
+        self.by_sha256 = {}
+        # Contenus dont la première image est en cours d'upload : sha256 -> Event
+        self.pending = {}
+        for img_id, sha256, dhash_value, group in known:
+            self.by_sha256.setdefault(sha256, img_id)
+            self._add(from_bigint(dhash_value), group or img_id)
+
+    def _add(self, dhash_value, group):
+        if dhash_value is not None:
+            for band, (shift, mask) in zip(self.bands, self.masks):
+                band[dhash_value >> shift & mask].append((dhash_value, group))
+
+    def _near_group(self, dhash_value):
+        for band, (shift, mask) in zip(self.bands, self.masks):
+            for candidate, group in band.get(dhash_value >> shift & mask, ()):
+                if bin(candidate ^ dhash_value).count("1") <= self.max_distance:
+                    return group
+        return None
+
+    def claim(self, img_id, sha256, dhash_value):
+        """Register an image and return (duplicate_of, near_duplicate_of).
+
+        duplicate_of is the id of the first image with the same content that
+        reached the bucket; near_duplicate_of the id of the group of a similar
+        image. While that first image is still uploading, the call waits for
+        it, and takes its place if its upload fails. A caller that gets no
+        duplicate_of must `confirm` or `release` its claim once its own upload
+        is over.
+        """
+        while True:
+            with self.lock:
+                original = self.by_sha256.get(sha256)
+                if original is not None:
+                    return original, None
+                uploading = self.pending.get(sha256)
+                if uploading is None:
+                    self.pending[sha256] = threading.Event()
+                    group = self._near_group(dhash_value) if dhash_value is not None else None
+                    self._add(dhash_value, group or img_id)
+                    return None, group
+            uploading.wait()
+
+    def confirm(self, img_id, sha256):
+        """The image is in the bucket: later images with its content are its duplicates."""
+        with self.lock:
+            self.by_sha256.setdefault(sha256, img_id)
+            uploading = self.pending.pop(sha256, None)
+        if uploading is not None:
+            uploading.set()
 
-# Récupération des données
-cursor.execute("SELECT id, url_source, label FROM plants_data;")
-data = cursor.fetchall()
+    def release(self, sha256):
+        """The image could not be stored: the next image with its content is uploaded instead."""
+        with self.lock:
+            uploading = self.pending.pop(sha256, None)
+        if uploading is not None:
+            uploading.set()
 
-# Upload direct dans MinIO sans stockage local
-for row in tqdm(data):
+
+def ensure_state_columns(conn):
+    # Colonnes d'état et empreintes des images, index sur les lignes à traiter et sur sha256
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            ALTER TABLE plants_data
+                ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'pending',
+                ADD COLUMN IF NOT EXISTS downloaded_at TIMESTAMPTZ,
+                ADD COLUMN IF NOT EXISTS size BIGINT,
+                ADD COLUMN IF NOT EXISTS etag TEXT,
+                ADD COLUMN IF NOT EXISTS error TEXT,
+                ADD COLUMN IF NOT EXISTS sha256 TEXT,
+                ADD COLUMN IF NOT EXISTS dhash BIGINT,
+                ADD COLUMN IF NOT EXISTS duplicate_of INTEGER,
+                ADD COLUMN IF NOT EXISTS near_duplicate_of INTEGER;
+            -- Remplacé par plants_data_unhashed_idx : la requête des lignes à traiter inclut
+            -- aussi les lignes sans sha256, que l'ancien prédicat (status <> 'done') ne couvrait pas
+            DROP INDEX IF EXISTS plants_data_pending_idx;
+            CREATE INDEX IF NOT EXISTS plants_data_unhashed_idx
+                ON plants_data (id) WHERE status <> 'done' OR sha256 IS NULL;
+            CREATE INDEX IF NOT EXISTS plants_data_sha256_idx ON plants_data (sha256);
+            """
+        )
+    conn.commit()
+
+
+def iter_pending_batches(conn, batch_size=DOWNLOAD_BATCH_SIZE):
+    """Yield the rows not ingested or not hashed yet, in lists of batch_size.
+
+    Rows are streamed through a named server-side cursor, declared WITH HOLD
+    so it survives the commit of each batch's status.
+    """
+    with conn.cursor(name="pending_images", withhold=True) as cursor:
+        cursor.itersize = batch_size
+        cursor.execute(
+            "SELECT id, url_source, label FROM plants_data "
+            "WHERE status <> 'done' OR sha256 IS NULL ORDER BY id;"
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+def load_hashes(conn):
+    """(id, sha256, dhash, near_duplicate_of) of the distinct images already ingested."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT id, sha256, dhash, near_duplicate_of FROM plants_data "
+            "WHERE sha256 IS NOT NULL AND duplicate_of IS NULL ORDER BY id;"
+        )
+        return cursor.fetchall()
+
+
+def save_status(conn, results):
+    """Write the STATUS_COLUMNS results of a batch in one statement."""
+    with conn.cursor() as cursor:
+        execute_values(
+            cursor,
+            f"""
+            UPDATE plants_data AS p
+            SET status = v.status,
+                size = v.size,
+                etag = v.etag,
+                error = v.error,
+                sha256 = v.sha256,
+                dhash = v.dhash,
+                duplicate_of = v.duplicate_of,
+                near_duplicate_of = v.near_duplicate_of,
+                downloaded_at = CASE WHEN v.status = 'done' THEN now() ELSE p.downloaded_at END
+            FROM (VALUES %s) AS v ({", ".join(STATUS_COLUMNS)})
+            WHERE p.id = v.id;
+            """,
+            results,
+            template="(%s, %s, %s::bigint, %s, %s, %s, %s::bigint, %s::integer, %s::integer)",
+        )
+    # Chaque lot validé est acquis : une exécution interrompue reprend au lot suivant
+    conn.commit()
+
+
+def object_name_for(img_id, label):
+    return f"{label}/{img_id:08d}.jpg"
+
+
+def list_existing_objects(client, bucket_name=BUCKET_NAME):
+    """Index {object name: (size, etag)} of the bucket, built with one recursive listing."""
+    return {
+        obj.object_name: (obj.size, obj.etag)
+        for obj in client.list_objects(bucket_name, recursive=True)
+        if not obj.is_dir
+    }
+
+
+def read_object(client, bucket_name, object_name, target):
+    response = client.get_object(bucket_name, object_name)
+    try:
+        return sha256_copy(response, target)
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def ingest_row(row, session, client, content_index, bucket_name=BUCKET_NAME, stored=None,
+               timeout=DOWNLOAD_TIMEOUT, part_size=UPLOAD_PART_SIZE):
+    """Download and hash one image, then upload it to MinIO unless its content is already there.
+
+    `stored` is the (size, etag) of the row's object when it is already in the
+    bucket: it is then read back from MinIO to be hashed. Returns a dict with
+    the status ("uploaded", "skipped" or "failed"), the bytes uploaded and the
+    values to save.
+    """
     img_id, url, label = row
-    object_name = f"{label}/{img_id:08d}.jpg"
+    result = {"id": img_id, "status": "failed", "bytes": 0, "size": None, "etag": None, "error": None,
+              "sha256": None, "dhash": None, "duplicate_of": None, "near_duplicate_of": None}
 
-    # Vérifie si l'objet existe déjà
-    found = False
     try:
-        client.stat_object(bucket_name, object_name)
-        found = True
-    except Exception:
-        pass
+        # Image gardée en mémoire (sur disque au-delà de part_size) le temps de calculer ses empreintes
+        with tempfile.SpooledTemporaryFile(max_size=part_size) as spool:
+            if stored is not None:
+                sha256 = read_object(client, bucket_name, object_name_for(img_id, label), spool)
+            else:
+                with session.get(url, timeout=timeout, stream=True) as response:
+                    if response.status_code != 200:
+                        result["error"] = f"HTTP {response.status_code}"
+                        return result
+                    response.raw.decode_content = True
+                    sha256 = sha256_copy(response.raw, spool)
+
+            size = spool.tell()
+            spool.seek(0)
+            dhash_value = dhash(spool)
+            duplicate_of, near_duplicate_of = content_index.claim(img_id, sha256, dhash_value)
+            result.update(size=size, sha256=sha256, dhash=dhash_value, duplicate_of=duplicate_of,
+                          near_duplicate_of=near_duplicate_of)
 
-    if found:
-        continue
+            if duplicate_of is not None:
+                # Contenu déjà dans le bucket sous le nom d'une autre image : pas d'upload
+                result.update(status="skipped", etag=stored[1] if stored is not None else None)
+                return result
+            try:
+                if stored is not None:
+                    result.update(status="skipped", etag=stored[1])
+                else:
+                    spool.seek(0)
+                    uploaded = client.put_object(
+                        bucket_name,
+                        object_name_for(img_id, label),
+                        spool,
+                        length=size,
+                        part_size=part_size,
+                        content_type="image/jpeg",
+                    )
+                    result.update(status="uploaded", bytes=size, etag=uploaded.etag)
+            except BaseException:
+                # Les images de même contenu en attente ne sont pas marquées doublons d'un échec
+                content_index.release(sha256)
+                raise
+            content_index.confirm(img_id, sha256)
+    except Exception as e:
+        result.update(status="failed", error=str(e))
+    return result
+
+
+def status_row(result):
+    # Ligne de STATUS_COLUMNS enregistrée pour une image
+    if result["status"] == "failed":
+        return (result["id"], "failed", None, None, result["error"], None, None, None, None)
+    return (
+        result["id"],
+        "done",
+        result["size"],
+        result["etag"],
+        None,
+        result["sha256"],
+        to_bigint(result["dhash"]),
+        result["duplicate_of"],
+        result["near_duplicate_of"],
+    )
+
+
+def ingest(batches, session, client, bucket_name=BUCKET_NAME, workers=DOWNLOAD_WORKERS, on_batch=None,
+           known_hashes=None):
+    """Ingest batches of rows concurrently and return a summary of the run.
+
+    `known_hashes` returns the hashes of the images ingested by earlier runs
+    (see load_hashes). `on_batch` receives the STATUS_COLUMNS rows of each
+    batch, with status "done" or "failed".
+    """
+    summary = {"uploaded": 0, "skipped": 0, "failed": 0, "duplicates": 0, "near_duplicates": 0, "bytes": 0,
+               "failures": [], "listing_seconds": 0.0}
+    start = time.perf_counter()
+    existing = None
+
+    # Upload direct dans MinIO sans stockage local, plusieurs images à la fois
+    with ThreadPoolExecutor(max_workers=workers) as pool, tqdm() as progress:
+        for rows in batches:
+            if existing is None:
+                # Un seul listing du bucket, et seulement s'il reste des images à traiter
+                listing_start = time.perf_counter()
+                existing = list_existing_objects(client, bucket_name)
+                summary["listing_seconds"] = time.perf_counter() - listing_start
+                content_index = ContentIndex(known_hashes() if known_hashes is not None else ())
+
+            futures = {}
+            for row in rows:
+                stored = existing.get(object_name_for(row[0], row[2]))
+                # Un objet vide (upload interrompu) est téléchargé à nouveau
+                if stored is not None and stored[0] <= 0:
+                    stored = None
+                futures[pool.submit(ingest_row, row, session, client, content_index, bucket_name, stored)] = row
+
+            results = []
+            for future in as_completed(futures):
+                result = future.result()
+                summary[result["status"]] += 1
+                summary["bytes"] += result["bytes"]
+                if result["status"] == "failed":
+                    summary["failures"].append((futures[future][1], result["error"]))
+                elif result["duplicate_of"] is not None:
+                    summary["duplicates"] += 1
+                elif result["near_duplicate_of"] is not None:
+                    summary["near_duplicates"] += 1
+                results.append(status_row(result))
+
+            if on_batch is not None:
+                on_batch(results)
+            progress.update(len(rows))
 
+    summary["seconds"] = time.perf_counter() - start
+    summary["images_per_second"] = summary["uploaded"] / summary["seconds"] if summary["seconds"] else 0.0
+    return summary
+
+
+def print_summary(summary, max_failures=20):
+    print(
+        f"Images envoyées : {summary['uploaded']}, déjà présentes : {summary['skipped']}, "
+        f"échecs : {summary['failed']}"
+    )
+    print(f"Doublons exacts : {summary['duplicates']}, quasi-doublons : {summary['near_duplicates']}")
+    print(
+        f"Durée : {summary['seconds']:.1f} s (listing du bucket : {summary['listing_seconds']:.1f} s), "
+        f"{summary['images_per_second']:.1f} images/s, "
+        f"{summary['bytes'] / 1024 ** 2:.1f} Mo"
+    )
+    for url, error in summary["failures"][:max_failures]:
+        print(f"Erreur : {url} => {error}")
+    if len(summary["failures"]) > max_failures:
+        print(f"... et {len(summary['failures']) - max_failures} autres erreurs")
+
+
+def main():
+    conn = connect_postgres()
     try:
-        response = requests.get(url, timeout=5)
-        if response.status_code == 200:
-            image_stream = BytesIO(response.content)
-            client.put_object(
-                bucket_name,
-                object_name,
-                image_stream,
-                length=len(response.content),
-                content_type="image/jpeg",
+        ensure_state_columns(conn)
+
+        client = create_minio_client()
+        if not client.bucket_exists(BUCKET_NAME):
+            client.make_bucket(BUCKET_NAME)
+
+        # Seules les lignes en attente ou en échec sont lues, par lots
+        with create_session() as session:
+            summary = ingest(
+                iter_pending_batches(conn),
+                session,
+                client,
+                on_batch=lambda results: save_status(conn, results),
+                known_hashes=lambda: load_hashes(conn),
             )
-    except Exception as e:
-        print(f"Erreur : {url} => {e}")
-        continue
+    finally:
+        conn.close()
+
+    print_summary(summary)
+    if summary["failed"]:
+        print(f"⚠️ {summary['failed']} images n'ont pas pu être envoyées dans MinIO.")
+    else:
+        print("✅ Toutes les images ont été envoyées dans MinIO sans stockage local.")
+    return summary
+
 
-print("✅ Toutes les images ont été envoyées dans MinIO sans stockage local.")
+if __name__ == "__main__":
+    main()
@@ -8,8 +8,9 @@ try:
     print(f"Contacting API at {API_RELOAD_URL} to reload model...")
     response = requests.post(API_RELOAD_URL, timeout=5)
 
-    if response.status_code == 200:
-        print("API responded with success. Model reloaded.")
+    # The API loads the new model in the background and swaps it atomically
+    if response.status_code in (200, 202):
+        print(f"API accepted the reload: {response.json()}")
     else:
         print(f"API responded with status code {response.status_code}: {response.text}")
 
@@ -1,4 +1,7 @@
+import io
+import json
 import os
+from datetime import datetime, timezone
 from minio import Minio
 from dotenv import load_dotenv
 
@@ -12,8 +15,9 @@ MODEL_PATH = "/opt/airflow/scripts/saved_models/export.pkl"
 MINIO_ENDPOINT = os.getenv("MLFLOW_S3_ENDPOINT_URL").replace("http://", "")
 ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
 SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-BUCKET_NAME = "models"
+BUCKET_NAME = os.getenv("MODEL_BUCKET", "models")
 OBJECT_NAME = MODEL_FILENAME
+MANIFEST_NAME = os.getenv("MODEL_MANIFEST_KEY", "latest.json")
 
 # === Check if model file exists ===
 if not os.path.exists(MODEL_PATH):
@@ -34,7 +38,7 @@ if not client.bucket_exists(BUCKET_NAME):
     client.make_bucket(BUCKET_NAME)
 
 # === Upload model to MinIO ===
-client.fput_object(
+result = client.fput_object(
     bucket_name=BUCKET_NAME,
     object_name=OBJECT_NAME,
     file_path=MODEL_PATH,
@@ -44,3 +48,20 @@ client.fput_object(
 print(
     f"Model '{MODEL_FILENAME}' successfully uploaded to MinIO in bucket '{BUCKET_NAME}' as object '{OBJECT_NAME}'"
 )
+
+# === Point the API to the new model ===
+# The API reads this small manifest instead of scanning every bucket
+manifest = json.dumps({
+    "key": OBJECT_NAME,
+    "etag": result.etag,
+    "uploaded_at": datetime.now(timezone.utc).isoformat(),
+}).encode()
+client.put_object(
+    bucket_name=BUCKET_NAME,
+    object_name=MANIFEST_NAME,
+    data=io.BytesIO(manifest),
+    length=len(manifest),
+    content_type="application/json"
+)
+
+print(f"Manifest '{MANIFEST_NAME}' now points to '{OBJECT_NAME}'")
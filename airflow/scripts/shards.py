@@ -0,0 +1,214 @@
+"""Packed, pre-resized uint8 image shards for training.
+
+Each image is decoded and resized once, with the validation-time fastai
+`Resize`, and packed with the other images of its shard: `<key>.images.npy`
+holds an (N, size, size, 3) uint8 array and `<key>.labels.npy` the (N,) class
+indices. The key hashes the shard members (id, label and sha256), the image
+size and the classes, so a shard is only rebuilt when its content changes; an
+unchanged shard is reused from the local directory or restored from MinIO.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+from fastai.vision.all import (
+    CategoryMap,
+    Categorize,
+    DataLoaders,
+    Datasets,
+    IntToFloatTensor,
+    ItemGetter,
+    Normalize,
+    PILImage,
+    Resize,
+    TensorCategory,
+    TensorImage,
+    ToTensor,
+    imagenet_stats,
+)
+
+# Images par shard (224 x 224 x 3 octets chacune) et emplacements local / MinIO
+SHARD_SIZE = int(os.getenv("SHARD_SIZE", "1024"))
+DATASET_SHARDS_DIR = os.getenv("DATASET_SHARDS_DIR") or "/opt/airflow/data/shards"
+SHARDS_BUCKET = os.getenv("SHARDS_BUCKET", "shards")
+
+INDEX_NAME = "index.json"
+
+
+def shard_files(key):
+    return f"{key}.images.npy", f"{key}.labels.npy"
+
+
+def plan_shards(rows, classes, size, shard_size=SHARD_SIZE):
+    """Split the (id, label, group, sha256) index rows into shards, in id order.
+
+    New images get new ids, so between two runs only the last shard usually changes.
+    """
+    rows = sorted(rows)
+    plan = []
+    for start in range(0, len(rows), shard_size):
+        members = rows[start:start + shard_size]
+        key = hashlib.sha256(
+            json.dumps([size, list(classes), [(img_id, label, sha256) for img_id, label, _, sha256 in members]]).encode()
+        ).hexdigest()[:24]
+        plan.append(
+            {
+                "key": key,
+                "ids": [img_id for img_id, _, _, _ in members],
+                "labels": [classes.index(label) for _, label, _, _ in members],
+            }
+        )
+    return plan
+
+
+def load_image(path, size):
+    # Même recadrage central et redimensionnement que fastai en validation
+    return np.asarray(Resize(size)(PILImage.create(path), split_idx=1))
+
+
+def build_shard(shard, paths, shard_dir, size):
+    """Decode and resize the shard images into its packed arrays."""
+    images_name, labels_name = shard_files(shard["key"])
+    images_path = os.path.join(shard_dir, images_name)
+
+    # Écriture directe dans le fichier (sans tout garder en mémoire), puis renommage
+    images = np.lib.format.open_memmap(
+        images_path + ".part", mode="w+", dtype=np.uint8, shape=(len(paths), size, size, 3)
+    )
+    for i, path in enumerate(paths):
+        images[i] = load_image(path, size)
+    images.flush()
+    del images
+    os.replace(images_path + ".part", images_path)
+
+    labels_path = os.path.join(shard_dir, labels_name)
+    with open(labels_path + ".part", "wb") as f:
+        np.save(f, np.asarray(shard["labels"], dtype=np.int64))
+    os.replace(labels_path + ".part", labels_path)
+
+
+def write_index(shard_dir, plan, classes, size):
+    path = os.path.join(shard_dir, INDEX_NAME)
+    with open(path + ".part", "w") as f:
+        json.dump({"size": size, "classes": list(classes), "shards": plan}, f)
+    os.replace(path + ".part", path)
+    return path
+
+
+def sync_shards(plan, image_path, minio_client, classes, size, shard_dir=None, bucket_name=SHARDS_BUCKET):
+    """Make every shard of the plan available in shard_dir and in the MinIO bucket.
+
+    Local shards are reused, missing ones are downloaded from MinIO or built
+    from the images (`image_path(id)` gives the local file of an image), and
+    shards that are no longer in the plan are deleted on both sides.
+    Returns the shard directory.
+    """
+    shard_dir = shard_dir or DATASET_SHARDS_DIR
+    os.makedirs(shard_dir, exist_ok=True)
+    if not minio_client.bucket_exists(bucket_name):
+        minio_client.make_bucket(bucket_name)
+    remote = {obj.object_name for obj in minio_client.list_objects(bucket_name, recursive=True)}
+
+    stats = {"local": 0, "restored": 0, "built": 0, "images": 0}
+    wanted = {INDEX_NAME}
+    for shard in plan:
+        names = shard_files(shard["key"])
+        wanted.update(names)
+        if all(os.path.exists(os.path.join(shard_dir, name)) for name in names):
+            stats["local"] += 1
+        elif all(name in remote for name in names):
+            for name in names:
+                minio_client.fget_object(bucket_name, name, os.path.join(shard_dir, name))
+            stats["restored"] += 1
+        else:
+            build_shard(shard, [image_path(img_id) for img_id in shard["ids"]], shard_dir, size)
+            stats["built"] += 1
+            stats["images"] += len(shard["ids"])
+        for name in set(names) - remote:
+            minio_client.fput_object(bucket_name, name, os.path.join(shard_dir, name))
+
+    index_path = write_index(shard_dir, plan, classes, size)
+    minio_client.fput_object(bucket_name, INDEX_NAME, index_path, content_type="application/json")
+
+    # Shards d'une version précédente du jeu de données
+    for name in remote - wanted:
+        minio_client.remove_object(bucket_name, name)
+    for name in set(os.listdir(shard_dir)) - wanted:
+        os.remove(os.path.join(shard_dir, name))
+
+    print(
+        f"Shards : {stats['local']} locaux, {stats['restored']} restaurés depuis MinIO, "
+        f"{stats['built']} construits ({stats['images']} images décodées)"
+    )
+    return shard_dir
+
+
+class ShardDataset(torch.utils.data.Dataset):
+    """Memory-mapped view of the shard images whose id is in `ids` (all if None).
+
+    Items are (uint8 CHW TensorImage, TensorCategory) pairs; only the pages
+    of the images read are loaded from disk.
+    """
+
+    def __init__(self, shard_dir, plan, ids=None):
+        self.shard_dir = shard_dir
+        self.keys = [shard["key"] for shard in plan]
+        self.positions = []
+        self.labels = []
+        for s, shard in enumerate(plan):
+            labels = np.load(os.path.join(shard_dir, shard_files(shard["key"])[1]))
+            for i, img_id in enumerate(shard["ids"]):
+                if ids is None or img_id in ids:
+                    self.positions.append((s, i))
+                    self.labels.append(int(labels[i]))
+        # Ouverture paresseuse : chaque processus (worker du DataLoader) a ses propres mmaps
+        self.arrays = None
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        if self.arrays is None:
+            self.arrays = [
+                np.load(os.path.join(self.shard_dir, shard_files(key)[0]), mmap_mode="r") for key in self.keys
+            ]
+        s, i = self.positions[index]
+        image = torch.from_numpy(np.array(self.arrays[s][i])).permute(2, 0, 1)
+        return TensorImage(image), TensorCategory(self.labels[index])
+
+
+def shard_dataloaders(shard_dir, plan, classes, valid_ids, bs=32, num_workers=0):
+    """Training DataLoaders reading the shards, with the transforms of ImageDataLoaders."""
+    all_ids = {img_id for shard in plan for img_id in shard["ids"]}
+    dls = DataLoaders.from_dsets(
+        ShardDataset(shard_dir, plan, all_ids - set(valid_ids)),
+        ShardDataset(shard_dir, plan, set(valid_ids)),
+        bs=bs,
+        num_workers=num_workers,
+        after_batch=[IntToFloatTensor(), Normalize.from_stats(*imagenet_stats)],
+    )
+    dls.c = len(classes)
+    dls.vocab = CategoryMap(list(classes), sort=False)
+    return dls
+
+
+def serving_dataloaders(classes, size):
+    """DataLoaders equivalent to ImageDataLoaders(item_tfms=Resize(size)), without data.
+
+    They replace the shard DataLoaders before `Learner.export`: the exported
+    model then predicts on PIL images and does not depend on this module.
+    """
+    item = (np.zeros((size, size, 3), dtype=np.uint8), classes[0])
+    dsets = Datasets(
+        [item],
+        tfms=[[ItemGetter(0), PILImage.create], [ItemGetter(1), Categorize(vocab=list(classes))]],
+        splits=([0], [0]),
+    )
+    return dsets.dataloaders(
+        after_item=[Resize(size), ToTensor()],
+        after_batch=[IntToFloatTensor(), Normalize.from_stats(*imagenet_stats)],
+        bs=1,
+    )
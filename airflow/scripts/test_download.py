@@ -0,0 +1,382 @@
+import hashlib
+import io
+import threading
+import time
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock, patch
+
+import pytest
+from PIL import Image
+
+from download import (
+    ContentIndex,
+    create_session,
+    dhash,
+    ingest,
+    iter_pending_batches,
+    list_existing_objects,
+    main,
+    object_name_for,
+    save_status,
+)
+
+
+# === FIXTURES ===
+
+
+class FakeMinio:
+    """In-memory stand-in for the MinIO client."""
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+        self.buckets = set()
+        self.lock = threading.Lock()
+        self.listings = 0
+        self.put_sizes = []
+
+    def bucket_exists(self, bucket_name):
+        return bucket_name in self.buckets
+
+    def make_bucket(self, bucket_name):
+        self.buckets.add(bucket_name)
+
+    def list_objects(self, bucket_name, recursive=False):
+        self.listings += 1
+        for (bucket, name), data in sorted(self.objects.items()):
+            if bucket == bucket_name:
+                yield SimpleNamespace(object_name=name, size=len(data), etag=f"etag-{name}", is_dir=False)
+
+    def get_object(self, bucket_name, object_name):
+        response = MagicMock()
+        response.read.side_effect = io.BytesIO(self.objects[(bucket_name, object_name)]).read
+        return response
+
+    def stat_object(self, bucket_name, object_name):
+        raise AssertionError("Existence must be checked against the bucket listing")
+
+    def put_object(self, bucket_name, object_name, data, length, part_size=0, content_type=None):
+        # Lecture par parts, comme le client MinIO
+        chunks = []
+        while True:
+            chunk = data.read(part_size or length)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        with self.lock:
+            self.put_sizes.append(length)
+            self.objects[(bucket_name, object_name)] = b"".join(chunks)
+        return SimpleNamespace(etag=f"etag-{object_name}")
+
+
+def gradient_png(tweak=0):
+    # Dégradé horizontal ; tweak modifie un pixel sans changer l'allure de l'image
+    img = Image.new("L", (64, 64))
+    img.putdata([x * 4 for _ in range(64) for x in range(64)])
+    img.putpixel((0, 0), tweak)
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    # /ok/<n> : image, /flaky/<n> : 503 au premier appel, /missing/<n> : 404,
+    # /stream/<n> : image sans Content-Length, /gradient/<n> : PNG légèrement différent selon n
+    attempts = {}
+
+    def do_GET(self):
+        attempts = self.attempts.setdefault(self.path, 0) + 1
+        self.attempts[self.path] = attempts
+        if self.path.startswith("/missing") or (self.path.startswith("/flaky") and attempts == 1):
+            self.send_response(404 if self.path.startswith("/missing") else 503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path.startswith("/gradient"):
+            body = gradient_png(int(self.path.rsplit("/", 1)[1]))
+        else:
+            body = f"jpeg{self.path}".encode()
+        self.send_response(200)
+        if not self.path.startswith("/stream"):
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def image_server():
+    ImageHandler.attempts = {}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def session():
+    with create_session(pool_size=4, retries=2, backoff=0) as session:
+        yield session
+
+
+# === TESTS ===
+
+
+def test_object_name_for():
+    assert object_name_for(42, "grass") == "grass/00000042.jpg"
+
+
+def test_ingest_uploads_concurrently(image_server, session):
+    rows = [(i, f"{image_server}/ok/{i}", "dandelion" if i % 2 else "grass") for i in range(20)]
+    client = FakeMinio()
+
+    summary = ingest([rows[:8], rows[8:]], session, client, workers=4)
+
+    assert summary["uploaded"] == 20
+    assert summary["failed"] == 0
+    assert client.objects[("images", "dandelion/00000001.jpg")] == b"jpeg/ok/1"
+    assert summary["bytes"] == sum(len(f"jpeg/ok/{i}") for i in range(20))
+
+
+def test_ingest_retries_and_reports_failures(image_server, session):
+    rows = [
+        (1, f"{image_server}/flaky/1", "grass"),
+        (2, f"{image_server}/missing/2", "grass"),
+        (3, "http://127.0.0.1:1/unreachable", "grass"),
+    ]
+    client = FakeMinio()
+
+    summary = ingest([rows], session, client, workers=2)
+
+    # La 503 est réessayée, la 404 et l'hôte injoignable sont comptés en échec
+    assert summary["uploaded"] == 1
+    assert ImageHandler.attempts["/flaky/1"] == 2
+    assert summary["failed"] == 2
+    assert sorted(url for url, _ in summary["failures"]) == [
+        "http://127.0.0.1:1/unreachable",
+        f"{image_server}/missing/2",
+    ]
+
+
+def test_list_existing_objects():
+    client = FakeMinio({("images", "grass/00000001.jpg"): b"abc", ("other", "x.jpg"): b"x"})
+    assert list_existing_objects(client) == {"grass/00000001.jpg": (3, "etag-grass/00000001.jpg")}
+
+
+def test_ingest_unchanged_bucket_is_a_single_listing(session):
+    rows = [(i, f"http://example.invalid/{i}.jpg", "grass") for i in range(5)]
+    client = FakeMinio({("images", object_name_for(i, "grass")): f"jpeg{i}".encode() for i in range(5)})
+
+    with patch.object(session, "get") as mock_get:
+        summary = ingest([rows], session, client)
+
+    mock_get.assert_not_called()
+    assert client.listings == 1
+    assert summary["skipped"] == 5
+    assert summary["uploaded"] == 0
+
+
+def test_ingest_downloads_empty_objects_again(image_server, session):
+    client = FakeMinio({("images", "grass/00000001.jpg"): b""})
+    summary = ingest([[(1, f"{image_server}/ok/1", "grass")]], session, client)
+    assert summary["uploaded"] == 1
+    assert client.objects[("images", "grass/00000001.jpg")] == b"jpeg/ok/1"
+
+
+def test_ingest_uploads_streamed_image_with_known_length(image_server, session):
+    client = FakeMinio()
+    summary = ingest([[(1, f"{image_server}/stream/1", "grass")]], session, client)
+
+    assert summary["uploaded"] == 1
+    assert summary["bytes"] == len(b"jpeg/stream/1")
+    assert client.objects[("images", "grass/00000001.jpg")] == b"jpeg/stream/1"
+    # Image lue entièrement pour l'empreinte : sa taille est connue à l'upload
+    assert client.put_sizes == [len(b"jpeg/stream/1")]
+
+
+def test_ingest_reports_status_per_batch(image_server, session):
+    batches = [
+        [(1, f"{image_server}/ok/1", "grass"), (2, f"{image_server}/missing/2", "grass")],
+        [(3, f"{image_server}/ok/3", "grass")],
+    ]
+    client = FakeMinio({("images", "grass/00000003.jpg"): b"jpeg"})
+    saved = []
+
+    summary = ingest(batches, session, client, workers=2, on_batch=saved.append)
+
+    assert len(saved) == 2
+    assert sorted(saved[0]) == [
+        (1, "done", len(b"jpeg/ok/1"), "etag-grass/00000001.jpg", None, sha256(b"jpeg/ok/1"), None, None, None),
+        (2, "failed", None, None, "HTTP 404", None, None, None, None),
+    ]
+    # Objet déjà présent : relu depuis MinIO pour ses empreintes, sans nouvel upload
+    assert saved[1] == [(3, "done", 4, "etag-grass/00000003.jpg", None, sha256(b"jpeg"), None, None, None)]
+    assert summary["skipped"] == 1
+    assert client.objects[("images", "grass/00000003.jpg")] == b"jpeg"
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_dhash_ignores_small_changes():
+    original = dhash(io.BytesIO(gradient_png(0)))
+    assert original is not None
+    assert bin(original ^ dhash(io.BytesIO(gradient_png(255)))).count("1") <= 2
+    assert dhash(io.BytesIO(b"not an image")) is None
+
+
+def test_content_index_groups_near_duplicates():
+    index = ContentIndex([(1, "a", -1, None)], max_distance=3)
+
+    # Même contenu : doublon exact de l'image 1
+    assert index.claim(2, "a", 0) == (1, None)
+    # dHash à 3 bits de l'image 1 (BIGINT signé -1 : tous les bits à 1)
+    assert index.claim(3, "b", (1 << 64) - 1 - 0b111) == (None, 1)
+    # Trop éloigné : nouveau groupe
+    assert index.claim(4, "c", 0) == (None, None)
+    assert index.claim(5, "d", 0b1) == (None, 4)
+    # Sans dHash (image illisible), seul le doublon exact est détecté
+    assert index.claim(6, "e", None) == (None, None)
+
+
+def test_ingest_skips_exact_duplicates_and_flags_near_duplicates(image_server, session):
+    rows = [
+        (1, f"{image_server}/gradient/0", "grass"),
+        (2, f"{image_server}/gradient/0", "grass"),
+        (3, f"{image_server}/gradient/255", "grass"),
+    ]
+    client = FakeMinio()
+    saved = []
+
+    summary = ingest([rows[:1], rows[1:]], session, client, on_batch=saved.extend)
+
+    results = {row[0]: row for row in saved}
+    assert results[2][7] == 1
+    assert results[3][7] is None and results[3][8] == 1
+    # Le doublon exact n'est pas envoyé, le quasi-doublon l'est
+    assert ("images", "grass/00000002.jpg") not in client.objects
+    assert ("images", "grass/00000003.jpg") in client.objects
+    assert summary["uploaded"] == 2
+    assert summary["duplicates"] == 1
+    assert summary["near_duplicates"] == 1
+
+
+def test_duplicate_waits_for_original_upload(image_server, session):
+    class FailingMinio(FakeMinio):
+        failed = False
+
+        def put_object(self, bucket_name, object_name, data, length, part_size=0, content_type=None):
+            if not self.failed:
+                # Premier upload : laisse le doublon arriver pendant l'envoi, puis échoue
+                self.failed = True
+                time.sleep(0.2)
+                raise IOError("upload interrupted")
+            return super().put_object(bucket_name, object_name, data, length, part_size, content_type)
+
+    rows = [(1, f"{image_server}/gradient/0", "grass"), (2, f"{image_server}/gradient/0", "grass")]
+    client = FailingMinio()
+    saved = []
+
+    summary = ingest([rows], session, client, workers=2, on_batch=saved.extend)
+
+    failed = [row for row in saved if row[1] == "failed"]
+    done = [row for row in saved if row[1] == "done"]
+    assert len(failed) == 1 and len(done) == 1
+    # L'original a échoué : la copie est envoyée à sa place, sans être marquée doublon
+    assert done[0][7] is None
+    assert ("images", f"grass/{done[0][0]:08d}.jpg") in client.objects
+    assert summary["duplicates"] == 0
+
+
+def test_content_index_release_hands_over_to_waiting_duplicate():
+    index = ContentIndex()
+    assert index.claim(1, "a", None) == (None, None)
+
+    claims = []
+    waiter = threading.Thread(target=lambda: claims.append(index.claim(2, "a", None)))
+    waiter.start()
+    waiter.join(timeout=0.1)
+    # Original en cours d'upload : le doublon attend
+    assert waiter.is_alive()
+
+    index.release("a")
+    waiter.join(timeout=5)
+    assert claims == [(None, None)]
+    index.confirm(2, "a")
+    assert index.claim(3, "a", None) == (2, None)
+
+
+def test_ingest_checks_hashes_of_earlier_runs(image_server, session):
+    known = [(7, sha256(b"jpeg/ok/1"), None, None)]
+    saved = []
+
+    summary = ingest([[(1, f"{image_server}/ok/1", "grass")]], session, FakeMinio(), on_batch=saved.extend,
+                     known_hashes=lambda: known)
+
+    assert summary["duplicates"] == 1
+    assert saved[0][7] == 7
+
+
+def test_ingest_without_pending_rows_skips_listing(session):
+    client = FakeMinio()
+    summary = ingest(iter([]), session, client)
+    assert client.listings == 0
+    assert summary["uploaded"] == 0
+
+
+def test_iter_pending_batches_uses_server_side_cursor():
+    conn = MagicMock()
+    cursor = conn.cursor.return_value.__enter__.return_value
+    cursor.fetchmany.side_effect = [[(1, "a", "grass"), (2, "b", "grass")], [(3, "c", "grass")], []]
+
+    batches = list(iter_pending_batches(conn, batch_size=2))
+
+    assert batches == [[(1, "a", "grass"), (2, "b", "grass")], [(3, "c", "grass")]]
+    conn.cursor.assert_called_once_with(name="pending_images", withhold=True)
+    assert cursor.itersize == 2
+    query = cursor.execute.call_args[0][0]
+    assert "status <> 'done' OR sha256 IS NULL" in query
+    cursor.fetchall.assert_not_called()
+
+
+def test_save_status_bulk_update_then_commit():
+    conn = MagicMock()
+    results = [
+        (1, "done", 10, "etag", None, "ab12", -5, None, None),
+        (2, "failed", None, None, "HTTP 404", None, None, None, None),
+    ]
+
+    with patch("download.execute_values") as mock_execute_values:
+        save_status(conn, results)
+
+    # Une seule requête UPDATE ... FROM (VALUES ...) pour tout le lot
+    mock_execute_values.assert_called_once()
+    _, query, values = mock_execute_values.call_args[0]
+    assert "UPDATE plants_data" in query
+    assert values == results
+    conn.commit.assert_called_once()
+
+
+def test_main_runs_full_pipeline(image_server):
+    client = FakeMinio()
+    with patch("download.connect_postgres") as mock_connect, patch(
+        "download.create_minio_client", return_value=client
+    ), patch("download.execute_values") as mock_execute_values:
+        cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchmany.side_effect = [[(1, f"{image_server}/ok/1", "grass")], []]
+        cursor.fetchall.return_value = []
+        summary = main()
+
+    assert summary["uploaded"] == 1
+    assert "images" in client.buckets
+    # Colonnes d'état créées, puis statut du lot enregistré
+    assert "ADD COLUMN IF NOT EXISTS status" in cursor.execute.call_args_list[0][0][0]
+    assert mock_execute_values.call_args[0][2] == [
+        (1, "done", len(b"jpeg/ok/1"), "etag-grass/00000001.jpg", None, sha256(b"jpeg/ok/1"), None, None, None)
+    ]
+    mock_connect.return_value.close.assert_called_once()
@@ -0,0 +1,171 @@
+import os
+import shutil
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from shards import (
+    ShardDataset,
+    load_image,
+    plan_shards,
+    serving_dataloaders,
+    shard_dataloaders,
+    shard_files,
+    sync_shards,
+)
+
+
+# === FIXTURES ===
+
+
+class FakeMinio:
+    """In-memory stand-in for the MinIO client (shards bucket)."""
+
+    def __init__(self):
+        self.objects = {}
+        self.buckets = set()
+        self.uploads = []
+
+    def bucket_exists(self, bucket_name):
+        return bucket_name in self.buckets
+
+    def make_bucket(self, bucket_name):
+        self.buckets.add(bucket_name)
+
+    def list_objects(self, bucket_name, recursive=False):
+        return [SimpleNamespace(object_name=name) for bucket, name in self.objects if bucket == bucket_name]
+
+    def fput_object(self, bucket_name, object_name, file_path, content_type=None):
+        with open(file_path, "rb") as f:
+            self.objects[(bucket_name, object_name)] = f.read()
+        self.uploads.append(object_name)
+
+    def fget_object(self, bucket_name, object_name, file_path):
+        with open(file_path, "wb") as f:
+            f.write(self.objects[(bucket_name, object_name)])
+
+    def remove_object(self, bucket_name, object_name):
+        del self.objects[(bucket_name, object_name)]
+
+
+@pytest.fixture
+def images(tmp_path):
+    # Images de tailles et couleurs différentes ; id -> chemin
+    paths = {}
+    for img_id in range(1, 6):
+        path = tmp_path / "images" / f"{img_id:08d}.jpg"
+        path.parent.mkdir(exist_ok=True)
+        Image.new("RGB", (40 + img_id * 10, 30), color=(img_id * 40, 0, 0)).save(path)
+        paths[img_id] = str(path)
+    return paths
+
+
+def index_rows(ids):
+    return [(img_id, "dandelion" if img_id % 2 else "grass", img_id, f"sha{img_id}") for img_id in ids]
+
+
+CLASSES = ["dandelion", "grass"]
+
+
+# === TESTS ===
+
+
+def test_plan_shards_only_changes_last_shard_on_append():
+    before = plan_shards(index_rows(range(1, 6)), CLASSES, 16, shard_size=2)
+    after = plan_shards(index_rows(range(1, 8)), CLASSES, 16, shard_size=2)
+
+    assert [shard["ids"] for shard in before] == [[1, 2], [3, 4], [5]]
+    assert [shard["key"] for shard in after[:2]] == [shard["key"] for shard in before[:2]]
+    assert after[2]["key"] != before[2]["key"]
+    assert after[0]["labels"] == [0, 1]
+    # Autre taille d'image : tous les shards changent
+    assert plan_shards(index_rows(range(1, 3)), CLASSES, 32, shard_size=2)[0]["key"] != before[0]["key"]
+
+
+def test_plan_shards_key_changes_with_label():
+    rows = index_rows(range(1, 5))
+    relabeled = [(1, "grass", 1, "sha1")] + rows[1:]
+
+    before = plan_shards(rows, CLASSES, 16, shard_size=2)
+    after = plan_shards(relabeled, CLASSES, 16, shard_size=2)
+
+    # Même image, nouveau label : le shard est reconstruit avec le bon tableau de labels
+    assert after[0]["key"] != before[0]["key"]
+    assert after[0]["labels"] == [1, 1]
+    assert after[1]["key"] == before[1]["key"]
+
+
+def test_sync_shards_builds_then_reuses(tmp_path, images):
+    client = FakeMinio()
+    shard_dir = str(tmp_path / "shards")
+    plan = plan_shards(index_rows(images), CLASSES, 16, shard_size=2)
+
+    sync_shards(plan, images.__getitem__, client, CLASSES, 16, shard_dir=shard_dir)
+
+    arrays = np.load(os.path.join(shard_dir, shard_files(plan[0]["key"])[0]), mmap_mode="r")
+    assert arrays.shape == (2, 16, 16, 3) and arrays.dtype == np.uint8
+    np.testing.assert_array_equal(arrays[1], load_image(images[2], 16))
+    assert ("shards", "index.json") in client.objects
+    assert len(client.uploads) == 7
+
+    # Deuxième exécution : rien n'est décodé ni envoyé à nouveau
+    client.uploads.clear()
+    sync_shards(plan, lambda img_id: pytest.fail("image decoded again"), client, CLASSES, 16, shard_dir=shard_dir)
+    assert client.uploads == ["index.json"]
+
+
+def test_sync_shards_restores_from_minio_and_prunes(tmp_path, images):
+    client = FakeMinio()
+    shard_dir = str(tmp_path / "shards")
+    old_plan = plan_shards(index_rows([1, 2, 3]), CLASSES, 16, shard_size=2)
+    sync_shards(old_plan, images.__getitem__, client, CLASSES, 16, shard_dir=shard_dir)
+    shutil.rmtree(shard_dir)
+
+    # Nouvelle machine : le premier shard vient de MinIO, le second (modifié) est reconstruit
+    plan = plan_shards(index_rows([1, 2, 4]), CLASSES, 16, shard_size=2)
+    sync_shards(plan, images.__getitem__, client, CLASSES, 16, shard_dir=shard_dir)
+
+    expected = {"index.json", *shard_files(plan[0]["key"]), *shard_files(plan[1]["key"])}
+    assert set(os.listdir(shard_dir)) == expected
+    assert {name for _, name in client.objects} == expected
+
+
+def test_shard_dataset_reads_memory_mapped_items(tmp_path, images):
+    shard_dir = str(tmp_path / "shards")
+    plan = plan_shards(index_rows(images), CLASSES, 16, shard_size=2)
+    sync_shards(plan, images.__getitem__, FakeMinio(), CLASSES, 16, shard_dir=shard_dir)
+
+    dataset = ShardDataset(shard_dir, plan, ids={2, 5})
+    assert len(dataset) == 2
+    image, label = dataset[1]
+    assert image.shape == (3, 16, 16) and image.dtype == torch.uint8
+    assert torch.equal(image, torch.from_numpy(np.array(load_image(images[5], 16))).permute(2, 0, 1))
+    assert int(label) == 0
+
+
+def test_shard_dataloaders_split_and_normalize(tmp_path, images):
+    shard_dir = str(tmp_path / "shards")
+    plan = plan_shards(index_rows(images), CLASSES, 16, shard_size=2)
+    sync_shards(plan, images.__getitem__, FakeMinio(), CLASSES, 16, shard_dir=shard_dir)
+
+    dls = shard_dataloaders(shard_dir, plan, CLASSES, valid_ids={1, 2}, bs=2)
+
+    assert len(dls.train_ds) == 3 and len(dls.valid_ds) == 2
+    assert dls.c == 2 and list(dls.vocab) == CLASSES
+    x, y = dls.valid.one_batch()
+    assert x.shape == (2, 3, 16, 16) and x.dtype == torch.float32
+    assert y.tolist() == [0, 1]
+
+
+def test_serving_dataloaders_match_image_dataloaders():
+    dls = serving_dataloaders(CLASSES, 224)
+
+    assert list(dls.vocab) == CLASSES
+    assert [type(tfm).__name__ for tfm in dls.after_item.fs] == ["Resize", "ToTensor"]
+    assert "Normalize" in [type(tfm).__name__ for tfm in dls.after_batch.fs]
+    # Prédiction sur une image PIL, comme dans l'API
+    batch = dls.test_dl([Image.new("RGB", (300, 200))]).one_batch()[0]
+    assert batch.shape == (1, 3, 224, 224)
@@ -1,3 +1,5 @@
+import io
+import json
 import pytest
 from unittest.mock import Mock, patch, MagicMock
 import os
@@ -6,12 +8,36 @@ import torch
 from PIL import Image
 import tempfile
 
-from train import download_minio_dataset, main
+from train import download_minio_dataset, group_split, load_image_index, main
 
 
 # === FIXTURES ===
 
 
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path):
+    with patch("train.DATASET_CACHE_DIR", str(tmp_path / "cache")):
+        yield str(tmp_path / "cache")
+
+
+def bucket_object(name, data, etag=None):
+    return Mock(object_name=name, etag=etag or f"etag-{data.decode()}", size=len(data))
+
+
+def serve_objects(mock_client, objects):
+    # Réponses get_object lues par morceaux, comme les flux MinIO
+    mock_client.list_objects.side_effect = lambda *args, **kwargs: [
+        bucket_object(name, data) for name, data in objects.items()
+    ]
+
+    def get_object(bucket_name, object_name):
+        response = MagicMock()
+        response.read.side_effect = io.BytesIO(objects[object_name]).read
+        return response
+
+    mock_client.get_object.side_effect = get_object
+
+
 @pytest.fixture
 def mock_minio():
     with patch("train.Minio") as mock:
@@ -30,9 +56,7 @@ def mock_mlflow():
 
 @pytest.fixture
 def mock_fastai():
-    with patch("train.ImageDataLoaders.from_folder"), patch(
-        "train.cnn_learner"
-    ) as mock_learner:
+    with patch("train.ImageDataLoaders.from_folder"), patch("train.cnn_learner") as mock_learner:
         learner = MagicMock()
         learner.validate.return_value = [None, 0.92]
         learner.get_preds.return_value = (
@@ -65,19 +89,13 @@ def test_download_minio_dataset_success(mock_getenv, mock_minio, temp_image_dir)
         "AWS_ACCESS_KEY_ID": "fake_access_key",
         "AWS_SECRET_ACCESS_KEY": "fake_secret_key",
     }.get(key, "")
-    mock_client = mock_minio.return_value
-    mock_client.list_objects.return_value = [
-        Mock(object_name="dandelion/img1.jpg"),
-        Mock(object_name="grass/img2.jpg"),
-    ]
-    obj = MagicMock()
-    obj.read.return_value = b"fake_image_data"
-    obj.close.return_value = None
-    mock_client.get_object.return_value = obj
+    serve_objects(mock_minio.return_value, {"dandelion/img1.jpg": b"fake_image_data", "grass/img2.jpg": b"data"})
 
     path = download_minio_dataset()
     assert os.path.exists(path)
-    assert set(os.listdir(path)) == {"dandelion", "grass"}
+    assert set(os.listdir(path)) == {"dandelion", "grass", ".manifest.json"}
+    with open(os.path.join(path, "dandelion", "img1.jpg"), "rb") as f:
+        assert f.read() == b"fake_image_data"
 
 
 @patch("train.os.getenv")
@@ -92,11 +110,12 @@ def test_download_minio_dataset_empty_bucket(mock_getenv, mock_minio):
 
     path = download_minio_dataset()
     assert os.path.exists(path)
-    assert len(os.listdir(path)) == 0
+    assert os.listdir(path) == [".manifest.json"]
 
 
+@patch("train.load_image_index", return_value=[])
 @patch("train.os.getenv")
-def test_main_flow(mock_getenv, mock_minio, mock_mlflow, mock_fastai):
+def test_main_flow(mock_getenv, mock_index, mock_minio, mock_mlflow, mock_fastai):
     mock_getenv.side_effect = lambda key: {
         "MLFLOW_API": "http://fake-mlflow:5001",
         "MLFLOW_S3_ENDPOINT_URL": "http://fake-minio:9000",
@@ -104,13 +123,7 @@ def test_main_flow(mock_getenv, mock_minio, mock_mlflow, mock_fastai):
         "AWS_SECRET_ACCESS_KEY": "fake_secret_key",
     }.get(key, "")
 
-    mock_minio.return_value.list_objects.return_value = [
-        Mock(object_name="dandelion/img1.jpg")
-    ]
-    obj = MagicMock()
-    obj.read.return_value = b"fake_data"
-    obj.close.return_value = None
-    mock_minio.return_value.get_object.return_value = obj
+    serve_objects(mock_minio.return_value, {"dandelion/img1.jpg": b"fake_data"})
 
     main()
 
@@ -146,3 +159,126 @@ def test_tempdir_cleanup_on_error(mock_getenv):
                 except Exception:
                     pass
                 assert os.path.exists(temp_dir)
+
+
+@patch("train.os.getenv")
+def test_download_minio_dataset_include(mock_getenv, mock_minio):
+    mock_getenv.side_effect = lambda key: {
+        "MLFLOW_S3_ENDPOINT_URL": "http://fake-minio:9000",
+    }.get(key, "")
+    mock_client = mock_minio.return_value
+    serve_objects(mock_client, {"grass/00000001.jpg": b"data", "grass/00000002.jpg": b"data"})
+
+    path = download_minio_dataset(include={"grass/00000001.jpg"})
+
+    # Le doublon exact n'est pas téléchargé
+    mock_client.get_object.assert_called_once_with("images", "grass/00000001.jpg")
+    assert os.listdir(os.path.join(path, "grass")) == ["00000001.jpg"]
+
+
+def test_load_image_index_excludes_duplicates():
+    with patch("train.connect_postgres") as mock_connect:
+        cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [(1, "grass", 1, "ab12")]
+        assert load_image_index() == [(1, "grass", 1, "ab12")]
+
+    query = cursor.execute.call_args[0][0]
+    assert "duplicate_of IS NULL" in query
+    assert "COALESCE(near_duplicate_of, id)" in query
+    mock_connect.return_value.close.assert_called_once()
+
+
+def test_group_split_keeps_groups_together():
+    # Groupes de quasi-doublons de tailles variées
+    rows = [(i, "grass", i - i % 5 if i < 50 else i, f"sha{i}") for i in range(200)]
+
+    valid_ids = group_split(rows, valid_pct=0.2, seed=0)
+
+    assert 40 <= len(valid_ids) < 45
+    for group in {row[2] for row in rows}:
+        members = {img_id for img_id, _, g, _ in rows if g == group}
+        assert members <= valid_ids or not members & valid_ids
+    # Même graine, même répartition
+    assert group_split(rows, valid_pct=0.2, seed=0) == valid_ids
+
+
+@patch("train.load_image_index", return_value=[(1, "dandelion", 1, "a"), (2, "grass", 2, "b"), (3, "grass", 3, "c")])
+@patch("train.os.getenv")
+def test_main_flow_trains_on_shards(mock_getenv, mock_index, mock_minio, mock_mlflow, mock_fastai):
+    mock_getenv.side_effect = lambda key: {"MLFLOW_S3_ENDPOINT_URL": "http://fake-minio:9000"}.get(key, "")
+    # L'image 3 manque dans le bucket : elle est écartée
+    serve_objects(mock_minio.return_value, {"dandelion/00000001.jpg": b"a", "grass/00000002.jpg": b"b"})
+
+    with patch("train.sync_shards", return_value="/shards") as mock_sync, patch(
+        "train.shard_dataloaders"
+    ) as mock_dls, patch("train.serving_dataloaders") as mock_serving:
+        main()
+
+    plan = mock_sync.call_args[0][0]
+    assert [shard["ids"] for shard in plan] == [[1, 2]]
+    assert mock_sync.call_args[0][3] == ["dandelion", "grass"]
+    mock_dls.assert_called_once()
+    mock_fastai.fine_tune.assert_called_once_with(5)
+    # Export avec les DataLoaders fastai standards, pas ceux des shards
+    assert mock_fastai.dls == mock_serving.return_value
+    mock_fastai.export.assert_called_once()
+
+
+@patch("train.os.getenv")
+def test_download_minio_dataset_syncs_cache(mock_getenv, mock_minio, cache_dir, capsys):
+    mock_getenv.side_effect = lambda key: {"MLFLOW_S3_ENDPOINT_URL": "http://fake-minio:9000"}.get(key, "")
+    mock_client = mock_minio.return_value
+    objects = {f"grass/{i:08d}.jpg": f"image{i}".encode() for i in range(4)}
+    serve_objects(mock_client, objects)
+    download_minio_dataset(workers=2)
+    assert mock_client.get_object.call_count == 4
+
+    # Une image modifiée, une supprimée, une ajoutée ; les autres sont reprises du cache
+    mock_client.get_object.reset_mock()
+    objects["grass/00000001.jpg"] = b"changed"
+    del objects["grass/00000002.jpg"]
+    objects["dandelion/00000009.jpg"] = b"new"
+    download_minio_dataset(workers=2)
+
+    fetched = sorted(call.args[1] for call in mock_client.get_object.call_args_list)
+    assert fetched == ["dandelion/00000009.jpg", "grass/00000001.jpg"]
+    assert sorted(os.listdir(os.path.join(cache_dir, "grass"))) == ["00000000.jpg", "00000001.jpg", "00000003.jpg"]
+    with open(os.path.join(cache_dir, "grass", "00000001.jpg"), "rb") as f:
+        assert f.read() == b"changed"
+    with open(os.path.join(cache_dir, ".manifest.json")) as f:
+        assert set(json.load(f)) == set(objects)
+    assert "Cache : 2/4 images à jour (50%), 2 téléchargées" in capsys.readouterr().out
+
+
+@patch("train.os.getenv")
+def test_download_minio_dataset_refetches_damaged_files(mock_getenv, mock_minio, cache_dir):
+    mock_getenv.side_effect = lambda key: {"MLFLOW_S3_ENDPOINT_URL": "http://fake-minio:9000"}.get(key, "")
+    mock_client = mock_minio.return_value
+    serve_objects(mock_client, {"grass/00000001.jpg": b"image"})
+    download_minio_dataset()
+
+    # Fichier tronqué et copie interrompue laissée sur le disque
+    with open(os.path.join(cache_dir, "grass", "00000001.jpg"), "wb") as f:
+        f.write(b"im")
+    with open(os.path.join(cache_dir, "grass", "00000002.jpg.part"), "wb") as f:
+        f.write(b"partial")
+    download_minio_dataset()
+
+    assert mock_client.get_object.call_count == 2
+    assert os.listdir(os.path.join(cache_dir, "grass")) == ["00000001.jpg"]
+
+
+@patch("train.os.getenv")
+def test_download_minio_dataset_keeps_every_label(mock_getenv, mock_minio, cache_dir):
+    mock_getenv.side_effect = lambda key: {"MLFLOW_S3_ENDPOINT_URL": "http://fake-minio:9000"}.get(key, "")
+    serve_objects(
+        mock_minio.return_value,
+        {"dandelion/00000001.jpg": b"a", "grass/00000002.jpg": b"b", "clover/00000003.jpg": b"c"},
+    )
+
+    download_minio_dataset()
+
+    # Un troisième label a son propre dossier, il n'est pas rangé avec l'herbe
+    assert sorted(os.listdir(cache_dir)) == [".manifest.json", "clover", "dandelion", "grass"]
+    assert os.listdir(os.path.join(cache_dir, "clover")) == ["00000003.jpg"]
+    assert os.listdir(os.path.join(cache_dir, "grass")) == ["00000002.jpg"]
@@ -1,4 +1,5 @@
 from fastai.vision.all import (
+    CrossEntropyLossFlat,
     ImageDataLoaders,
     Resize,
     cnn_learner,
@@ -6,66 +7,214 @@ from fastai.vision.all import (
     accuracy,
 )
 from minio import Minio
+import json
 import os
+import random
 import shutil
+import urllib3
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import mlflow
 from sklearn.metrics import f1_score, precision_score, recall_score
 from mlflow.tracking import MlflowClient
 from dotenv import load_dotenv
 
+from download import COPY_CHUNK_SIZE, connect_postgres, create_retry, object_name_for
+from shards import plan_shards, serving_dataloaders, shard_dataloaders, sync_shards
+
 # Chargement des variables d'environnement
 load_dotenv()
 
+# Part des images en validation ; graine fixe pour garder la même répartition d'un entraînement à l'autre
+VALID_PCT = 0.2
+SPLIT_SEED = 42
+
+IMAGE_SIZE = 224
+
+# Cache local persistant des images, synchronisé avec le bucket par ETag et taille
+DATASET_CACHE_DIR = os.getenv("DATASET_CACHE_DIR") or "/opt/airflow/data/images"
+DATASET_SYNC_WORKERS = int(os.getenv("DATASET_SYNC_WORKERS", "8"))
+MANIFEST_NAME = ".manifest.json"
+
+
+def read_manifest(local_dir):
+    # {objet: {"etag", "size"}} des images présentes dans le cache
+    try:
+        with open(os.path.join(local_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(local_dir, manifest):
+    path = os.path.join(local_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
 
-def download_minio_dataset(bucket_name="images", local_dir="/tmp/images"):
-    print("⬇️ Téléchargement des données depuis MinIO...")
+def local_path_for(local_dir, object_name):
+    # Objets nommés <label>/<id>.jpg : le dossier local est le label, quel que soit DATASET_LABELS
+    return os.path.join(local_dir, *object_name.split("/"))
 
+
+def fetch_object(minio_client, bucket_name, object_name, file_path):
+    """Download one object to file_path and return its size in bytes."""
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    response = minio_client.get_object(bucket_name, object_name)
+    try:
+        # Fichier temporaire renommé à la fin : une copie interrompue ne laisse pas d'image tronquée
+        with open(file_path + ".part", "wb") as f:
+            shutil.copyfileobj(response, f, COPY_CHUNK_SIZE)
+    finally:
+        response.close()
+        response.release_conn()
+    os.replace(file_path + ".part", file_path)
+    return os.path.getsize(file_path)
+
+
+def create_minio_client(workers=DATASET_SYNC_WORKERS):
     endpoint = os.getenv("MLFLOW_S3_ENDPOINT_URL").replace("http://", "")
-    minio_client = Minio(
+    return Minio(
         endpoint,
         access_key=os.getenv("AWS_ACCESS_KEY_ID"),
         secret_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
         secure=False,
+        # Une connexion par téléchargement simultané
+        http_client=urllib3.PoolManager(maxsize=workers, retries=create_retry()),
     )
 
-    # Nettoyage du dossier local
-    if os.path.exists(local_dir):
-        shutil.rmtree(local_dir)
+
+def download_minio_dataset(bucket_name="images", local_dir=None, include=None, workers=DATASET_SYNC_WORKERS):
+    """Sync the bucket images into the persistent local cache and return its path.
+
+    Images whose ETag and size match the cache manifest are kept, new or
+    changed ones are downloaded in parallel, and local files no longer in the
+    bucket (or not in `include`) are deleted.
+    """
+    print("⬇️ Synchronisation des données depuis MinIO...")
+    local_dir = local_dir or DATASET_CACHE_DIR
+
+    minio_client = create_minio_client(workers)
     os.makedirs(local_dir, exist_ok=True)
+    manifest = read_manifest(local_dir)
 
-    objects = minio_client.list_objects(bucket_name, recursive=True)
-    for obj in objects:
+    wanted = {}
+    for obj in minio_client.list_objects(bucket_name, recursive=True):
+        # Seules les images de l'index sont utiles (les doublons exacts sont écartés)
+        if include is not None and obj.object_name not in include:
+            continue
         if obj.object_name.lower().endswith((".jpg", ".png")):
-            label = "dandelion" if "dandelion" in obj.object_name.lower() else "grass"
-            label_dir = os.path.join(local_dir, label)
-            os.makedirs(label_dir, exist_ok=True)
-            filename = os.path.basename(obj.object_name)
-            file_path = os.path.join(label_dir, filename)
-
-            response = minio_client.get_object(bucket_name, obj.object_name)
-            with open(file_path, "wb") as f:
-                f.write(response.read())
-            response.close()
-
-    print(f"Données copiées dans {local_dir}")
+            wanted[obj.object_name] = {"etag": obj.etag, "size": obj.size}
+
+    # Image à jour : même ETag et même taille que lors de son téléchargement
+    stale = set()
+    for object_name, meta in wanted.items():
+        file_path = local_path_for(local_dir, object_name)
+        if manifest.get(object_name) != meta or not os.path.isfile(file_path) \
+                or os.path.getsize(file_path) != meta["size"]:
+            stale.add(object_name)
+
+    # Suppression des images retirées du bucket (et des copies interrompues)
+    keep = {local_path_for(local_dir, object_name) for object_name in wanted}
+    removed = 0
+    for root, _, files in os.walk(local_dir):
+        for filename in files:
+            file_path = os.path.join(root, filename)
+            if filename != MANIFEST_NAME and file_path not in keep:
+                os.remove(file_path)
+                removed += 1
+
+    synced = {object_name: meta for object_name, meta in wanted.items() if object_name not in stale}
+    transferred = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(
+                    fetch_object, minio_client, bucket_name, object_name, local_path_for(local_dir, object_name)
+                ): object_name
+                for object_name in stale
+            }
+            for future in as_completed(futures):
+                transferred += future.result()
+                synced[futures[future]] = wanted[futures[future]]
+    finally:
+        # Le manifeste ne décrit que les fichiers complets : une synchronisation interrompue reprend là
+        write_manifest(local_dir, synced)
+
+    hits = len(wanted) - len(stale)
+    print(
+        f"Cache : {hits}/{len(wanted)} images à jour ({hits / len(wanted) if wanted else 1:.0%}), "
+        f"{len(stale)} téléchargées ({transferred / 1024 ** 2:.1f} Mo), {removed} supprimées"
+    )
+    print(f"Données synchronisées dans {local_dir}")
     return local_dir
 
 
+def load_image_index():
+    """(id, label, group, sha256) of the distinct ingested images, group being the near-duplicate group."""
+    conn = connect_postgres()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT id, label, COALESCE(near_duplicate_of, id), sha256 FROM plants_data "
+                "WHERE status = 'done' AND sha256 IS NOT NULL AND duplicate_of IS NULL ORDER BY id;"
+            )
+            return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def group_split(rows, valid_pct=VALID_PCT, seed=SPLIT_SEED):
+    """Ids of the validation images, drawn by whole near-duplicate groups."""
+    groups = defaultdict(list)
+    for img_id, _, group, _ in rows:
+        groups[group].append(img_id)
+    keys = sorted(groups)
+    random.Random(seed).shuffle(keys)
+
+    # Un groupe de quasi-doublons est entièrement d'un côté de la séparation
+    valid_ids = set()
+    for key in keys:
+        if len(valid_ids) >= valid_pct * len(rows):
+            break
+        valid_ids.update(groups[key])
+    return valid_ids
+
+
 def main():
     # Configuration MLflow via variables d'environnement
     mlflow.set_tracking_uri(os.getenv("MLFLOW_API"))
     mlflow.set_experiment("classification_dandelion_grass_fastai")
 
+    # Index des images distinctes, avec leurs groupes de quasi-doublons
+    rows = load_image_index()
+
     # Données depuis MinIO
-    data_dir = download_minio_dataset()
+    data_dir = download_minio_dataset(
+        include={object_name_for(img_id, label) for img_id, label, _, _ in rows} or None
+    )
 
     # Création DataLoader
-    dls = ImageDataLoaders.from_folder(
-        data_dir, valid_pct=0.2, item_tfms=Resize(224), bs=32, num_workers=0
-    )
+    serving_dls = None
+    if rows:
+        # Images décodées et redimensionnées une seule fois, dans des shards lus par memory-map
+        paths = {img_id: local_path_for(data_dir, object_name_for(img_id, label)) for img_id, label, _, _ in rows}
+        rows = [row for row in rows if os.path.exists(paths[row[0]])]
+        classes = sorted({label for _, label, _, _ in rows})
+        plan = plan_shards(rows, classes, IMAGE_SIZE)
+        shard_dir = sync_shards(plan, paths.__getitem__, create_minio_client(), classes, IMAGE_SIZE)
+        dls = shard_dataloaders(shard_dir, plan, classes, group_split(rows), bs=32, num_workers=0)
+        serving_dls = serving_dataloaders(classes, IMAGE_SIZE)
+    else:
+        # Images sans empreintes en base (download.py pas encore exécuté) : séparation aléatoire
+        print("⚠️ Aucune image indexée dans plants_data, séparation aléatoire des données")
+        dls = ImageDataLoaders.from_folder(
+            data_dir, valid_pct=VALID_PCT, item_tfms=Resize(IMAGE_SIZE), bs=32, num_workers=0
+        )
 
     # Modèle
-    learn = cnn_learner(dls, resnet34, metrics=accuracy)
+    learn = cnn_learner(dls, resnet34, metrics=accuracy, loss_func=CrossEntropyLossFlat())
 
     with mlflow.start_run() as run:
         learn.fine_tune(5)
@@ -78,7 +227,7 @@ def main():
         mlflow.log_params(
             {
                 "architecture": "resnet34",
-                "image_size": 224,
+                "image_size": IMAGE_SIZE,
                 "batch_size": 32,
                 "epochs": 5,
             }
@@ -98,6 +247,9 @@ def main():
         model_dir = os.path.abspath("/opt/airflow/scripts/saved_models")
         os.makedirs(model_dir, exist_ok=True)
         export_path = os.path.join(model_dir, "export.pkl")
+        if serving_dls is not None:
+            # Modèle exporté avec des DataLoaders fastai standards : l'API prédit sur des images PIL
+            learn.dls = serving_dls
         learn.export(export_path)
         mlflow.log_artifact(export_path, artifact_path="model")
 
@@ -0,0 +1,103 @@
+"""
+Benchmark of the API image decode stage on large photos.
+
+Compares the original `Image.open(...).convert("RGB")` full-resolution decode
+with `decoding.decode_image` (JPEG draft mode), both followed by the 224px
+center crop + resize the model applies.
+
+Usage: python benchmarks/bench_decode.py [--sizes 4000x3000 ...] [--repeat 10] [--json out.json]
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "api"))
+
+from decoding import decode_image  # noqa: E402
+
+TARGET = (224, 224)
+
+
+def make_photo(width, height, quality=90):
+    # Dégradé + bruit : se compresse comme une photo, pas comme un aplat
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+    noise = rng.normal(0, 20, size=(height, width, 3))
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def center_crop_resize(image):
+    w, h = image.size
+    m = min(w / TARGET[0], h / TARGET[1])
+    cw, ch = int(m * TARGET[0]), int(m * TARGET[1])
+    left, top = (w - cw) // 2, (h - ch) // 2
+    return image.crop((left, top, left + cw, top + ch)).resize(TARGET, Image.BILINEAR)
+
+
+def baseline(contents):
+    return center_crop_resize(Image.open(io.BytesIO(contents)).convert("RGB"))
+
+
+def fast(contents):
+    return center_crop_resize(decode_image(contents, target=TARGET))
+
+
+def timeit(fn, contents, repeat):
+    fn(contents)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(contents)
+        timings.append(time.perf_counter() - start)
+    return 1000 * float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", default=["1920x1080", "4032x3024", "6000x4000"])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for spec in args.sizes:
+        width, height = map(int, spec.split("x"))
+        contents = make_photo(width, height)
+        base_ms = timeit(baseline, contents, args.repeat)
+        fast_ms = timeit(fast, contents, args.repeat)
+        # Écart moyen des pixels après redimensionnement (0-255)
+        diff = np.abs(
+            np.asarray(baseline(contents), dtype=np.int16) - np.asarray(fast(contents), dtype=np.int16)
+        ).mean()
+        results.append({
+            "size": spec,
+            "jpeg_bytes": len(contents),
+            "baseline_ms": round(base_ms, 2),
+            "draft_ms": round(fast_ms, 2),
+            "speedup": round(base_ms / fast_ms, 2),
+            "mean_abs_pixel_diff": round(float(diff), 2),
+        })
+        print(
+            f"{spec:>10}  baseline {base_ms:8.1f} ms  draft {fast_ms:7.1f} ms  "
+            f"x{base_ms / fast_ms:5.1f}  mean |diff| {diff:.2f}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
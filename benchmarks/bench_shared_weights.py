@@ -0,0 +1,119 @@
+"""
+Resident memory of API workers loading the model from the pickle vs from
+memory-mapped shared weights (SERVING_MODE=mmap).
+
+Builds a ResNet34 learner like airflow/scripts/train.py (random weights, no
+download), exports it, then starts N worker processes that each load the
+model, run a warm-up forward pass and report their RSS and PSS (proportional
+set size: shared pages are split between the processes that map them).
+
+Usage: python benchmarks/bench_shared_weights.py [--workers 4] [--json out.json]
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "api"))
+
+
+def memory_kb():
+    usage = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                usage[parts[0][:-1].lower()] = int(parts[1])
+    return usage
+
+
+def worker(mode, path, ready, release):
+    import torch
+    from PIL import Image
+
+    torch.set_num_threads(1)
+    if mode == "pickle":
+        from fastai.vision.all import load_learner
+        from inference import InferenceEngine
+
+        engine = InferenceEngine.from_learner(load_learner(path))
+    else:
+        from shared_weights import load_shared_engine
+
+        engine = load_shared_engine(path)
+    engine.predict(Image.new("RGB", (224, 224)))
+    ready.put(memory_kb())
+    release.wait()
+
+
+def build_artifacts(directory):
+    import numpy as np
+    from fastai.vision.all import ImageDataLoaders, Resize, resnet34, vision_learner
+    from PIL import Image
+
+    from inference import InferenceEngine
+    from shared_weights import export_shared_weights
+
+    data_dir = os.path.join(directory, "images")
+    for label in ("dandelion", "grass"):
+        os.makedirs(os.path.join(data_dir, label))
+        for i in range(4):
+            pixels = np.random.randint(0, 255, (256, 256, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(os.path.join(data_dir, label, f"{i}.jpg"))
+    dls = ImageDataLoaders.from_folder(
+        data_dir, valid_pct=0.25, item_tfms=Resize(224), bs=4, num_workers=0
+    )
+    learn = vision_learner(dls, resnet34, pretrained=False)
+    pkl_path = os.path.join(directory, "export.pkl")
+    learn.export(pkl_path)
+    mmap_dir = export_shared_weights(
+        InferenceEngine.from_learner(learn), os.path.join(directory, "export.mmap")
+    )
+    return pkl_path, mmap_dir
+
+
+def run(mode, path, workers):
+    ctx = mp.get_context("spawn")
+    ready, release = ctx.Queue(), ctx.Event()
+    processes = [ctx.Process(target=worker, args=(mode, path, ready, release)) for _ in range(workers)]
+    for p in processes:
+        p.start()
+    # Mesure pendant que tous les workers sont vivants
+    usages = [ready.get(timeout=600) for _ in processes]
+    release.set()
+    for p in processes:
+        p.join()
+    return {
+        "mode": mode,
+        "workers": workers,
+        "rss_mb_per_worker": round(sum(u["rss"] for u in usages) / len(usages) / 1024, 1),
+        "pss_mb_per_worker": round(sum(u["pss"] for u in usages) / len(usages) / 1024, 1),
+        "pss_mb_total": round(sum(u["pss"] for u in usages) / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        pkl_path, mmap_dir = build_artifacts(directory)
+        results = [run("pickle", pkl_path, args.workers), run("mmap", mmap_dir, args.workers)]
+
+    for r in results:
+        print(
+            f"{r['mode']:>6}  {r['workers']} workers  RSS/worker {r['rss_mb_per_worker']:7.1f} MB  "
+            f"PSS/worker {r['pss_mb_per_worker']:7.1f} MB  PSS total {r['pss_mb_total']:7.1f} MB"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
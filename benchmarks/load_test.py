@@ -0,0 +1,320 @@
+"""
+Offline load test of the prediction API.
+
+Builds a small fastai learner on synthetic images (random weights, no
+download), publishes it in a local stand-in for the MinIO model bucket, then
+drives the FastAPI app in-process through httpx's ASGI transport at each
+requested concurrency. No network, MinIO or GPU is needed, so the numbers
+measure the app itself: upload parsing, decode, batching, inference and
+model loading.
+
+Reports, per scenario and concurrency, req/s, p50/p95/p99 latency and the
+peak RSS of the process as JSON. With `--baseline`, exits with status 1 when
+throughput, tail latency or peak memory regress by more than `--tolerance`
+compared with the stored results (baselines are machine specific:
+regenerate them with `--save-baseline` on the machine that runs the check).
+
+Usage: python benchmarks/load_test.py [--scenario predict predict_batch]
+       [--concurrency 1 8 32] [--requests 100] [--arch resnet18]
+       [--json out.json] [--baseline benchmarks/baselines/load_test.json]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "api"))
+
+SCENARIOS = ("predict", "predict_batch")
+MODEL_KEY = "bench/export.pkl"
+
+
+class LocalModelBucket:
+    """Minimal boto3 S3 client serving objects from a local directory."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, key)
+
+    def _missing(self, operation):
+        from botocore.exceptions import ClientError
+
+        return ClientError({"Error": {"Code": "NoSuchKey"}}, operation)
+
+    def put(self, bucket, key, data):
+        path = self._path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def head_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise self._missing("HeadObject")
+        with open(path, "rb") as f:
+            etag = hashlib.md5(f.read()).hexdigest()
+        mtime = datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc)
+        return {"LastModified": mtime, "ETag": f'"{etag}"', "ContentLength": os.path.getsize(path)}
+
+    def get_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise self._missing("GetObject")
+        return {"Body": open(path, "rb"), **self.head_object(Bucket, Key)}
+
+    def get_paginator(self, operation):
+        bucket = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix=""):
+                contents = []
+                base = os.path.join(bucket.root, Bucket)
+                for root, _, files in os.walk(base):
+                    for name in files:
+                        key = os.path.relpath(os.path.join(root, name), base)
+                        if key.startswith(Prefix):
+                            contents.append({"Key": key, **bucket.head_object(Bucket, key)})
+                yield {"Contents": contents}
+
+        return Paginator()
+
+
+def build_learner(directory, arch_name):
+    import torchvision.models
+    from fastai.vision.all import ImageDataLoaders, Resize, vision_learner
+
+    data_dir = os.path.join(directory, "images")
+    rng = np.random.default_rng(0)
+    for label in ("dandelion", "grass"):
+        os.makedirs(os.path.join(data_dir, label))
+        for i in range(4):
+            pixels = rng.integers(0, 256, (256, 256, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(os.path.join(data_dir, label, f"{i}.jpg"))
+    dls = ImageDataLoaders.from_folder(
+        data_dir, valid_pct=0.25, item_tfms=Resize(224), bs=4, num_workers=0
+    )
+    learn = vision_learner(dls, getattr(torchvision.models, arch_name), pretrained=False)
+    path = os.path.join(directory, "export.pkl")
+    learn.export(path)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def make_images(count, size, seed=0):
+    # Images distinctes : chaque requête passe par le décodage et l'inférence
+    rng = np.random.default_rng(seed)
+    width, height = size
+    images = []
+    for _ in range(count):
+        pixels = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+        image = Image.fromarray(pixels).resize((width, height), Image.BILINEAR)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=85)
+        images.append(buffer.getvalue())
+    return images
+
+
+def peak_rss_mb():
+    # ru_maxrss est en Ko sous Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def summarize(scenario, concurrency, latencies, statuses, duration, images_per_request):
+    ok = [latency for latency, status in zip(latencies, statuses) if status == 200]
+    latency_ms = np.array(ok) * 1000 if ok else np.zeros(1)
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": sum(status not in (200, 503) for status in statuses),
+        "rejected": sum(status == 503 for status in statuses),
+        "duration_s": round(duration, 3),
+        "req_per_s": round(len(ok) / duration, 2),
+        "images_per_s": round(len(ok) * images_per_request / duration, 2),
+        "latency_ms": {
+            "p50": round(float(np.percentile(latency_ms, 50)), 2),
+            "p95": round(float(np.percentile(latency_ms, 95)), 2),
+            "p99": round(float(np.percentile(latency_ms, 99)), 2),
+            "mean": round(float(latency_ms.mean()), 2),
+            "max": round(float(latency_ms.max()), 2),
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+async def run_scenario(client, scenario, concurrency, requests, images, batch_files):
+    def files_for(i):
+        if scenario == "predict":
+            return {"file": (f"{i}.jpg", images[i % len(images)], "image/jpeg")}
+        return [
+            ("files", (f"{i}_{j}.jpg", images[(i * batch_files + j) % len(images)], "image/jpeg"))
+            for j in range(batch_files)
+        ]
+
+    latencies, statuses = [], []
+    next_request = iter(range(requests))
+
+    async def user():
+        for i in next_request:
+            start = time.perf_counter()
+            response = await client.post(f"/{scenario}", files=files_for(i))
+            latencies.append(time.perf_counter() - start)
+            status = response.status_code
+            # /predict_batch renvoie 200 même si certaines images échouent
+            if status == 200 and scenario == "predict_batch" and '"error"' in response.text:
+                status = 500
+            statuses.append(status)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    duration = time.perf_counter() - start
+    images_per_request = 1 if scenario == "predict" else batch_files
+    return summarize(scenario, concurrency, latencies, statuses, duration, images_per_request)
+
+
+async def run_all(main, args, images):
+    import httpx
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        results = []
+        for scenario in args.scenario:
+            for concurrency in args.concurrency:
+                # Requêtes de chauffe non comptées
+                await run_scenario(client, scenario, concurrency, args.warmup, images, args.batch_files)
+                result = await run_scenario(
+                    client, scenario, concurrency, args.requests, images, args.batch_files
+                )
+                results.append(result)
+                print(
+                    f"{scenario:>13}  c={concurrency:<3}  {result['req_per_s']:8.1f} req/s  "
+                    f"p50 {result['latency_ms']['p50']:8.1f} ms  p95 {result['latency_ms']['p95']:8.1f} ms  "
+                    f"p99 {result['latency_ms']['p99']:8.1f} ms  errors {result['errors']}  "
+                    f"rejected {result['rejected']}  peak RSS {result['peak_rss_mb']:.0f} MB",
+                    flush=True,
+                )
+        return results
+
+
+def compare(report, baseline, tolerance):
+    """Return the list of regressions of `report` against `baseline`."""
+    reference = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        base = reference.get((result["scenario"], result["concurrency"]))
+        if base is None:
+            continue
+        name = f"{result['scenario']} c={result['concurrency']}"
+        if result["req_per_s"] < base["req_per_s"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['req_per_s']} req/s < baseline {base['req_per_s']}")
+        for percentile in ("p95", "p99"):
+            value, reference_value = result["latency_ms"][percentile], base["latency_ms"][percentile]
+            if value > reference_value * (1 + tolerance):
+                regressions.append(f"{name}: {percentile} {value} ms > baseline {reference_value} ms")
+        if result["errors"] > base["errors"]:
+            regressions.append(f"{name}: {result['errors']} errors > baseline {base['errors']}")
+    for metric, unit in (("peak_rss_mb", "MB"), ("model_load_s", "s")):
+        if report[metric] > baseline[metric] * (1 + tolerance):
+            regressions.append(f"{metric} {report[metric]} {unit} > baseline {baseline[metric]} {unit}")
+    return regressions
+
+
+def parse_size(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario and concurrency")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--batch-files", type=int, default=8, help="Images per /predict_batch request")
+    parser.add_argument("--image-size", type=parse_size, default=(640, 480))
+    parser.add_argument("--arch", default="resnet18", help="torchvision architecture of the learner")
+    parser.add_argument("--engine", choices=("lean", "fastai"), default="lean")
+    parser.add_argument("--prediction-cache", action="store_true", help="Keep the prediction cache on")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--baseline", help="Fail if results regress against this results file")
+    parser.add_argument("--save-baseline", help="Write results as the new baseline to this file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        bucket = LocalModelBucket(os.path.join(directory, "minio"))
+        bucket.put("models", MODEL_KEY, build_learner(directory, args.arch))
+        bucket.put("models", "latest.json", json.dumps({"key": MODEL_KEY}).encode())
+
+        # Configuration lue à l'import de main
+        os.environ.update(
+            MODEL_BUCKET="models",
+            MODEL_CACHE_DIR=os.path.join(directory, "model_cache"),
+            EAGER_MODEL_LOAD="false",
+            INFERENCE_ENGINE=args.engine,
+        )
+        if not args.prediction_cache:
+            os.environ["PREDICTION_CACHE_SIZE"] = "0"
+
+        with mock.patch("boto3.client", return_value=bucket):
+            import main as api
+
+            logging.getLogger("httpx").setLevel(logging.WARNING)
+
+            start = time.perf_counter()
+            api.get_model()
+            model_load_s = round(time.perf_counter() - start, 3)
+            print(f"Model loaded in {model_load_s} s", flush=True)
+
+            images = make_images(64, args.image_size)
+            results = asyncio.run(run_all(api, args, images))
+
+    report = {
+        "config": {
+            "arch": args.arch,
+            "engine": args.engine,
+            "image_size": list(args.image_size),
+            "requests": args.requests,
+            "batch_files": args.batch_files,
+            "prediction_cache": args.prediction_cache,
+            "max_batch_size": api.MAX_BATCH_SIZE,
+            "torch_threads": api.TORCH_NUM_THREADS,
+            "cpu_count": os.cpu_count(),
+        },
+        "model_load_s": model_load_s,
+        "peak_rss_mb": peak_rss_mb(),
+        "results": results,
+    }
+    for path in (args.json, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
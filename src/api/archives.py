@@ -0,0 +1,69 @@
+"""
+Lazy iteration over the images contained in an uploaded zip or tar archive.
+"""
+
+import os
+import tarfile
+import zipfile
+from typing import BinaryIO, Iterator, Tuple, Union
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp", ".tif", ".tiff")
+
+
+def is_archive(fileobj: BinaryIO, filename: str = "") -> bool:
+    """Return True if the file looks like a zip or tar archive."""
+    name = (filename or "").lower()
+    if name.endswith((".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")):
+        return True
+    position = fileobj.tell()
+    try:
+        if zipfile.is_zipfile(fileobj):
+            return True
+        fileobj.seek(position)
+        try:
+            with tarfile.open(fileobj=fileobj, mode="r:*"):
+                return True
+        except tarfile.TarError:
+            return False
+    finally:
+        fileobj.seek(position)
+
+
+def _is_image_member(name: str) -> bool:
+    base = os.path.basename(name)
+    if not base or base.startswith(".") or "__MACOSX" in name:
+        return False
+    return base.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def iter_archive(
+    fileobj: BinaryIO, max_member_bytes: int
+) -> Iterator[Tuple[str, Union[bytes, Exception]]]:
+    """Yield (member name, bytes) for each image of the archive, one at a time.
+
+    Members larger than `max_member_bytes` are yielded with a ValueError in
+    place of their bytes, so the caller can report them and move on.
+    """
+    fileobj.seek(0)
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not _is_image_member(info.filename):
+                    continue
+                if info.file_size > max_member_bytes:
+                    yield info.filename, ValueError("Archive member too large")
+                    continue
+                yield info.filename, archive.read(info)
+        return
+
+    fileobj.seek(0)
+    with tarfile.open(fileobj=fileobj, mode="r:*") as archive:
+        for member in archive:
+            if not member.isfile() or not _is_image_member(member.name):
+                continue
+            if member.size > max_member_bytes:
+                yield member.name, ValueError("Archive member too large")
+                continue
+            extracted = archive.extractfile(member)
+            yield member.name, extracted.read()
@@ -0,0 +1,163 @@
+"""
+Local on-disk cache of model artifacts downloaded from MinIO.
+
+Artifacts are stored under `<cache_dir>/<bucket>/<key>/<etag>` so an
+unchanged object is read straight from disk, while a new upload (new ETag)
+gets its own entry. Downloads are streamed to a temporary file and moved into
+place atomically, which makes the cache safe to share between processes.
+Least recently used entries are evicted once the cache exceeds `max_bytes`;
+an artifact and its `<path>.mmap` export directory count as one entry.
+"""
+
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+from typing import BinaryIO, Callable, Dict, Iterable, List, Optional, Union
+
+# Répertoire d'export à mémoire partagée rangé à côté de l'artefact
+EXPORT_SUFFIX = ".mmap"
+
+
+def _safe_name(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]", "_", value)
+
+
+class ArtifactCache:
+    """Size-bounded cache of downloaded artifacts keyed by bucket/key/ETag."""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pinned = None
+
+    def path_for(self, bucket: str, key: str, etag: str) -> str:
+        parts = [_safe_name(part) for part in key.split("/") if part]
+        suffix = os.path.splitext(key)[1]
+        filename = _safe_name(etag.strip('"')) + suffix
+        return os.path.join(self.cache_dir, _safe_name(bucket), *parts, filename)
+
+    def get(self, bucket: str, key: str, etag: str) -> Optional[str]:
+        """Return the cached path for this artifact version, or None."""
+        path = self.path_for(bucket, key, etag)
+        if not os.path.exists(path):
+            return None
+        # Marque l'entrée comme récemment utilisée pour l'éviction LRU
+        os.utime(path)
+        return path
+
+    def fetch(
+        self,
+        bucket: str,
+        key: str,
+        etag: str,
+        download: Callable[[BinaryIO], None],
+    ) -> str:
+        """Return the local path of the artifact, downloading it on a miss.
+
+        `download` receives a binary file object and must stream the artifact
+        into it.
+        """
+        path = self.get(bucket, key, etag)
+        if path is not None:
+            logging.info(f"Model cache hit: {path}")
+            return path
+
+        path = self.path_for(bucket, key, etag)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                download(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        logging.info(f"Model cache miss, downloaded {os.path.getsize(path)} bytes to {path}")
+
+        self.evict(keep=path)
+        return path
+
+    def pin(self, path: Optional[str]):
+        """Protect the artifact being served (and its export) from eviction."""
+        with self._lock:
+            self._pinned = None if path is None else self._unit(path)
+
+    def _unit(self, path: str) -> str:
+        # Un artefact et son export `.mmap` forment une seule entrée
+        path = os.path.abspath(path)
+        return path[:-len(EXPORT_SUFFIX)] if path.endswith(EXPORT_SUFFIX) else path
+
+    def _entries(self) -> Dict[str, List[float]]:
+        """Map each artifact to [last use, total size], counting its export directory."""
+        entries = {}
+
+        def add(path, mtime, size):
+            entry = entries.setdefault(self._unit(path), [0.0, 0])
+            entry[0] = max(entry[0], mtime)
+            entry[1] += size
+
+        for root, dirs, files in os.walk(self.cache_dir):
+            # Ignore les exports en cours d'écriture
+            dirs[:] = [d for d in dirs if not d.endswith(".part")]
+            for name in list(dirs):
+                if not name.endswith(EXPORT_SUFFIX):
+                    continue
+                dirs.remove(name)
+                export_dir = os.path.join(root, name)
+                try:
+                    mtime = os.stat(export_dir).st_mtime
+                    size = 0
+                    for sub_root, _, sub_files in os.walk(export_dir):
+                        for sub_name in sub_files:
+                            stat = os.stat(os.path.join(sub_root, sub_name))
+                            mtime = max(mtime, stat.st_mtime)
+                            size += stat.st_size
+                except FileNotFoundError:
+                    continue
+                add(export_dir, mtime, size)
+            for name in files:
+                if name.endswith(".part"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                add(path, stat.st_mtime, stat.st_size)
+        return entries
+
+    def evict(self, keep: Union[str, Iterable[str], None] = None) -> int:
+        """Delete least recently used artifacts until the cache fits in max_bytes.
+
+        An artifact and its `.mmap` export are evicted together; `keep` (one
+        path or several) and the pinned artifact are never evicted.
+        """
+        if isinstance(keep, str):
+            keep = [keep]
+        with self._lock:
+            protected = {self._unit(path) for path in keep or ()}
+            if self._pinned is not None:
+                protected.add(self._pinned)
+
+            entries = self._entries()
+            total = sum(size for _, size in entries.values())
+            removed = 0
+            for path, (_, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+                if total <= self.max_bytes:
+                    break
+                if path in protected:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                shutil.rmtree(path + EXPORT_SUFFIX, ignore_errors=True)
+                total -= size
+                removed += 1
+                logging.info(f"Evicted cached model artifact {path}")
+            return removed
@@ -0,0 +1,116 @@
+"""
+Micro-batching of concurrent prediction requests.
+
+Requests submitted to a `MicroBatcher` are queued and grouped by a background
+worker thread: a batch is flushed as soon as it reaches `max_batch_size` items
+or when the oldest item has waited `max_wait_ms` milliseconds. The whole batch
+is handed to `predict_fn` in a single call and each caller receives its own
+result through a `concurrent.futures.Future`. If the batched call fails, its
+items are predicted again one by one, so an invalid item only fails its own
+caller.
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+
+class MicroBatcher:
+    """Collect concurrent items into batches for a single batched call."""
+
+    def __init__(
+        self,
+        predict_fn: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+    ):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(max_wait_ms, 0) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._batch_sizes = Counter()
+
+    def submit(self, item: Any) -> Future:
+        """Queue one item and return a future resolved with its result."""
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((item, future))
+        return future
+
+    def stats(self) -> dict:
+        """Return the histogram of achieved batch sizes."""
+        with self._lock:
+            sizes = dict(sorted(self._batch_sizes.items()))
+        batches = sum(sizes.values())
+        items = sum(size * count for size, count in sizes.items())
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": batches,
+            "items": items,
+            "mean_batch_size": items / batches if batches else 0.0,
+            "batch_sizes": sizes,
+        }
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name="micro-batcher", daemon=True
+                )
+                self._worker.start()
+
+    def _collect(self) -> list:
+        # Bloque jusqu'au premier élément, puis attend au plus max_wait
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            futures = [future for _, future in batch]
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
+            try:
+                results = self._predict(items)
+            except Exception as e:
+                if len(batch) == 1:
+                    logging.exception("Batched prediction failed")
+                    futures[0].set_exception(e)
+                    continue
+                # Un élément invalide ne doit pas faire échouer les autres : reprise un par un
+                logging.warning("Batched prediction failed, retrying %d items one by one", len(batch))
+                for item, future in batch:
+                    try:
+                        future.set_result(self._predict([item])[0])
+                    except Exception as item_error:
+                        logging.exception("Prediction failed")
+                        future.set_exception(item_error)
+                continue
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    def _predict(self, items: list) -> list:
+        results = self.predict_fn(items)
+        if len(results) != len(items):
+            raise ValueError(f"Expected {len(items)} predictions, got {len(results)}")
+        return results
@@ -0,0 +1,61 @@
+"""
+Image decoding tuned for inference on downscaled inputs.
+
+JPEG files can be decoded directly at 1/2, 1/4 or 1/8 scale by libjpeg
+(`Image.draft`). `decode_image` uses it to land just above the size the model
+needs instead of decoding every pixel of a multi-megapixel photo and throwing
+most of them away in the resize.
+"""
+
+import io
+import math
+from typing import Optional, Tuple
+
+from PIL import Image
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an image exceeds the configured pixel budget."""
+
+
+def draft_size(size: Tuple[int, int], target: Tuple[int, int]) -> Optional[Tuple[int, int]]:
+    """Smallest size keeping a `target` center crop or squish at full resolution.
+
+    Returns None when the image is already smaller than the target.
+    """
+    w, h = size
+    tw, th = target
+    scale = max(tw / w, th / h)
+    if scale >= 1:
+        return None
+    return math.ceil(w * scale), math.ceil(h * scale)
+
+
+def decode_image(
+    contents: bytes,
+    target: Optional[Tuple[int, int]] = None,
+    max_pixels: Optional[int] = None,
+) -> Image.Image:
+    """Decode an upload to an RGB PIL image.
+
+    `target` is the (width, height) the model resizes to; JPEGs are decoded at
+    the smallest libjpeg scale that still covers it. Images with more than
+    `max_pixels` pixels are rejected before any pixel data is decoded.
+    """
+    image = Image.open(io.BytesIO(contents))
+
+    w, h = image.size
+    if max_pixels and w * h > max_pixels:
+        raise ImageTooLargeError(f"Image too large: {w}x{h} pixels")
+
+    if target is not None and image.format == "JPEG":
+        requested = draft_size((w, h), target)
+        if requested is not None:
+            # Le décodeur produit directement du RGB à échelle réduite
+            image.draft("RGB", requested)
+
+    # Pas de copie quand l'image est déjà en RGB
+    if image.mode != "RGB":
+        return image.convert("RGB")
+    image.load()
+    return image
@@ -0,0 +1,140 @@
+"""
+Lean inference path for exported fastai image classifiers.
+
+`InferenceEngine` pulls the torch module, class vocab, resize settings and
+normalization stats out of a fastai `Learner` once, then predicts with plain
+PIL + torch: no test DataLoader, no transform pipeline and no label decoding
+per call. It reproduces the validation-time preprocessing of fastai's
+`Resize` (center crop or squish, bilinear resampling), `IntToFloatTensor`
+and `Normalize`, so predictions match `Learner.predict`.
+"""
+
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+RESIZE_METHODS = ("crop", "squish")
+
+
+class InferenceEngine:
+    """Batched, thread-safe predictor exposing a `Learner.predict`-like API."""
+
+    def __init__(
+        self,
+        module: torch.nn.Module,
+        vocab: Sequence[str],
+        size: Tuple[int, int] = (224, 224),
+        resize_method: str = "crop",
+        resample: int = Image.BILINEAR,
+        mean: Optional[torch.Tensor] = None,
+        std: Optional[torch.Tensor] = None,
+        activation=None,
+        memory_format: torch.memory_format = torch.contiguous_format,
+    ):
+        if resize_method not in RESIZE_METHODS:
+            raise ValueError(f"Unsupported resize method: {resize_method}")
+        self.module = module.eval()
+        self.vocab = list(vocab)
+        # Taille cible (largeur, hauteur), comme fastai
+        self.size = tuple(int(s) for s in size)
+        self.resize_method = resize_method
+        self.resample = resample
+        self.mean = None if mean is None else mean.reshape(1, -1, 1, 1).float()
+        self.std = None if std is None else std.reshape(1, -1, 1, 1).float()
+        # Activation de la fonction de perte fastai, softmax par défaut
+        self.activation = activation
+        self.memory_format = memory_format
+
+    @classmethod
+    def from_learner(cls, learn) -> "InferenceEngine":
+        """Build an engine from a loaded fastai Learner."""
+        module = learn.model
+        if not isinstance(module, torch.nn.Module):
+            raise TypeError(f"Learner model is not a torch module: {type(module)}")
+
+        resizes = [tfm for tfm in learn.dls.after_item.fs if type(tfm).__name__ == "Resize"]
+        if not resizes:
+            raise ValueError("Learner has no Resize item transform")
+        resize = resizes[-1]
+
+        mean = std = None
+        for tfm in learn.dls.after_batch.fs:
+            if type(tfm).__name__ == "Normalize":
+                mean = tfm.mean.cpu().as_subclass(torch.Tensor)
+                std = tfm.std.cpu().as_subclass(torch.Tensor)
+
+        activation = getattr(learn.loss_func, "activation", None)
+        return cls(
+            module.cpu(),
+            learn.dls.vocab,
+            size=tuple(resize.size),
+            resize_method=str(resize.method),
+            resample=resize.mode,
+            mean=mean,
+            std=std,
+            activation=activation,
+        )
+
+    def resize(self, image: Image.Image) -> Image.Image:
+        """Validation-time equivalent of fastai's `Resize`."""
+        w, h = image.size
+        tw, th = self.size
+        if self.resize_method == "squish":
+            return image.resize((tw, th), self.resample)
+        # Recadrage central au ratio de la cible, puis redimensionnement
+        m = w / tw if w / tw < h / th else h / th
+        cw, ch = int(m * tw), int(m * th)
+        left, top = int(0.5 * (w - cw)), int(0.5 * (h - ch))
+        image = image.crop((left, top, left + cw, top + ch))
+        return image.resize((tw, th), self.resample)
+
+    def preprocess(self, images: Sequence) -> torch.Tensor:
+        """Resize each image and return a normalized float batch (N, C, H, W).
+
+        Items are PIL images, or uint8 (H, W, 3) arrays already at the model
+        input size, which skip the resize.
+        """
+        arrays = [
+            image if isinstance(image, np.ndarray) else np.asarray(self.resize(image), dtype=np.uint8)
+            for image in images
+        ]
+        batch = torch.from_numpy(np.stack(arrays)).permute(0, 3, 1, 2)
+        # La vue NHWC est déjà au format channels_last : copie seulement si besoin
+        batch = batch.contiguous(memory_format=self.memory_format)
+        return self.normalize(batch)
+
+    def normalize(self, batch: torch.Tensor) -> torch.Tensor:
+        """Convert a uint8 (N, C, H, W) batch to normalized floats."""
+        batch = batch.float().div_(255.0)
+        if self.mean is not None:
+            batch = batch.sub_(self.mean).div_(self.std)
+        return batch
+
+    def forward(self, batch: torch.Tensor) -> torch.Tensor:
+        """Return class probabilities for a preprocessed batch."""
+        with torch.inference_mode():
+            logits = self.module(batch)
+            if self.activation is None:
+                return F.softmax(logits, dim=-1)
+            return self.activation(logits)
+
+    def predict_batch(self, images: Sequence) -> List[tuple]:
+        """Predict a list of images with a single forward pass."""
+        probs = self.forward(self.preprocess(images))
+        return self.decode(probs)
+
+    def accepts(self, array: np.ndarray) -> bool:
+        """Whether a raw frame can be fed to `preprocess` without resizing."""
+        tw, th = self.size
+        return array.dtype == np.uint8 and array.shape == (th, tw, 3)
+
+    def decode(self, probs: torch.Tensor) -> List[tuple]:
+        idxs = probs.argmax(dim=-1)
+        return [(self.vocab[int(idx)], idx, p) for idx, p in zip(idxs, probs)]
+
+    def predict(self, image: Image.Image) -> tuple:
+        """Same output as `Learner.predict`: (class, class index, probabilities)."""
+        return self.predict_batch([image])[0]
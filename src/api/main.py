@@ -1,26 +1,176 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from contextlib import asynccontextmanager
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
+from typing import List
 from fastai.vision.all import load_learner
 from PIL import Image
 import numpy as np
-import io
 import os
 import logging
 from dotenv import load_dotenv
-import torchvision.transforms as transforms
 import torch
 import boto3
-from io import BytesIO
-import pickle
-from datetime import datetime
+from botocore.exceptions import ClientError
+import asyncio
+import json
+import threading
+import time
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from batching import MicroBatcher
+from archives import is_archive, iter_archive
+from artifact_cache import EXPORT_SUFFIX, ArtifactCache
+from prediction_cache import PredictionCache, content_hash
+from inference import InferenceEngine
+from decoding import ImageTooLargeError, decode_image as fast_decode_image
+from shared_weights import export_shared_weights, is_exported, load_shared_engine
+from optimization import OPTIMIZATION_MODES, AccuracyGateError, gate_optimization, load_validation_samples
 
 logging.basicConfig(level=logging.INFO)
 
 # Chargement des variables d'environnement
 load_dotenv()
 
-app = FastAPI()
+# Après load_dotenv : prometheus_client choisit son mode (PROMETHEUS_MULTIPROC_DIR) à l'import
+import metrics  # noqa: E402
+
+# Chargement et préchauffage du modèle au démarrage
+EAGER_MODEL_LOAD = os.getenv("EAGER_MODEL_LOAD", "true").lower() == "true"
+
+@asynccontextmanager
+async def lifespan(app):
+    if EAGER_MODEL_LOAD:
+        try:
+            await asyncio.to_thread(get_model)
+        except Exception as e:
+            logging.warning(f"Model not loaded at startup, will retry on first request: {e}")
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 model = None
+model_info = None
+# Moteur fp32 du modèle servi : base et référence de toute optimisation
+fp32_model = None
+# Version du modèle et mode d'optimisation servis, dans la clé du cache de prédictions
+cache_version = None
+
+# Un seul chargement à la fois : les requêtes concurrentes attendent le même
+model_lock = threading.Lock()
+reload_lock = threading.Lock()
+reload_status = {"state": "idle", "error": None}
+
+# Moteur d'inférence : "lean" (torch direct) ou "fastai" (Learner.predict)
+INFERENCE_ENGINE = os.getenv("INFERENCE_ENGINE", "lean")
+
+# "mmap" : poids exportés en fichier brut et partagés entre workers via mmap
+SERVING_MODE = os.getenv("SERVING_MODE", "pickle")
+
+# Micro-batching des requêtes /predict concurrentes
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "8"))
+MAX_BATCH_WAIT_MS = float(os.getenv("MAX_BATCH_WAIT_MS", "5"))
+
+# Décodage hors de la boucle asyncio et taille maximale des fichiers
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", str(min(4, os.cpu_count() or 1))))
+DECODE_EXECUTOR = os.getenv("DECODE_EXECUTOR", "thread")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+
+# Décodage JPEG à échelle réduite (draft) au plus près de la taille du modèle
+DECODE_DRAFT = os.getenv("DECODE_DRAFT", "true").lower() == "true"
+DECODE_TARGET_SIZE = int(os.getenv("DECODE_TARGET_SIZE", "224"))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))
+
+# Trames brutes (/predict_raw) : nombre maximal d'images par requête
+MAX_RAW_FRAMES = int(os.getenv("MAX_RAW_FRAMES", "64"))
+
+# Nombre maximal de requêtes en cours : au-delà, réponse 503 immédiate
+MAX_INFLIGHT_REQUESTS = int(os.getenv("MAX_INFLIGHT_REQUESTS", "64"))
+
+# Threads intra-op de torch : les cœurs sont partagés entre les workers uvicorn
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+TORCH_NUM_THREADS = int(
+    os.getenv("TORCH_NUM_THREADS") or max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)
+)
+
+# Emplacement des modèles dans MinIO et pointeur vers le modèle courant
+MODEL_BUCKET = os.getenv("MODEL_BUCKET", "models")
+MODEL_PREFIX = os.getenv("MODEL_PREFIX", "")
+MODEL_MANIFEST_KEY = os.getenv("MODEL_MANIFEST_KEY", "latest.json")
+
+# Cache local des modèles téléchargés depuis MinIO, indexé par bucket/clé/ETag
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "model_cache"))
+MODEL_CACHE_MAX_BYTES = int(os.getenv("MODEL_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+artifact_cache = ArtifactCache(MODEL_CACHE_DIR, MODEL_CACHE_MAX_BYTES)
+
+# Cache des prédictions indexé par le contenu de l'image et la version du modèle
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "1024"))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "3600"))
+
+prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL)
+
+# Optimisation CPU (channels_last, int8) validée sur des images étiquetées
+OPTIMIZE_MODE = os.getenv("OPTIMIZE_MODE", "none")
+OPTIMIZE_TOLERANCE = float(os.getenv("OPTIMIZE_TOLERANCE", "0.01"))
+VALIDATION_DIR = os.getenv("VALIDATION_DIR", "")
+VALIDATION_LIMIT = int(os.getenv("VALIDATION_LIMIT", "200"))
+
+optimization_report = None
+
+torch.set_num_threads(TORCH_NUM_THREADS)
+try:
+    # Une seule passe forward à la fois (worker du micro-batcher)
+    torch.set_num_interop_threads(1)
+except RuntimeError:
+    pass
+
+decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+process_pool = (
+    ProcessPoolExecutor(max_workers=DECODE_WORKERS) if DECODE_EXECUTOR == "process" else None
+)
+inflight_slots = threading.BoundedSemaphore(MAX_INFLIGHT_REQUESTS)
+
+def read_model_manifest(s3):
+    # Pointeur "modèle courant" écrit par save_model.py
+    try:
+        obj = s3.get_object(Bucket=MODEL_BUCKET, Key=MODEL_MANIFEST_KEY)
+        manifest = json.loads(obj['Body'].read())
+        key = manifest['key']
+        head = s3.head_object(Bucket=MODEL_BUCKET, Key=key)
+    except ClientError as e:
+        logging.info(f"No usable model manifest ({e.response.get('Error', {}).get('Code')})")
+        return None
+    except (ValueError, KeyError, TypeError) as e:
+        logging.warning(f"Invalid model manifest {MODEL_BUCKET}/{MODEL_MANIFEST_KEY}: {e}")
+        return None
+
+    return {
+        'Bucket': MODEL_BUCKET,
+        'Key': key,
+        'LastModified': head['LastModified'],
+        'ETag': head.get('ETag'),
+    }
+
+def scan_latest_model(s3):
+    # Repli : parcours paginé limité au bucket et au préfixe des modèles
+    latest_model_info = None
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=MODEL_BUCKET, Prefix=MODEL_PREFIX):
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            if key.endswith('.pkl'):  # Vérifier si c'est un fichier .pkl
+                last_modified = obj['LastModified']
+                if latest_model_info is None or last_modified > latest_model_info['LastModified']:
+                    latest_model_info = {
+                        'Bucket': MODEL_BUCKET,
+                        'Key': key,
+                        'LastModified': last_modified,
+                        'ETag': obj.get('ETag'),
+                    }
+    return latest_model_info
 
 def find_latest_model():
     # Connexion à MinIO
@@ -30,38 +180,23 @@ def find_latest_model():
         aws_access_key_id=os.getenv("MINIO_ROOT_USER"),
         aws_secret_access_key=os.getenv("MINIO_ROOT_PASSWORD")
         )
-    
-    latest_model_info = None
 
-    # Lister tous les buckets
-    buckets = s3.list_buckets()['Buckets']
-    for bucket in buckets:
-        bucket_name = bucket['Name']
-        logging.info(f"Exploring bucket: {bucket_name}")
-        
-        # Lister les objets dans le bucket
-        objects = s3.list_objects_v2(Bucket=bucket_name)
-        if 'Contents' in objects:
-            for obj in objects['Contents']:
-                key = obj['Key']
-                if key.endswith('.pkl'):  # Vérifier si c'est un fichier .pkl
-                    last_modified = obj['LastModified']
-                    if latest_model_info is None or last_modified > latest_model_info['LastModified']:
-                        latest_model_info = {
-                            'Bucket': bucket_name,
-                            'Key': key,
-                            'LastModified': last_modified
-                        }
-    
+    latest_model_info = read_model_manifest(s3)
     if latest_model_info is None:
-        raise FileNotFoundError("No .pkl model files found in any bucket.")
-    
+        latest_model_info = scan_latest_model(s3)
+
+    if latest_model_info is None:
+        raise FileNotFoundError(
+            f"No .pkl model files found in bucket '{MODEL_BUCKET}' with prefix '{MODEL_PREFIX}'."
+        )
+
     logging.info(f"Latest model found: {latest_model_info}")
     return latest_model_info
 
-def load_model():
+def load_model(latest_model_info=None):
     # Trouver le modèle le plus récent
-    latest_model_info = find_latest_model()
+    if latest_model_info is None:
+        latest_model_info = find_latest_model()
     bucket_name = latest_model_info['Bucket']
     key = latest_model_info['Key']
 
@@ -72,10 +207,39 @@ def load_model():
         aws_access_key_id=os.getenv("MINIO_ROOT_USER"),
         aws_secret_access_key=os.getenv("MINIO_ROOT_PASSWORD")
         )
-    obj = s3.get_object(Bucket=bucket_name, Key=key)
-    model_bytes = BytesIO(obj['Body'].read())
 
-    return load_learner(model_bytes)
+    def download(f):
+        # Téléchargement en flux vers un fichier, sans copie complète en mémoire
+        obj = s3.get_object(Bucket=bucket_name, Key=key)
+        shutil.copyfileobj(obj['Body'], f, DOWNLOAD_CHUNK_BYTES)
+
+    etag = latest_model_info.get('ETag')
+    if etag:
+        return load_learner(artifact_cache.fetch(bucket_name, key, etag, download))
+
+    # Sans ETag, impossible de valider une entrée du cache : fichier temporaire
+    with tempfile.NamedTemporaryFile(suffix=".pkl") as f:
+        download(f)
+        f.flush()
+        return load_learner(f.name)
+
+def decode_image(contents, target=None):
+    return fast_decode_image(contents, target=target, max_pixels=MAX_IMAGE_PIXELS)
+
+def decode_target():
+    # Taille d'entrée du modèle servi : inutile de décoder plus de pixels
+    if not DECODE_DRAFT:
+        return None
+    if isinstance(model, InferenceEngine):
+        return model.size
+    return DECODE_TARGET_SIZE, DECODE_TARGET_SIZE
+
+def decode(contents):
+    target = decode_target()
+    # En mode "process", le décodage s'exécute dans un pool de processus
+    if process_pool is not None:
+        return process_pool.submit(decode_image, contents, target).result()
+    return decode_image(contents, target)
 
 def predict_image(image, model):
     result = model.predict(image)
@@ -85,25 +249,487 @@ def predict_image(image, model):
     confidence = probs.max().item()
     return class_name, confidence
 
-@app.post("/predict")
-async def predict(file: UploadFile = File(...)):
-    global model
+def predict_images(images, model):
+    metrics.BATCH_SIZE.observe(len(images))
+    # Moteur léger : une passe forward directe sur le batch
+    if isinstance(model, InferenceEngine):
+        with metrics.timed("preprocess"):
+            batch = model.preprocess(images)
+        with metrics.timed("forward"):
+            probs = model.forward(batch)
+        return [(class_name, probs.max().item()) for class_name, _, probs in model.decode(probs)]
+
+    # Trames brutes (/predict_raw) : fastai attend des images PIL
+    images = [Image.fromarray(image) if isinstance(image, np.ndarray) else image for image in images]
+
+    # Une seule image : pas besoin de construire un DataLoader de test
+    if len(images) == 1:
+        with metrics.timed("forward"):
+            return [predict_image(images[0], model)]
+
+    # Plusieurs images : une seule passe forward sur tout le batch
+    # (avec fastai, le prétraitement est compté dans "forward")
+    with metrics.timed("forward"):
+        dl = model.dls.test_dl(images, bs=len(images))
+        with model.no_bar():
+            probs, _, decoded = model.get_preds(dl=dl, with_decoded=True)
+    vocab = model.dls.vocab
+    return [
+        (vocab[int(idx)], p.max().item())
+        for idx, p in zip(decoded, probs)
+    ]
+
+def warm_up(model):
+    # Passe forward factice pour initialiser les poids et les kernels
+    dummy = Image.new("RGB", (224, 224))
+    predict_image(dummy, model)
+    return model
 
-    if model is None:
+def build_predictor(learner):
+    # Extrait le module torch du Learner pour éviter le pipeline fastai à chaque appel
+    if INFERENCE_ENGINE != "lean":
+        return learner
+    try:
+        return InferenceEngine.from_learner(learner)
+    except Exception as e:
+        logging.warning(f"Lean inference unavailable, using Learner.predict: {e}")
+        return learner
+
+def load_mmap_predictor(info):
+    # Export partagé à côté du .pkl en cache, un par version (ETag) du modèle
+    artifact_path = artifact_cache.path_for(info['Bucket'], info['Key'], info['ETag'])
+    shared_dir = artifact_path + EXPORT_SUFFIX
+    if is_exported(shared_dir):
         try:
-            model = load_model()
+            engine = load_shared_engine(shared_dir)
+            serve_from_cache(artifact_path)
+            return engine
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Could not load model: {str(e)}")
+            logging.warning(f"Could not map shared weights from {shared_dir}: {e}")
+            shutil.rmtree(shared_dir, ignore_errors=True)
+
+    predictor = build_predictor(load_model(info))
+    if not isinstance(predictor, InferenceEngine):
+        return predictor
+    export_shared_weights(predictor, shared_dir)
+    logging.info(f"Exported memory-mappable weights to {shared_dir}")
+    engine = load_shared_engine(shared_dir)
+    serve_from_cache(artifact_path)
+    return engine
+
+def serve_from_cache(artifact_path):
+    # L'export mappé ne doit pas être évincé tant qu'il est servi ; sa taille compte dans le cache
+    os.utime(artifact_path + EXPORT_SUFFIX)
+    artifact_cache.pin(artifact_path)
+    artifact_cache.evict(keep=artifact_path)
+
+def run_optimization(predictor, mode):
+    # Lève une erreur si le moteur optimisé perd trop de précision
+    if mode not in OPTIMIZATION_MODES:
+        raise ValueError(f"Unknown optimization mode: {mode}")
+    if not isinstance(predictor, InferenceEngine):
+        raise ValueError("Optimization needs the lean inference engine")
+    if not VALIDATION_DIR or not os.path.isdir(VALIDATION_DIR):
+        raise ValueError("VALIDATION_DIR is not set or does not exist")
+    samples = load_validation_samples(VALIDATION_DIR, VALIDATION_LIMIT)
+    return gate_optimization(predictor, mode, samples, OPTIMIZE_TOLERANCE, MAX_BATCH_SIZE)
+
+def optimize_predictor(predictor, mode=OPTIMIZE_MODE):
+    global optimization_report
+    if mode == "none":
+        optimization_report = None
+        return predictor
+    try:
+        optimized, report = run_optimization(predictor, mode)
+    except Exception as e:
+        # Le modèle fp32 reste servi si l'optimisation est refusée ou échoue
+        logging.warning(f"Optimization '{mode}' refused, serving fp32 model: {e}")
+        optimization_report = {"mode": mode, "applied": False, "error": str(e), **getattr(e, "report", {})}
+        return predictor
+    optimization_report = {"applied": True, **report}
+    return optimized
+
+def load_fp32_predictor(info):
+    if SERVING_MODE == "mmap" and info.get('ETag'):
+        return load_mmap_predictor(info)
+    return build_predictor(load_model(info))
+
+def load_predictor(info):
+    return optimize_predictor(load_fp32_predictor(info))
+
+def model_version(info):
+    if info is None:
+        return None
+    return f"{info['Bucket']}/{info['Key']}@{info['LastModified'].isoformat()}"
+
+def prepare_model(info):
+    # Renvoie le modèle à servir (optimisé ou non), son moteur fp32 et le mode d'optimisation
+    with metrics.MODEL_LOAD_SECONDS.time():
+        fp32 = load_fp32_predictor(info)
+        served = optimize_predictor(fp32)
+        mode = optimization_report["mode"] if served is not fp32 else "none"
+        return warm_up(served), fp32, mode
+
+def load_serving_model():
+    # Charge et préchauffe un nouveau modèle sans toucher au modèle servi
+    info = find_latest_model()
+    new_model, fp32, mode = prepare_model(info)
+    return new_model, info, fp32, mode
+
+def swap_model(new_model, info, fp32=None, mode="none"):
+    global model, model_info, fp32_model, cache_version
+    # Affectation atomique : une requête voit l'ancien ou le nouveau modèle
+    model = new_model
+    model_info = info
+    fp32_model = new_model if fp32 is None else fp32
+    # Une prédiction de l'ancien moteur mise en cache après clear() reste sous l'ancienne clé
+    cache_version = f"{model_version(info)}#{mode}"
+    # Les prédictions de l'ancien modèle ne doivent plus être servies
+    prediction_cache.clear()
+    metrics.set_model_version(model_version(info))
+    logging.info(f"Serving model {model_version(info)}")
 
+def get_model():
+    if model is not None:
+        return model
+    with model_lock:
+        if model is None:
+            swap_model(*load_serving_model())
+    return model
+
+def reload_model(force=False):
+    if not reload_lock.acquire(blocking=False):
+        return False
+    try:
+        reload_status.update(state="reloading", error=None)
+        info = find_latest_model()
+        if not force and model is not None and model_version(info) == model_version(model_info):
+            logging.info("Model unchanged, reload skipped")
+        else:
+            new_model, fp32, mode = prepare_model(info)
+            swap_model(new_model, info, fp32, mode)
+        reload_status.update(state="idle")
+    except Exception as e:
+        logging.exception("Model reload failed")
+        reload_status.update(state="failed", error=str(e))
+    finally:
+        reload_lock.release()
+    return True
+
+batcher = MicroBatcher(
+    lambda images: predict_images(images, model),
+    max_batch_size=MAX_BATCH_SIZE,
+    max_wait_ms=MAX_BATCH_WAIT_MS,
+)
+
+@app.post("/reload", status_code=202)
+def reload(force: bool = False):
+    # Chargement en arrière-plan : le modèle courant continue de servir
+    if reload_lock.locked():
+        return {"status": "already reloading", "model_version": model_version(model_info)}
+    threading.Thread(target=reload_model, args=(force,), daemon=True).start()
+    return {"status": "reloading", "model_version": model_version(model_info)}
+
+@app.get("/model")
+def model_status():
+    return {
+        "loaded": model is not None,
+        "model_version": model_version(model_info),
+        "reload": reload_status,
+        "optimization": optimization_report,
+        # Taille attendue des trames envoyées à /predict_raw
+        "input_shape": [model.size[1], model.size[0], 3] if isinstance(model, InferenceEngine) else None,
+    }
+
+def optimize_serving_model(mode):
+    # Chargement, optimisation et préchauffage hors de la boucle d'événements ;
+    # toujours à partir du moteur fp32, jamais d'un modèle déjà optimisé
+    get_model()
+    fp32, info = fp32_model, model_info
+    if mode == "none":
+        return warm_up(fp32), {"mode": "none"}, info, fp32
+    optimized, report = run_optimization(fp32, mode)
+    return warm_up(optimized), report, info, fp32
+
+def swap_if_unchanged(new_model, info, fp32, mode):
+    # Un rechargement pendant l'optimisation a priorité sur le modèle optimisé
+    with reload_lock:
+        if model_version(model_info) != model_version(info):
+            return False
+        swap_model(new_model, info, fp32, mode)
+        return True
+
+@app.post("/optimize")
+async def optimize(mode: str):
+    # Optimise le modèle servi ; il n'est remplacé que si le contrôle de précision passe.
+    # mode=none revient au modèle fp32
+    global optimization_report
     try:
+        optimized, report, info, fp32 = await asyncio.to_thread(optimize_serving_model, mode)
+    except AccuracyGateError as e:
+        raise HTTPException(status_code=409, detail={"error": str(e), "report": e.report})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not await asyncio.to_thread(swap_if_unchanged, optimized, info, fp32, mode):
+        raise HTTPException(
+            status_code=409, detail="The served model changed during optimization, retry"
+        )
+    optimization_report = {"applied": True, **report}
+    return optimization_report
+
+@app.get("/health")
+def health():
+    return {"status": "ok", "model_loaded": model is not None}
+
+@app.get("/batching/stats")
+def batching_stats():
+    return batcher.stats()
+
+@app.get("/cache/stats")
+def cache_stats():
+    return prediction_cache.stats()
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+def prediction_key(contents):
+    return content_hash(contents), cache_version
+
+def overloaded():
+    return HTTPException(
+        status_code=503, detail="Server busy, retry later", headers={"Retry-After": "1"}
+    )
+
+def submit_inference(image):
+    # Durée entre la soumission au micro-batcher et le résultat (attente comprise)
+    start = time.perf_counter()
+    future = batcher.submit(image)
+    future.add_done_callback(lambda _: metrics.observe("inference", time.perf_counter() - start))
+    return future
+
+@app.post("/predict")
+async def predict(file: UploadFile = File(...)):
+    if not inflight_slots.acquire(blocking=False):
+        metrics.request_rejected("predict")
+        raise overloaded()
+    start = metrics.request_started("predict")
+    try:
+        return await run_predict(file)
+    finally:
+        metrics.request_finished("predict", start)
+        inflight_slots.release()
+
+async def run_predict(file):
+    try:
+        await asyncio.to_thread(get_model)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Could not load model: {str(e)}")
+
+    with metrics.timed("read"):
         contents = await file.read()
-        image = Image.open(io.BytesIO(contents)).convert("RGB")
+
+    # Hachage et décodage dans le pool : la boucle asyncio reste disponible
+    loop = asyncio.get_running_loop()
+    key, cached, image = await loop.run_in_executor(decode_pool, prepare_payload, contents)
+    if cached is not None:
+        class_name, confidence = cached
+        return {"prediction": class_name, "probability": confidence}
+    if isinstance(image, Exception):
+        raise HTTPException(status_code=400, detail=str(image))
+
+    try:
+        class_name, confidence = await asyncio.wrap_future(submit_inference(image))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    prediction_cache.put(key, (class_name, confidence))
+    return {"prediction": class_name, "probability": confidence}
+
+
+def iter_batch_payloads(files):
+    # Chaque fichier est soit une image, soit une archive zip/tar d'images
+    for upload in files:
+        upload.file.seek(0)
+        if is_archive(upload.file, upload.filename):
+            try:
+                for name, payload in iter_archive(upload.file, MAX_UPLOAD_BYTES):
+                    yield name, payload
+            except Exception as e:
+                yield upload.filename, ValueError(f"Invalid archive: {e}")
+        else:
+            yield upload.filename, upload.file.read(MAX_UPLOAD_BYTES + 1)
+
+def prepare_payload(payload):
+    # Renvoie (clé de cache, prédiction en cache, image décodée ou erreur)
+    if isinstance(payload, Exception):
+        return None, None, payload
+    if len(payload) > MAX_UPLOAD_BYTES:
+        return None, None, ValueError("File too large")
+    key = prediction_key(payload)
+    cached = prediction_cache.get(key)
+    if cached is not None:
+        return key, cached, None
+    try:
+        with metrics.timed("decode"):
+            return key, None, decode(payload)
+    except ImageTooLargeError as e:
+        return key, None, e
     except Exception:
-        raise HTTPException(status_code=400, detail="Invalid image file")
+        return key, None, ValueError("Invalid image file")
+
+async def stream_batch_predictions(files):
+    loop = asyncio.get_running_loop()
+    payloads = iter_batch_payloads(files)
+    index = 0
+
+    def next_chunk():
+        # Lecture d'au plus MAX_BATCH_SIZE fichiers : la mémoire reste bornée
+        chunk = []
+        while len(chunk) < MAX_BATCH_SIZE:
+            start = time.perf_counter()
+            item = next(payloads, None)
+            if item is None:
+                break
+            metrics.observe("read", time.perf_counter() - start)
+            chunk.append(item)
+        return chunk
+
+    while True:
+        chunk = await loop.run_in_executor(decode_pool, next_chunk)
+        if not chunk:
+            break
+
+        # Décodage en parallèle, puis inférence par batch via le micro-batcher
+        prepared = await asyncio.gather(*(
+            loop.run_in_executor(decode_pool, prepare_payload, payload)
+            for _, payload in chunk
+        ))
+        futures = [
+            submit_inference(image) if cached is None and not isinstance(image, Exception) else None
+            for _, cached, image in prepared
+        ]
+
+        for (name, _), (key, cached, image), future in zip(chunk, prepared, futures):
+            line = {"index": index, "filename": name}
+            if cached is not None:
+                line.update(prediction=cached[0], probability=cached[1])
+            elif future is None:
+                line["error"] = str(image)
+            else:
+                try:
+                    class_name, confidence = await asyncio.wrap_future(future)
+                    line.update(prediction=class_name, probability=confidence)
+                    prediction_cache.put(key, (class_name, confidence))
+                except Exception as e:
+                    line["error"] = str(e)
+            index += 1
+            yield json.dumps(line) + "\n"
+
+@app.post("/predict_batch")
+async def predict_batch(files: List[UploadFile] = File(...)):
+    if not inflight_slots.acquire(blocking=False):
+        metrics.request_rejected("predict_batch")
+        raise overloaded()
+    start = metrics.request_started("predict_batch")
+    try:
+        await asyncio.to_thread(get_model)
+    except Exception as e:
+        metrics.request_finished("predict_batch", start)
+        inflight_slots.release()
+        raise HTTPException(status_code=500, detail=f"Could not load model: {str(e)}")
+
+    released = False
+
+    def release():
+        # Une seule libération, que le flux ait été parcouru ou non
+        nonlocal released
+        if not released:
+            released = True
+            metrics.request_finished("predict_batch", start)
+            inflight_slots.release()
 
+    async def stream():
+        # Le créneau reste occupé jusqu'à la fin du flux
+        try:
+            async for line in stream_batch_predictions(files):
+                yield line
+        finally:
+            release()
+
+    # La tâche de fond s'exécute même si le client se déconnecte avant le début du flux
+    return StreamingResponse(stream(), media_type="application/x-ndjson", background=BackgroundTask(release))
+
+def parse_raw_shape(header):
+    # "H,W,3" pour une trame, "N,H,W,3" pour un batch
+    try:
+        shape = tuple(int(dim) for dim in header.split(","))
+    except (AttributeError, ValueError):
+        raise HTTPException(status_code=400, detail="X-Image-Shape must be 'H,W,3' or 'N,H,W,3'")
+    if len(shape) not in (3, 4) or shape[-1] != 3 or min(shape) < 1:
+        raise HTTPException(status_code=400, detail=f"Invalid X-Image-Shape {header}: expected 'H,W,3' or 'N,H,W,3'")
+    if len(shape) == 4 and shape[0] > MAX_RAW_FRAMES:
+        raise HTTPException(status_code=400, detail=f"Too many frames: {shape[0]} > {MAX_RAW_FRAMES}")
+    if shape[-3] * shape[-2] > MAX_IMAGE_PIXELS:
+        raise HTTPException(status_code=400, detail=f"Image too large: {shape[-2]}x{shape[-3]} pixels")
+    return shape
+
+async def read_raw_body(request, expected_bytes):
+    # Lecture en flux, arrêtée dès que le corps dépasse la taille annoncée par la forme
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > expected_bytes:
+            break
+    return body
+
+@app.post("/predict_raw")
+async def predict_raw(request: Request):
+    if not inflight_slots.acquire(blocking=False):
+        metrics.request_rejected("predict_raw")
+        raise overloaded()
+    start = metrics.request_started("predict_raw")
     try:
-        class_name, confidence = predict_image(image, model)
+        return await run_predict_raw(request)
+    finally:
+        metrics.request_finished("predict_raw", start)
+        inflight_slots.release()
+
+async def run_predict_raw(request):
+    # Pixels RGB uint8 bruts, sans décodage PIL : la forme est donnée par l'en-tête
+    shape = parse_raw_shape(request.headers.get("X-Image-Shape"))
+    expected_bytes = int(np.prod(shape))
+    if expected_bytes > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Body of {expected_bytes} bytes exceeds {MAX_UPLOAD_BYTES}")
+    length = request.headers.get("Content-Length")
+    if length is not None and length.isdigit() and int(length) != expected_bytes:
+        raise HTTPException(status_code=400, detail=f"Expected {expected_bytes} bytes for shape {shape}, got {length}")
+
+    try:
+        current = await asyncio.to_thread(get_model)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Could not load model: {str(e)}")
+    # Forme vérifiée avant de lire le corps
+    if isinstance(current, InferenceEngine) and shape[-3:] != (current.size[1], current.size[0], 3):
+        tw, th = current.size
+        raise HTTPException(status_code=400, detail=f"Frames must be pre-resized to {th},{tw},3")
+
+    with metrics.timed("read"):
+        body = await read_raw_body(request, expected_bytes)
+    if len(body) != expected_bytes:
+        raise HTTPException(status_code=400, detail=f"Expected {expected_bytes} bytes for shape {shape}, got {len(body)}")
+
+    # Vue sur le corps de la requête, sans copie
+    frames = np.frombuffer(body, dtype=np.uint8).reshape((-1,) + shape[-3:])
+
+    try:
+        results = await asyncio.gather(*(
+            asyncio.wrap_future(submit_inference(frame)) for frame in frames
+        ))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
-    
-    return {"prediction": class_name, "probability": confidence}
\ No newline at end of file
+
+    predictions = [
+        {"prediction": class_name, "probability": confidence} for class_name, confidence in results
+    ]
+    return predictions[0] if len(shape) == 3 else {"predictions": predictions}
@@ -0,0 +1,150 @@
+"""
+Prometheus metrics for the prediction API.
+
+Each request is split into stages (upload read, decode, batcher wait plus
+inference, preprocessing, forward pass) recorded in one latency histogram
+labelled by stage, so a slow p99 can be traced back to the stage it comes
+from. Histogram children are bound once at import: recording a sample is a
+`perf_counter` call and a locked increment, cheap enough to stay on in
+production.
+
+With several uvicorn workers, set `PROMETHEUS_MULTIPROC_DIR` to an empty
+directory shared by the workers so `/metrics` aggregates all of them.
+"""
+
+import os
+import threading
+import time
+from typing import Optional
+
+# prometheus_client passe en mode multiprocess dès que la variable existe, même vide
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR") == "":
+    del os.environ["PROMETHEUS_MULTIPROC_DIR"]
+
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+
+# read: lecture de l'upload ou du corps brut, decode: décodage PIL, inference: attente du batcher
+# et passe complète, preprocess/forward: détail de la passe du moteur léger
+STAGES = ("read", "decode", "inference", "preprocess", "forward")
+ENDPOINTS = ("predict", "predict_batch", "predict_raw")
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+MODEL_LOAD_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+STAGE_SECONDS = Histogram(
+    "api_stage_duration_seconds",
+    "Time spent in each stage of a prediction",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "api_request_duration_seconds",
+    "End-to-end duration of prediction requests",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+INFLIGHT_REQUESTS = Gauge(
+    "api_inflight_requests",
+    "Prediction requests currently being served",
+    ["endpoint"],
+    multiprocess_mode="livesum",
+)
+REJECTED_REQUESTS = Counter(
+    "api_rejected_requests",
+    "Prediction requests rejected because the server was overloaded",
+    ["endpoint"],
+)
+BATCH_SIZE = Histogram(
+    "api_inference_batch_size",
+    "Number of images per forward pass",
+    buckets=BATCH_SIZE_BUCKETS,
+)
+MODEL_LOAD_SECONDS = Histogram(
+    "api_model_load_duration_seconds",
+    "Time to download, load and warm up a model",
+    buckets=MODEL_LOAD_BUCKETS,
+)
+MODEL_INFO = Gauge(
+    "api_model_info",
+    "Model version currently served (1) and previously served versions (0)",
+    ["version"],
+    multiprocess_mode="liveall",
+)
+
+_stages = {stage: STAGE_SECONDS.labels(stage) for stage in STAGES}
+_requests = {endpoint: REQUEST_SECONDS.labels(endpoint) for endpoint in ENDPOINTS}
+_inflight = {endpoint: INFLIGHT_REQUESTS.labels(endpoint) for endpoint in ENDPOINTS}
+_model_lock = threading.Lock()
+_model_version = None
+
+
+def observe(stage: str, seconds: float):
+    _stages[stage].observe(seconds)
+
+
+class _Timer:
+    # Plus léger qu'un @contextmanager sur le chemin critique
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+def timed(stage: str) -> _Timer:
+    """Context manager recording the duration of its block under `stage`."""
+    return _Timer(_stages[stage])
+
+
+def request_started(endpoint: str) -> float:
+    _inflight[endpoint].inc()
+    return time.perf_counter()
+
+
+def request_finished(endpoint: str, start: float):
+    _inflight[endpoint].dec()
+    _requests[endpoint].observe(time.perf_counter() - start)
+
+
+def request_rejected(endpoint: str):
+    REJECTED_REQUESTS.labels(endpoint).inc()
+
+
+def set_model_version(version: Optional[str]):
+    global _model_version
+    with _model_lock:
+        # Remise à 0 plutôt que suppression : compatible avec le mode multiprocess
+        if _model_version is not None:
+            MODEL_INFO.labels(_model_version).set(0)
+        _model_version = version
+        if version is not None:
+            MODEL_INFO.labels(version).set(1)
+
+
+def render() -> bytes:
+    """Metrics in the Prometheus text format."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
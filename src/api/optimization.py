@@ -0,0 +1,188 @@
+"""
+Optimized CPU inference modes with an accuracy gate.
+
+`optimize_engine` derives a new `InferenceEngine` from an fp32 one using:
+
+- "channels_last": NHWC memory format for the convolutions;
+- "dynamic": dynamic INT8 quantization of the Linear layers;
+- "static": static INT8 quantization of the whole network (FX graph mode),
+  calibrated on sample images.
+
+`gate_optimization` measures accuracy and latency of both engines on
+held-out validation images and raises `AccuracyGateError` when the optimized
+engine loses more than the allowed accuracy.
+"""
+
+import copy
+import itertools
+import logging
+import os
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import torch
+from PIL import Image
+
+from inference import InferenceEngine
+
+OPTIMIZATION_MODES = ("channels_last", "dynamic", "static")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+class AccuracyGateError(RuntimeError):
+    """Raised when an optimized engine is not accurate enough to be served."""
+
+    def __init__(self, message: str, report: dict):
+        super().__init__(message)
+        self.report = report
+
+
+def load_validation_samples(directory: str, limit: Optional[int] = None) -> List[Tuple[Image.Image, str]]:
+    """Load (image, label) pairs from a `<label>/<image>` folder tree."""
+    paths_by_label = {}
+    for label in sorted(os.listdir(directory)):
+        label_dir = os.path.join(directory, label)
+        if os.path.isdir(label_dir):
+            paths_by_label[label] = [
+                os.path.join(label_dir, name)
+                for name in sorted(os.listdir(label_dir))
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            ]
+
+    # Alterne les classes pour qu'une limite garde un échantillon équilibré
+    paths = [
+        (path, label)
+        for group in itertools.zip_longest(*[
+            [(path, label) for path in label_paths] for label, label_paths in paths_by_label.items()
+        ])
+        for path, label in filter(None, group)
+    ]
+    if limit is not None:
+        paths = paths[:limit]
+
+    samples = []
+    for path, label in paths:
+        with Image.open(path) as image:
+            samples.append((image.convert("RGB"), label))
+    return samples
+
+
+def _batches(items: Sequence, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def optimize_engine(
+    engine: InferenceEngine,
+    mode: str,
+    calibration: Sequence[Image.Image] = (),
+    batch_size: int = 8,
+) -> InferenceEngine:
+    """Return a new engine running an optimized copy of `engine.module`."""
+    if mode not in OPTIMIZATION_MODES:
+        raise ValueError(f"Unknown optimization mode: {mode}")
+
+    module = copy.deepcopy(engine.module).eval()
+    memory_format = torch.contiguous_format
+    if mode == "channels_last":
+        module = module.to(memory_format=torch.channels_last)
+        memory_format = torch.channels_last
+    elif mode == "dynamic":
+        module = torch.ao.quantization.quantize_dynamic(
+            module, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    else:
+        if not calibration:
+            raise ValueError("Static quantization needs calibration images")
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+        example = engine.preprocess(list(calibration[:1]))
+        qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+        prepared = prepare_fx(module, qconfig_mapping, example_inputs=(example,))
+        # Calibration des observateurs sur des images réelles
+        with torch.inference_mode():
+            for batch in _batches(list(calibration), batch_size):
+                prepared(engine.preprocess(batch))
+        module = convert_fx(prepared)
+
+    return InferenceEngine(
+        module,
+        engine.vocab,
+        size=engine.size,
+        resize_method=engine.resize_method,
+        resample=engine.resample,
+        mean=engine.mean,
+        std=engine.std,
+        activation=engine.activation,
+        memory_format=memory_format,
+    )
+
+
+def evaluate_engine(
+    engine: InferenceEngine,
+    samples: Sequence[Tuple[Image.Image, str]],
+    batch_size: int = 8,
+) -> dict:
+    """Accuracy and forward latency (ms per image) on labelled samples."""
+    correct = 0
+    forward_seconds = 0.0
+    for batch in _batches(list(samples), batch_size):
+        inputs = engine.preprocess([image for image, _ in batch])
+        start = time.perf_counter()
+        probs = engine.forward(inputs)
+        forward_seconds += time.perf_counter() - start
+        for (class_name, _, _), (_, label) in zip(engine.decode(probs), batch):
+            correct += class_name == label
+    return {
+        "samples": len(samples),
+        "accuracy": correct / len(samples) if samples else 0.0,
+        "latency_ms_per_image": 1000 * forward_seconds / len(samples) if samples else 0.0,
+    }
+
+
+def gate_optimization(
+    engine: InferenceEngine,
+    mode: str,
+    samples: Sequence[Tuple[Image.Image, str]],
+    tolerance: float,
+    batch_size: int = 8,
+) -> Tuple[InferenceEngine, dict]:
+    """Build the optimized engine and check it against the fp32 one.
+
+    A quarter of the samples (at most 32) calibrates static quantization and
+    the rest is used for the comparison. Returns the optimized engine and the
+    report, or raises `AccuracyGateError`.
+    """
+    samples = list(samples)
+    n_calibration = min(32, len(samples) // 4) if mode == "static" else 0
+    calibration = [image for image, _ in samples[:n_calibration]]
+    held_out = samples[n_calibration:]
+    if not held_out:
+        raise AccuracyGateError("No validation images to check the optimized model", {"mode": mode})
+
+    optimized = optimize_engine(engine, mode, calibration, batch_size)
+    # Une passe de chauffe pour chaque moteur avant de mesurer la latence
+    warm_up = engine.preprocess([held_out[0][0]])
+    engine.forward(warm_up)
+    optimized.forward(warm_up)
+
+    baseline = evaluate_engine(engine, held_out, batch_size)
+    candidate = evaluate_engine(optimized, held_out, batch_size)
+    report = {
+        "mode": mode,
+        "tolerance": tolerance,
+        "fp32": baseline,
+        "optimized": candidate,
+        "accuracy_drop": baseline["accuracy"] - candidate["accuracy"],
+        "speedup": (
+            baseline["latency_ms_per_image"] / candidate["latency_ms_per_image"]
+            if candidate["latency_ms_per_image"] else None
+        ),
+    }
+    logging.info(f"Optimization report: {report}")
+    if report["accuracy_drop"] > tolerance:
+        raise AccuracyGateError(
+            f"Accuracy drop {report['accuracy_drop']:.4f} exceeds tolerance {tolerance}", report
+        )
+    return optimized, report
@@ -0,0 +1,145 @@
+"""
+Memory-mapped model weights shared between API worker processes.
+
+`export_shared_weights` splits an `InferenceEngine` into a small skeleton
+(module structure with empty tensors, vocab and preprocessing settings) and a
+raw `weights.bin` file holding every parameter and buffer back to back.
+`load_shared_engine` maps `weights.bin` read-only and points the module's
+tensors straight into the mapping, so every worker on the node reads the same
+page-cache pages instead of holding its own copy of the weights.
+"""
+
+import copy
+import json
+import os
+import shutil
+import tempfile
+import warnings
+
+import numpy as np
+import torch
+
+from inference import InferenceEngine
+
+SKELETON_FILE = "skeleton.pt"
+WEIGHTS_FILE = "weights.bin"
+INDEX_FILE = "index.json"
+ALIGNMENT = 64
+
+
+def _numpy_dtype(dtype: torch.dtype) -> np.dtype:
+    return torch.empty(0, dtype=dtype).numpy().dtype
+
+
+def is_exported(directory: str) -> bool:
+    return all(
+        os.path.exists(os.path.join(directory, name))
+        for name in (SKELETON_FILE, WEIGHTS_FILE, INDEX_FILE)
+    )
+
+
+def _set_tensor(module: torch.nn.Module, name: str, tensor: torch.Tensor):
+    *path, attr = name.split(".")
+    owner = module.get_submodule(".".join(path)) if path else module
+    if attr in owner._parameters:
+        owner._parameters[attr] = torch.nn.Parameter(tensor, requires_grad=False)
+    else:
+        owner._buffers[attr] = tensor
+
+
+def export_shared_weights(engine: InferenceEngine, directory: str) -> str:
+    """Write the engine as skeleton + raw weights into `directory`.
+
+    The directory is built next to its destination and renamed into place, so
+    concurrent workers either see a complete export or none.
+    """
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent, suffix=".part")
+    try:
+        index = {}
+        offset = 0
+        state = engine.module.state_dict()
+        with open(os.path.join(tmp_dir, WEIGHTS_FILE), "wb") as f:
+            for name, tensor in state.items():
+                data = tensor.detach().cpu().contiguous().numpy().tobytes()
+                padding = -offset % ALIGNMENT
+                f.write(b"\0" * padding)
+                offset += padding
+                index[name] = {
+                    "dtype": str(tensor.dtype).replace("torch.", ""),
+                    "shape": list(tensor.shape),
+                    "offset": offset,
+                    "nbytes": len(data),
+                }
+                f.write(data)
+                offset += len(data)
+
+        # Structure du module sans les poids
+        skeleton = copy.deepcopy(engine.module)
+        for name, tensor in state.items():
+            _set_tensor(skeleton, name, torch.empty(0, dtype=tensor.dtype))
+
+        torch.save(
+            {
+                "module": skeleton,
+                "vocab": engine.vocab,
+                "size": engine.size,
+                "resize_method": engine.resize_method,
+                "resample": engine.resample,
+                "mean": engine.mean,
+                "std": engine.std,
+                "activation": engine.activation,
+            },
+            os.path.join(tmp_dir, SKELETON_FILE),
+        )
+        with open(os.path.join(tmp_dir, INDEX_FILE), "w") as f:
+            json.dump(index, f)
+
+        if os.path.exists(directory) and not is_exported(directory):
+            # Export incomplet laissé par un worker interrompu
+            shutil.rmtree(directory, ignore_errors=True)
+        try:
+            os.rename(tmp_dir, directory)
+        except OSError:
+            # Un autre worker a terminé l'export en premier
+            if not is_exported(directory):
+                raise
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return directory
+
+
+def load_shared_engine(directory: str) -> InferenceEngine:
+    """Load an exported engine whose weights are read-only views of an mmap."""
+    meta = torch.load(
+        os.path.join(directory, SKELETON_FILE), map_location="cpu", weights_only=False
+    )
+    with open(os.path.join(directory, INDEX_FILE)) as f:
+        index = json.load(f)
+
+    weights = np.memmap(os.path.join(directory, WEIGHTS_FILE), dtype=np.uint8, mode="r")
+    module = meta["module"]
+    with warnings.catch_warnings():
+        # Les tableaux sont en lecture seule : aucun poids n'est modifié en inférence
+        warnings.simplefilter("ignore", UserWarning)
+        for name, entry in index.items():
+            dtype = getattr(torch, entry["dtype"])
+            raw = weights[entry["offset"]:entry["offset"] + entry["nbytes"]]
+            array = raw.view(_numpy_dtype(dtype)).reshape(entry["shape"])
+            _set_tensor(module, name, torch.from_numpy(array))
+
+    engine = InferenceEngine(
+        module,
+        meta["vocab"],
+        size=meta["size"],
+        resize_method=meta["resize_method"],
+        resample=meta["resample"],
+        mean=meta["mean"],
+        std=meta["std"],
+        activation=meta["activation"],
+    )
+    engine.shared_weights = weights
+    return engine
@@ -0,0 +1,49 @@
+import io
+import tarfile
+import zipfile
+
+from archives import is_archive, iter_archive
+
+
+def _tar_with(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    buffer.seek(0)
+    return buffer
+
+
+def test_is_archive_detects_zip_and_tar_by_content():
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w") as zf:
+        zf.writestr("a.jpg", b"data")
+    zip_buffer.seek(0)
+
+    assert is_archive(zip_buffer, "upload.bin")
+    assert is_archive(_tar_with({"a.jpg": b"data"}), "upload.bin")
+    assert not is_archive(io.BytesIO(b"\xff\xd8\xff not an archive"), "photo.jpg")
+
+
+def test_iter_tar_skips_non_images_and_hidden_files():
+    archive = _tar_with({
+        "field/1.jpg": b"one",
+        "field/.hidden.jpg": b"hidden",
+        "field/readme.md": b"text",
+        "field/2.png": b"two",
+    })
+
+    members = list(iter_archive(archive, max_member_bytes=1024))
+
+    assert members == [("field/1.jpg", b"one"), ("field/2.png", b"two")]
+
+
+def test_iter_archive_rejects_oversized_members():
+    archive = _tar_with({"big.jpg": b"x" * 100, "small.jpg": b"x"})
+
+    members = dict(iter_archive(archive, max_member_bytes=10))
+
+    assert isinstance(members["big.jpg"], ValueError)
+    assert members["small.jpg"] == b"x"
@@ -0,0 +1,101 @@
+import os
+import time
+
+import pytest
+
+from artifact_cache import ArtifactCache
+
+
+def _writer(data):
+    def download(f):
+        f.write(data)
+    return download
+
+
+def test_fetch_downloads_once_per_etag(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=10 ** 6)
+    calls = []
+
+    def download(f):
+        calls.append(1)
+        f.write(b"model")
+
+    first = cache.fetch("models", "export.pkl", '"v1"', download)
+    second = cache.fetch("models", "export.pkl", '"v1"', download)
+
+    assert first == second
+    assert len(calls) == 1
+    assert first.endswith(os.path.join("models", "export.pkl", "v1.pkl"))
+
+    # Une nouvelle version (nouvel ETag) a sa propre entrée
+    third = cache.fetch("models", "export.pkl", '"v2"', download)
+    assert third != first
+    assert len(calls) == 2
+
+
+def test_failed_download_leaves_no_entry(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=10 ** 6)
+
+    def download(f):
+        f.write(b"partial")
+        raise IOError("connection reset")
+
+    with pytest.raises(IOError):
+        cache.fetch("models", "export.pkl", "v1", download)
+
+    assert cache.get("models", "export.pkl", "v1") is None
+    leftovers = [name for _, _, files in os.walk(tmp_path) for name in files]
+    assert leftovers == []
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=25)
+
+    old = cache.fetch("models", "a.pkl", "v1", _writer(b"x" * 10))
+    recent = cache.fetch("models", "b.pkl", "v1", _writer(b"x" * 10))
+    past = time.time() - 100
+    os.utime(old, (past, past))
+    os.utime(recent, (past + 50, past + 50))
+
+    newest = cache.fetch("models", "c.pkl", "v1", _writer(b"x" * 10))
+
+    assert not os.path.exists(old)
+    assert os.path.exists(recent)
+    assert os.path.exists(newest)
+
+
+def test_evicts_artifact_together_with_its_export(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=40)
+
+    old = cache.fetch("models", "a.pkl", "v1", _writer(b"x" * 10))
+    os.makedirs(old + ".mmap")
+    with open(os.path.join(old + ".mmap", "weights.bin"), "wb") as f:
+        f.write(b"x" * 20)
+    past = time.time() - 100
+    for path in (old, old + ".mmap", os.path.join(old + ".mmap", "weights.bin")):
+        os.utime(path, (past, past))
+
+    # 10 + 20 + 10 octets : tient dans le cache, rien n'est évincé
+    recent = cache.fetch("models", "b.pkl", "v1", _writer(b"x" * 10))
+    assert os.path.exists(old) and os.path.exists(old + ".mmap")
+
+    # Au-delà : le .pkl et son export partent ensemble
+    cache.fetch("models", "c.pkl", "v1", _writer(b"x" * 10))
+    assert not os.path.exists(old)
+    assert not os.path.exists(old + ".mmap")
+    assert os.path.exists(recent)
+
+
+def test_pinned_artifact_is_not_evicted(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=15)
+
+    served = cache.fetch("models", "a.pkl", "v1", _writer(b"x" * 10))
+    os.makedirs(served + ".mmap")
+    past = time.time() - 100
+    os.utime(served, (past, past))
+    cache.pin(served)
+
+    newest = cache.fetch("models", "a.pkl", "v2", _writer(b"x" * 10))
+
+    assert os.path.exists(served) and os.path.exists(served + ".mmap")
+    assert os.path.exists(newest)
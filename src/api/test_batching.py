@@ -0,0 +1,88 @@
+import unittest
+import threading
+from concurrent.futures import wait
+
+from batching import MicroBatcher
+
+
+class TestMicroBatcher(unittest.TestCase):
+
+    def test_groups_concurrent_items(self):
+        # Bloquer le premier batch pour que les suivants s'accumulent
+        release = threading.Event()
+        calls = []
+
+        def predict_fn(items):
+            calls.append(list(items))
+            release.wait(timeout=5)
+            return [item * 2 for item in items]
+
+        batcher = MicroBatcher(predict_fn, max_batch_size=4, max_wait_ms=50)
+        futures = [batcher.submit(i) for i in range(5)]
+        release.set()
+        wait(futures, timeout=5)
+
+        # Chaque appelant reçoit son propre résultat
+        self.assertEqual([f.result() for f in futures], [0, 2, 4, 6, 8])
+        # Aucun batch ne dépasse la taille maximale
+        self.assertTrue(all(len(c) <= 4 for c in calls))
+        self.assertEqual(sum(len(c) for c in calls), 5)
+
+    def test_max_batch_size_one(self):
+        batcher = MicroBatcher(lambda items: items, max_batch_size=1, max_wait_ms=0)
+        futures = [batcher.submit(i) for i in range(3)]
+        wait(futures, timeout=5)
+
+        stats = batcher.stats()
+        self.assertEqual(stats["batch_sizes"], {1: 3})
+        self.assertEqual(stats["items"], 3)
+        self.assertEqual(stats["mean_batch_size"], 1.0)
+
+    def test_exception_propagates_to_every_caller(self):
+        def predict_fn(items):
+            raise ValueError("boom")
+
+        batcher = MicroBatcher(predict_fn, max_batch_size=2, max_wait_ms=1)
+        future = batcher.submit("img")
+
+        with self.assertRaises(ValueError):
+            future.result(timeout=5)
+
+        # Le worker survit à l'erreur
+        batcher.predict_fn = lambda items: ["ok"] * len(items)
+        self.assertEqual(batcher.submit("img").result(timeout=5), "ok")
+
+    def test_failing_item_only_fails_its_caller(self):
+        calls = []
+        release = threading.Event()
+
+        def predict_fn(items):
+            calls.append(list(items))
+            release.wait(timeout=5)
+            if "bad" in items:
+                raise ValueError("bad item")
+            return [f"ok-{item}" for item in items]
+
+        batcher = MicroBatcher(predict_fn, max_batch_size=3, max_wait_ms=200)
+        futures = [batcher.submit(item) for item in ("a", "bad", "b")]
+        release.set()
+
+        self.assertEqual(futures[0].result(timeout=5), "ok-a")
+        self.assertEqual(futures[2].result(timeout=5), "ok-b")
+        with self.assertRaises(ValueError):
+            futures[1].result(timeout=5)
+        # Un appel groupé, puis un appel par élément
+        self.assertEqual(calls, [["a", "bad", "b"], ["a"], ["bad"], ["b"]])
+
+    def test_result_count_mismatch(self):
+        batcher = MicroBatcher(lambda items: [], max_batch_size=2, max_wait_ms=1)
+        with self.assertRaises(ValueError):
+            batcher.submit("img").result(timeout=5)
+
+    def test_invalid_batch_size(self):
+        with self.assertRaises(ValueError):
+            MicroBatcher(lambda items: items, max_batch_size=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
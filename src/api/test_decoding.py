@@ -0,0 +1,49 @@
+import io
+
+import pytest
+from PIL import Image
+
+from decoding import ImageTooLargeError, decode_image, draft_size
+
+
+def _encode(image, fmt):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def test_draft_size_keeps_target_covered():
+    # Le recadrage central au ratio de la cible reste >= 224 px
+    w, h = draft_size((4000, 3000), (224, 224))
+    assert min(w, h) >= 224
+    assert draft_size((200, 150), (224, 224)) is None
+
+
+def test_large_jpeg_is_decoded_at_reduced_scale():
+    contents = _encode(Image.new("RGB", (4000, 3000), color="green"), "JPEG")
+
+    image = decode_image(contents, target=(224, 224))
+
+    assert image.mode == "RGB"
+    # Échelle 1/8 : la plus petite qui couvre encore 224 px
+    assert image.size == (500, 375)
+
+
+def test_without_target_decodes_full_resolution():
+    contents = _encode(Image.new("RGB", (800, 600)), "JPEG")
+    assert decode_image(contents).size == (800, 600)
+
+
+def test_non_rgb_png_is_converted():
+    contents = _encode(Image.new("RGBA", (64, 32)), "PNG")
+
+    image = decode_image(contents, target=(224, 224))
+
+    assert image.mode == "RGB"
+    assert image.size == (64, 32)
+
+
+def test_pixel_limit_rejects_before_decoding():
+    contents = _encode(Image.new("L", (1000, 1000)), "PNG")
+    with pytest.raises(ImageTooLargeError):
+        decode_image(contents, max_pixels=500_000)
@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+from fastai.vision.all import (
+    CrossEntropyLossFlat,
+    ImageDataLoaders,
+    Learner,
+    Normalize,
+    Resize,
+    ResizeMethod,
+    imagenet_stats,
+)
+from PIL import Image
+
+from inference import InferenceEngine
+
+
+def _random_image(rng, size):
+    pixels = rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+
+def _small_cnn(n_out):
+    return torch.nn.Sequential(
+        torch.nn.Conv2d(3, 8, 3, stride=2),
+        torch.nn.ReLU(),
+        torch.nn.AdaptiveAvgPool2d(1),
+        torch.nn.Flatten(),
+        torch.nn.Linear(8, n_out),
+    )
+
+
+class TestInferenceEngineParity(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Petit jeu de données local : deux classes, images de tailles variées
+        cls.data_dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        for label in ("dandelion", "grass"):
+            os.makedirs(os.path.join(cls.data_dir, label))
+            for i in range(4):
+                image = _random_image(rng, (40 + 7 * i, 30 + 5 * i))
+                image.save(os.path.join(cls.data_dir, label, f"{i}.png"))
+        cls.rng = rng
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.data_dir)
+
+    def _learner(self, method):
+        torch.manual_seed(0)
+        dls = ImageDataLoaders.from_folder(
+            self.data_dir,
+            valid_pct=0.25,
+            item_tfms=Resize(32, method=method),
+            batch_tfms=Normalize.from_stats(*imagenet_stats),
+            bs=4,
+            num_workers=0,
+        )
+        return Learner(dls, _small_cnn(len(dls.vocab)), loss_func=CrossEntropyLossFlat())
+
+    def _assert_parity(self, learn):
+        engine = InferenceEngine.from_learner(learn)
+        images = [_random_image(self.rng, size) for size in [(64, 48), (37, 91), (32, 32)]]
+
+        for image in images:
+            with learn.no_bar():
+                expected = learn.predict(image)
+            actual = engine.predict(image)
+            self.assertEqual(actual[0], expected[0])
+            self.assertEqual(int(actual[1]), int(expected[1]))
+            torch.testing.assert_close(actual[2], expected[2], atol=1e-5, rtol=1e-4)
+
+        # Le batch donne les mêmes probabilités que les appels unitaires
+        batched = engine.predict_batch(images)
+        for image, (_, _, probs) in zip(images, batched):
+            torch.testing.assert_close(probs, engine.predict(image)[2], atol=1e-5, rtol=1e-4)
+
+    def test_parity_with_learner_predict_crop(self):
+        self._assert_parity(self._learner(ResizeMethod.Crop))
+
+    def test_parity_with_learner_predict_squish(self):
+        self._assert_parity(self._learner(ResizeMethod.Squish))
+
+    def test_pre_resized_arrays_skip_resize(self):
+        engine = InferenceEngine(_small_cnn(2), ["a", "b"], size=(32, 24))
+        image = _random_image(self.rng, (80, 60))
+        frame = np.asarray(engine.resize(image), dtype=np.uint8)
+        self.assertTrue(engine.accepts(frame))
+        self.assertFalse(engine.accepts(frame[:, :-1]))
+        torch.testing.assert_close(engine.preprocess([frame]), engine.preprocess([image]))
+
+    def test_rejects_unsupported_resize(self):
+        with self.assertRaises(ValueError):
+            InferenceEngine.from_learner(self._learner(ResizeMethod.Pad))
+
+    def test_rejects_non_torch_model(self):
+        learn = self._learner(ResizeMethod.Crop)
+        learn.model = object()
+        with self.assertRaises(TypeError):
+            InferenceEngine.from_learner(learn)
+
+
+if __name__ == "__main__":
+    unittest.main()
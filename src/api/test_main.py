@@ -1,7 +1,12 @@
+import asyncio
 import unittest
 import sys
 from unittest.mock import patch, MagicMock, mock_open
 import io
+import json
+import tempfile
+import threading
+import zipfile
 import os
 import pytest
 from fastapi import FastAPI
@@ -9,10 +14,15 @@ from fastapi.testclient import TestClient
 from PIL import Image
 import numpy as np
 import boto3
+from botocore.exceptions import ClientError
+import torch
 from datetime import datetime
 
 # Import le module à tester
-from main import app, find_latest_model, load_model, predict_image
+import main
+from artifact_cache import ArtifactCache
+from inference import InferenceEngine
+from main import app, find_latest_model, load_model, predict_image, predict_images
 
 # Créer un client de test
 client = TestClient(app)
@@ -32,6 +42,10 @@ class TestMainPy(unittest.TestCase):
         # Mock pour Image.open
         self.patcher_image = patch('PIL.Image.open')
         self.mock_image = self.patcher_image.start()
+        self.mock_image.return_value = Image.new('RGB', (100, 100))
+
+        # Partir d'un cache de prédictions vide pour chaque test
+        main.prediction_cache.clear()
 
     def tearDown(self):
         # Arrêter tous les patchers
@@ -39,48 +53,72 @@ class TestMainPy(unittest.TestCase):
         self.patcher_load_learner.stop()
         self.patcher_image.stop()
 
-    def test_find_latest_model(self):
-        # Configurer le mock pour boto3.client
+    def _no_manifest(self, mock_s3_client):
+        mock_s3_client.get_object.side_effect = ClientError(
+            {'Error': {'Code': 'NoSuchKey'}}, 'GetObject'
+        )
+
+    def test_find_latest_model_from_manifest(self):
         mock_s3_client = MagicMock()
         self.mock_s3.return_value = mock_s3_client
 
-        # Simuler les buckets
-        mock_s3_client.list_buckets.return_value = {
-            'Buckets': [{'Name': 'test-bucket'}]
+        # Le pointeur désigne directement le modèle courant
+        mock_s3_client.get_object.return_value = {
+            'Body': io.BytesIO(json.dumps({'key': 'export.pkl'}).encode())
+        }
+        mock_s3_client.head_object.return_value = {
+            'LastModified': datetime(2023, 2, 1), 'ETag': '"abc"'
         }
 
-        # Simuler les objets dans le bucket
-        test_date = datetime(2023, 1, 1)
-        mock_s3_client.list_objects_v2.return_value = {
-            'Contents': [
+        result = find_latest_model()
+
+        self.assertEqual(result['Bucket'], 'models')
+        self.assertEqual(result['Key'], 'export.pkl')
+        self.assertEqual(result['ETag'], '"abc"')
+        mock_s3_client.get_object.assert_called_once_with(Bucket='models', Key='latest.json')
+        mock_s3_client.head_object.assert_called_once_with(Bucket='models', Key='export.pkl')
+        mock_s3_client.list_buckets.assert_not_called()
+        mock_s3_client.get_paginator.assert_not_called()
+
+    def test_find_latest_model(self):
+        # Configurer le mock pour boto3.client
+        mock_s3_client = MagicMock()
+        self.mock_s3.return_value = mock_s3_client
+        self._no_manifest(mock_s3_client)
+
+        # Simuler deux pages d'objets dans le bucket des modèles
+        mock_s3_client.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [
                 {'Key': 'model_v1.pkl', 'LastModified': datetime(2023, 1, 1)},
+                {'Key': 'data.csv', 'LastModified': datetime(2023, 3, 1)},
+            ]},
+            {'Contents': [
                 {'Key': 'model_v2.pkl', 'LastModified': datetime(2023, 2, 1)},
-                {'Key': 'data.csv', 'LastModified': datetime(2023, 3, 1)}
-            ]
-        }
+            ]},
+        ]
 
         # Appeler la fonction à tester
         result = find_latest_model()
 
         # Vérifier les résultats
-        self.assertEqual(result['Bucket'], 'test-bucket')
+        self.assertEqual(result['Bucket'], 'models')
         self.assertEqual(result['Key'], 'model_v2.pkl')
         self.assertEqual(result['LastModified'], datetime(2023, 2, 1))
+        mock_s3_client.get_paginator.return_value.paginate.assert_called_once_with(
+            Bucket='models', Prefix=''
+        )
+        mock_s3_client.list_buckets.assert_not_called()
 
     def test_find_latest_model_no_pkl(self):
         # Configurer le mock pour boto3.client
         mock_s3_client = MagicMock()
         self.mock_s3.return_value = mock_s3_client
-
-        # Simuler les buckets
-        mock_s3_client.list_buckets.return_value = {
-            'Buckets': [{'Name': 'test-bucket'}]
-        }
+        self._no_manifest(mock_s3_client)
 
         # Simuler aucun fichier .pkl
-        mock_s3_client.list_objects_v2.return_value = {
-            'Contents': [{'Key': 'data.csv', 'LastModified': datetime(2023, 3, 1)}]
-        }
+        mock_s3_client.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [{'Key': 'data.csv', 'LastModified': datetime(2023, 3, 1)}]}
+        ]
 
         # Vérifier que la fonction lève une exception
         with self.assertRaises(FileNotFoundError):
@@ -101,7 +139,7 @@ class TestMainPy(unittest.TestCase):
 
             # Simuler la réponse de get_object
             mock_s3_client.get_object.return_value = {
-                'Body': MagicMock(read=lambda: b'mock_model_data')
+                'Body': io.BytesIO(b'mock_model_data')
             }
 
             # Mock pour load_learner
@@ -117,6 +155,35 @@ class TestMainPy(unittest.TestCase):
                 Bucket='test-bucket', Key='model.pkl'
             )
 
+    def test_load_model_uses_local_cache(self):
+        info = {
+            'Bucket': 'models',
+            'Key': 'export.pkl',
+            'LastModified': datetime(2023, 1, 1),
+            'ETag': '"abc123"',
+        }
+        mock_s3_client = MagicMock()
+        self.mock_s3.return_value = mock_s3_client
+        mock_s3_client.get_object.side_effect = lambda **kwargs: {
+            'Body': io.BytesIO(b'mock_model_data')
+        }
+        loaded_paths = []
+        self.mock_load_learner.side_effect = lambda path: loaded_paths.append(path)
+
+        with tempfile.TemporaryDirectory() as cache_dir, patch(
+            'main.artifact_cache', ArtifactCache(cache_dir, 10 ** 6)
+        ):
+            load_model(info)
+            load_model(info)
+
+            # Le second chargement lit le fichier en cache sans retélécharger
+            mock_s3_client.get_object.assert_called_once_with(
+                Bucket='models', Key='export.pkl'
+            )
+            self.assertEqual(loaded_paths[0], loaded_paths[1])
+            with open(loaded_paths[0], 'rb') as f:
+                self.assertEqual(f.read(), b'mock_model_data')
+
     def test_predict_image(self):
         # Créer un mock pour le modèle
         mock_model = MagicMock()
@@ -137,6 +204,75 @@ class TestMainPy(unittest.TestCase):
         self.assertEqual(confidence, 0.95)
         mock_model.predict.assert_called_once_with(test_image)
 
+    def test_predict_images_batch(self):
+        # Simuler un learner fastai pour un batch de deux images
+        mock_model = MagicMock()
+        mock_model.dls.vocab = ['dandelion', 'grass']
+        mock_model.get_preds.return_value = (
+            torch.tensor([[0.9, 0.1], [0.3, 0.7]]),
+            None,
+            torch.tensor([0, 1]),
+        )
+
+        results = predict_images([MagicMock(), MagicMock()], mock_model)
+
+        self.assertEqual(results[0][0], 'dandelion')
+        self.assertAlmostEqual(results[0][1], 0.9, places=5)
+        self.assertEqual(results[1][0], 'grass')
+        self.assertAlmostEqual(results[1][1], 0.7, places=5)
+        mock_model.predict.assert_not_called()
+
+    def test_predict_images_with_inference_engine(self):
+        engine = InferenceEngine(
+            torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(3 * 8 * 8, 2)),
+            ['dandelion', 'grass'],
+            size=(8, 8),
+        )
+        images = [Image.new('RGB', (20, 10), color='red'), Image.new('RGB', (10, 20))]
+
+        results = predict_images(images, engine)
+
+        self.assertEqual(len(results), 2)
+        for class_name, confidence in results:
+            self.assertIn(class_name, ['dandelion', 'grass'])
+            self.assertGreaterEqual(confidence, 0.5)
+
+    def test_mmap_serving_mode_exports_once(self):
+        info = {
+            'Bucket': 'models', 'Key': 'export.pkl',
+            'LastModified': datetime(2023, 1, 1), 'ETag': '"abc"',
+        }
+        engine = InferenceEngine(
+            torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(3 * 8 * 8, 2)),
+            ['dandelion', 'grass'],
+            size=(8, 8),
+        )
+
+        with tempfile.TemporaryDirectory() as cache_dir, patch(
+            'main.artifact_cache', ArtifactCache(cache_dir, 10 ** 9)
+        ), patch('main.SERVING_MODE', 'mmap'), patch(
+            'main.load_model'
+        ) as mock_load, patch('main.build_predictor', return_value=engine):
+            first = main.load_predictor(info)
+            second = main.load_predictor(info)
+
+            # Le second worker mappe l'export existant sans charger le pickle
+            mock_load.assert_called_once_with(info)
+            self.assertTrue(hasattr(first, 'shared_weights'))
+            self.assertTrue(hasattr(second, 'shared_weights'))
+            batch = torch.rand(1, 3, 8, 8)
+            torch.testing.assert_close(second.forward(batch), engine.forward(batch))
+
+    def test_build_predictor_falls_back_to_learner(self):
+        # Un Learner sans module torch exploitable reste servi tel quel
+        learner = MagicMock()
+        self.assertIs(main.build_predictor(learner), learner)
+
+    def test_batching_stats_endpoint(self):
+        response = client.get("/batching/stats")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("batch_sizes", response.json())
+
     @patch('main.predict_image')
     def test_predict_endpoint_success(self, mock_predict):
         # Configurer les mocks
@@ -227,6 +363,342 @@ class TestMainPy(unittest.TestCase):
             assert response.status_code == 400
             assert "Unexpected prediction output" in response.json()["detail"]
 
+    def _jpeg_bytes(self, color='red'):
+        img_byte_arr = io.BytesIO()
+        Image.new('RGB', (32, 32), color=color).save(img_byte_arr, format='JPEG')
+        return img_byte_arr.getvalue()
+
+    @patch('main.predict_images')
+    def test_predict_batch_multipart(self, mock_predict_images):
+        # Une prédiction par image, dans l'ordre du batch
+        mock_predict_images.side_effect = lambda images, model: [
+            ('grass', 0.8) for _ in images
+        ]
+        self.patcher_image.stop()
+        try:
+            with patch('main.model', MagicMock()):
+                response = client.post(
+                    "/predict_batch",
+                    files=[
+                        ("files", ("a.jpg", self._jpeg_bytes(), "image/jpeg")),
+                        ("files", ("b.jpg", b"not an image", "image/jpeg")),
+                        ("files", ("c.jpg", self._jpeg_bytes('blue'), "image/jpeg")),
+                    ],
+                )
+        finally:
+            self.patcher_image.start()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([line["filename"] for line in lines], ["a.jpg", "b.jpg", "c.jpg"])
+        self.assertEqual(lines[0]["prediction"], "grass")
+        self.assertEqual(lines[1]["error"], "Invalid image file")
+        self.assertEqual(lines[2]["probability"], 0.8)
+
+    @patch('main.predict_images')
+    def test_predict_batch_zip_archive(self, mock_predict_images):
+        mock_predict_images.side_effect = lambda images, model: [
+            ('dandelion', 0.9) for _ in images
+        ]
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('photos/1.jpg', self._jpeg_bytes())
+            zf.writestr('photos/2.jpg', self._jpeg_bytes('green'))
+            zf.writestr('photos/notes.txt', 'ignored')
+        archive.seek(0)
+
+        self.patcher_image.stop()
+        try:
+            with patch('main.model', MagicMock()):
+                response = client.post(
+                    "/predict_batch",
+                    files=[("files", ("photos.zip", archive, "application/zip"))],
+                )
+        finally:
+            self.patcher_image.start()
+
+        self.assertEqual(response.status_code, 200)
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([line["filename"] for line in lines], ["photos/1.jpg", "photos/2.jpg"])
+        self.assertTrue(all(line["prediction"] == "dandelion" for line in lines))
+
+    def test_startup_loads_and_warms_model(self):
+        mock_model = MagicMock()
+        mock_model.predict.return_value = ('grass', None, torch.tensor([0.2, 0.8]))
+        info = {'Bucket': 'models', 'Key': 'export.pkl', 'LastModified': datetime(2023, 1, 1)}
+
+        with patch('main.model', None), patch('main.model_info', None), patch(
+            'main.find_latest_model', return_value=info
+        ), patch('main.load_model', return_value=mock_model):
+            with TestClient(app):
+                # Le modèle est chargé et préchauffé avant la première requête
+                self.assertIs(main.model, mock_model)
+                mock_model.predict.assert_called_once()
+
+    def test_reload_swaps_model(self):
+        old_model, new_model = MagicMock(), MagicMock()
+        new_model.predict.return_value = ('grass', None, torch.tensor([0.2, 0.8]))
+        old_info = {'Bucket': 'models', 'Key': 'export.pkl', 'LastModified': datetime(2023, 1, 1)}
+        new_info = {'Bucket': 'models', 'Key': 'export.pkl', 'LastModified': datetime(2023, 2, 1)}
+
+        with patch('main.model', old_model), patch('main.model_info', old_info), patch(
+            'main.find_latest_model', return_value=new_info
+        ), patch('main.load_model', return_value=new_model) as mock_load:
+            self.assertTrue(main.reload_model())
+            self.assertIs(main.model, new_model)
+            self.assertEqual(main.model_info, new_info)
+            mock_load.assert_called_once_with(new_info)
+
+    def test_reload_skips_unchanged_model(self):
+        current = MagicMock()
+        info = {'Bucket': 'models', 'Key': 'export.pkl', 'LastModified': datetime(2023, 1, 1)}
+
+        with patch('main.model', current), patch('main.model_info', info), patch(
+            'main.find_latest_model', return_value=dict(info)
+        ), patch('main.load_model') as mock_load:
+            main.reload_model()
+            self.assertIs(main.model, current)
+            mock_load.assert_not_called()
+
+    def test_reload_failure_keeps_current_model(self):
+        current = MagicMock()
+        info = {'Bucket': 'models', 'Key': 'export.pkl', 'LastModified': datetime(2023, 1, 1)}
+
+        with patch('main.model', current), patch('main.model_info', info), patch(
+            'main.find_latest_model', side_effect=Exception('MinIO down')
+        ):
+            main.reload_model()
+            self.assertIs(main.model, current)
+            self.assertEqual(main.reload_status['state'], 'failed')
+            self.assertIn('MinIO down', main.reload_status['error'])
+
+    @patch('main.predict_image')
+    def test_predict_endpoint_uses_prediction_cache(self, mock_predict):
+        mock_predict.return_value = ('cat', 0.95)
+        img_bytes = self._jpeg_bytes()
+
+        with patch('main.model', MagicMock()):
+            first = client.post("/predict", files={"file": ("a.jpg", img_bytes, "image/jpeg")})
+            second = client.post("/predict", files={"file": ("b.jpg", img_bytes, "image/jpeg")})
+
+        self.assertEqual(first.json(), second.json())
+        # La même image n'est prédite qu'une seule fois
+        mock_predict.assert_called_once()
+        stats = client.get("/cache/stats").json()
+        self.assertGreaterEqual(stats["hits"], 1)
+
+    def test_swap_model_invalidates_prediction_cache(self):
+        main.prediction_cache.put(('hash', 'v1'), ('cat', 0.9))
+        info = {'Bucket': 'models', 'Key': 'export.pkl', 'LastModified': datetime(2023, 1, 1)}
+
+        with patch('main.model', None), patch('main.model_info', None):
+            main.swap_model(MagicMock(), info)
+
+        self.assertEqual(main.prediction_cache.stats()["size"], 0)
+
+    def test_optimized_model_has_its_own_cache_keys(self):
+        info = {'Bucket': 'models', 'Key': 'export.pkl', 'LastModified': datetime(2023, 1, 1)}
+        with patch('main.model', None), patch('main.model_info', None), patch('main.fp32_model', None), patch(
+            'main.cache_version', None
+        ):
+            main.swap_model(MagicMock(), info)
+            fp32_key = main.prediction_key(b"image")
+            main.swap_model(MagicMock(), info, mode="dynamic")
+            # Même version du modèle, mais une prédiction du moteur fp32 écrite en retard n'est pas servie
+            self.assertNotEqual(main.prediction_key(b"image"), fp32_key)
+
+    def test_predict_endpoint_overloaded(self):
+        # Aucun créneau libre : la requête est rejetée sans attendre
+        with patch('main.inflight_slots', threading.BoundedSemaphore(1)) as slots:
+            slots.acquire()
+            response = client.post(
+                "/predict", files={"file": ("a.jpg", self._jpeg_bytes(), "image/jpeg")}
+            )
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["retry-after"], "1")
+
+    def test_predict_batch_releases_slot_when_stream_never_starts(self):
+        with patch('main.inflight_slots', threading.BoundedSemaphore(1)) as slots, patch(
+            'main.model', MagicMock()
+        ):
+            response = asyncio.run(main.predict_batch([]))
+            self.assertFalse(slots.acquire(blocking=False))
+            # Client déconnecté avant l'envoi : seule la tâche de fond s'exécute
+            asyncio.run(response.background())
+            self.assertTrue(slots.acquire(blocking=False))
+            slots.release()
+            # Un second appel ne libère pas le créneau une deuxième fois
+            asyncio.run(response.background())
+
+    def test_health_endpoint(self):
+        with patch('main.model', None):
+            response = client.get("/health")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"status": "ok", "model_loaded": False})
+
+    def test_reload_endpoint_accepted(self):
+        started = threading.Event()
+        with patch('main.reload_lock', threading.Lock()), patch(
+            'main.reload_model', side_effect=lambda force: started.set()
+        ) as mock_reload:
+            response = client.post("/reload")
+            # Le rechargement tourne dans un thread en arrière-plan
+            self.assertTrue(started.wait(timeout=5))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["status"], "reloading")
+        mock_reload.assert_called_once_with(False)
+
+    @patch('main.predict_image')
+    def test_metrics_endpoint_records_stages(self, mock_predict):
+        mock_predict.return_value = ('cat', 0.95)
+        with patch('main.model', MagicMock()):
+            client.post("/predict", files={"file": ("a.jpg", self._jpeg_bytes(), "image/jpeg")})
+
+        response = client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        for stage in ("read", "decode", "inference", "forward"):
+            self.assertIn(f'api_stage_duration_seconds_count{{stage="{stage}"}}', response.text)
+        self.assertIn('api_inflight_requests{endpoint="predict"} 0.0', response.text)
+
+    def _raw_engine(self):
+        module = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 4, 3), torch.nn.AdaptiveAvgPool2d(1), torch.nn.Flatten(), torch.nn.Linear(4, 2)
+        )
+        return InferenceEngine(module, ['dandelion', 'grass'], size=(32, 24))
+
+    def test_predict_raw_single_frame(self):
+        engine = self._raw_engine()
+        frame = np.random.default_rng(0).integers(0, 256, (24, 32, 3), dtype=np.uint8)
+
+        with patch('main.model', engine):
+            response = client.post(
+                "/predict_raw", content=frame.tobytes(), headers={"X-Image-Shape": "24,32,3"}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        # Même résultat que la même image passée par /predict
+        expected_class, _, probs = engine.predict(Image.fromarray(frame))
+        self.assertEqual(response.json()["prediction"], expected_class)
+        self.assertAlmostEqual(response.json()["probability"], probs.max().item(), places=5)
+
+    def test_predict_raw_batch(self):
+        frames = np.zeros((3, 24, 32, 3), dtype=np.uint8)
+        with patch('main.model', self._raw_engine()):
+            response = client.post(
+                "/predict_raw", content=frames.tobytes(), headers={"X-Image-Shape": "3,24,32,3"}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["predictions"]), 3)
+
+    def test_predict_raw_rejects_invalid_shapes(self):
+        frame = np.zeros((24, 32, 3), dtype=np.uint8).tobytes()
+        with patch('main.model', self._raw_engine()):
+            cases = [
+                ({}, frame),
+                ({"X-Image-Shape": "24,32,4"}, frame),
+                ({"X-Image-Shape": "24,31,3"}, frame),
+                ({"X-Image-Shape": "24,32,3"}, frame[:-1]),
+                ({"X-Image-Shape": "48,64,3"}, bytes(48 * 64 * 3)),
+            ]
+            for headers, body in cases:
+                response = client.post("/predict_raw", content=body, headers=headers)
+                self.assertEqual(response.status_code, 400, headers)
+
+    def test_predict_raw_rejects_oversized_body(self):
+        with patch('main.model', self._raw_engine()), patch('main.MAX_UPLOAD_BYTES', 1000):
+            response = client.post(
+                "/predict_raw", content=bytes(2 * 24 * 32 * 3), headers={"X-Image-Shape": "2,24,32,3"}
+            )
+        self.assertEqual(response.status_code, 413)
+
+    def test_predict_raw_rejects_chunked_body_past_expected_size(self):
+        # Sans Content-Length, le corps est lu en flux jusqu'à la taille attendue
+        def body():
+            yield bytes(24 * 32 * 3)
+            yield b"extra"
+
+        with patch('main.model', self._raw_engine()):
+            response = client.post("/predict_raw", content=body(), headers={"X-Image-Shape": "24,32,3"})
+        self.assertEqual(response.status_code, 400)
+
+    @patch('main.predict_image')
+    def test_predict_raw_with_fastai_learner(self, mock_predict):
+        mock_predict.return_value = ('grass', 0.7)
+        frame = np.zeros((50, 40, 3), dtype=np.uint8)
+        with patch('main.model', MagicMock()):
+            response = client.post(
+                "/predict_raw", content=frame.tobytes(), headers={"X-Image-Shape": "50,40,3"}
+            )
+        self.assertEqual(response.json(), {"prediction": "grass", "probability": 0.7})
+        # Le Learner reçoit une image PIL
+        self.assertEqual(mock_predict.call_args[0][0].size, (40, 50))
+
+    def test_optimize_refused_keeps_current_model(self):
+        current = MagicMock()
+        info = {'Bucket': 'models', 'Key': 'export.pkl', 'LastModified': datetime(2023, 1, 1)}
+        report = {"mode": "static", "accuracy_drop": 0.05}
+        error = main.AccuracyGateError("Accuracy drop 0.0500 exceeds tolerance 0.01", report)
+
+        with patch('main.model', current), patch('main.fp32_model', current), patch('main.model_info', info), patch(
+            'main.run_optimization', side_effect=error
+        ):
+            response = client.post("/optimize", params={"mode": "static"})
+            self.assertIs(main.model, current)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["detail"]["report"], report)
+
+    def test_optimize_discarded_when_model_reloaded(self):
+        current, optimized, reloaded = MagicMock(), MagicMock(), MagicMock()
+        info = {'Bucket': 'models', 'Key': 'export.pkl', 'LastModified': datetime(2023, 1, 1)}
+        new_info = {'Bucket': 'models', 'Key': 'export.pkl', 'LastModified': datetime(2023, 2, 1)}
+
+        def optimize_during_reload(predictor, mode):
+            # Un rechargement remplace le modèle pendant l'optimisation
+            main.model, main.model_info = reloaded, new_info
+            return optimized, {"mode": mode}
+
+        with patch('main.model', current), patch('main.fp32_model', current), patch('main.model_info', info), patch(
+            'main.run_optimization', side_effect=optimize_during_reload
+        ), patch('main.warm_up', side_effect=lambda m: m):
+            response = client.post("/optimize", params={"mode": "dynamic"})
+            self.assertIs(main.model, reloaded)
+
+        self.assertEqual(response.status_code, 409)
+
+    def test_optimize_always_starts_from_fp32(self):
+        fp32, int8, channels_last = MagicMock(), MagicMock(), MagicMock()
+        info = {'Bucket': 'models', 'Key': 'export.pkl', 'LastModified': datetime(2023, 1, 1)}
+        results = {"dynamic": int8, "channels_last": channels_last}
+
+        def optimize(predictor, mode):
+            return results[mode], {"mode": mode}
+
+        with patch('main.model', fp32), patch('main.fp32_model', fp32), patch('main.model_info', info), patch(
+            'main.run_optimization', side_effect=optimize
+        ) as mock_optimize, patch('main.warm_up', side_effect=lambda m: m), patch('main.optimization_report', None):
+            client.post("/optimize", params={"mode": "dynamic"})
+            client.post("/optimize", params={"mode": "channels_last"})
+            self.assertIs(main.model, channels_last)
+            # Le second appel part du moteur fp32, pas du modèle int8 servi
+            self.assertTrue(all(call.args[0] is fp32 for call in mock_optimize.call_args_list))
+
+            # mode=none revient au modèle fp32 sans rechargement
+            response = client.post("/optimize", params={"mode": "none"})
+            self.assertEqual(response.status_code, 200)
+            self.assertIs(main.model, fp32)
+            self.assertEqual(mock_optimize.call_count, 2)
+
+    def test_optimize_predictor_falls_back_to_fp32(self):
+        engine = MagicMock(spec=InferenceEngine)
+        with patch('main.VALIDATION_DIR', ''), patch('main.optimization_report', None):
+            self.assertIs(main.optimize_predictor(engine, "dynamic"), engine)
+            self.assertFalse(main.optimization_report["applied"])
+            self.assertIn("VALIDATION_DIR", main.optimization_report["error"])
+
 
 if __name__ == "__main__":
     unittest.main()
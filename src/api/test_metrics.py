@@ -0,0 +1,47 @@
+import unittest
+
+from prometheus_client import REGISTRY
+
+import metrics
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_timed_records_stage(self):
+        before = _sample("api_stage_duration_seconds_count", stage="decode")
+        with metrics.timed("decode"):
+            pass
+        self.assertEqual(_sample("api_stage_duration_seconds_count", stage="decode"), before + 1)
+
+    def test_timed_records_on_error(self):
+        before = _sample("api_stage_duration_seconds_count", stage="forward")
+        with self.assertRaises(ValueError):
+            with metrics.timed("forward"):
+                raise ValueError("boom")
+        self.assertEqual(_sample("api_stage_duration_seconds_count", stage="forward"), before + 1)
+
+    def test_inflight_gauge(self):
+        start = metrics.request_started("predict")
+        self.assertEqual(_sample("api_inflight_requests", endpoint="predict"), 1.0)
+        metrics.request_finished("predict", start)
+        self.assertEqual(_sample("api_inflight_requests", endpoint="predict"), 0.0)
+        self.assertGreaterEqual(_sample("api_request_duration_seconds_count", endpoint="predict"), 1)
+
+    def test_model_version_switch(self):
+        metrics.set_model_version("models/a.pkl@1")
+        metrics.set_model_version("models/b.pkl@2")
+        self.assertEqual(_sample("api_model_info", version="models/a.pkl@1"), 0.0)
+        self.assertEqual(_sample("api_model_info", version="models/b.pkl@2"), 1.0)
+
+    def test_render_text_format(self):
+        text = metrics.render().decode()
+        self.assertIn("# TYPE api_stage_duration_seconds histogram", text)
+        self.assertIn("api_model_load_duration_seconds_bucket", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import torch
+from PIL import Image
+
+from inference import InferenceEngine
+from optimization import (
+    AccuracyGateError,
+    evaluate_engine,
+    gate_optimization,
+    load_validation_samples,
+    optimize_engine,
+)
+
+
+def _small_cnn(n_out):
+    return torch.nn.Sequential(
+        torch.nn.Conv2d(3, 8, 3, stride=2),
+        torch.nn.ReLU(),
+        torch.nn.AdaptiveAvgPool2d(1),
+        torch.nn.Flatten(),
+        torch.nn.Linear(8, n_out),
+    )
+
+
+def _samples(n):
+    # Classe déterminée par le canal dominant : rouge ou bleu
+    rng = np.random.default_rng(0)
+    samples = []
+    for i in range(n):
+        pixels = rng.integers(0, 64, size=(32, 32, 3), dtype=np.uint8)
+        label = ("red", "blue")[i % 2]
+        pixels[..., 0 if label == "red" else 2] += 160
+        samples.append((Image.fromarray(pixels), label))
+    return samples
+
+
+class TestOptimization(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        module = _small_cnn(2)
+        # Poids choisis pour séparer les deux classes
+        with torch.no_grad():
+            module[0].weight.zero_()
+            module[0].bias.zero_()
+            module[0].weight[:4, 0] = 1.0 / 9
+            module[0].weight[4:, 2] = 1.0 / 9
+            module[4].weight.copy_(torch.tensor([[1.0] * 4 + [-1.0] * 4, [-1.0] * 4 + [1.0] * 4]))
+            module[4].bias.zero_()
+        self.engine = InferenceEngine(module, ["red", "blue"], size=(32, 32))
+        self.samples = _samples(24)
+
+    def test_channels_last_matches_fp32(self):
+        optimized = optimize_engine(self.engine, "channels_last")
+        images = [image for image, _ in self.samples[:4]]
+        batch = optimized.preprocess(images)
+        self.assertTrue(batch.is_contiguous(memory_format=torch.channels_last))
+        torch.testing.assert_close(
+            optimized.forward(batch), self.engine.forward(self.engine.preprocess(images))
+        )
+
+    def test_dynamic_quantizes_linear_layers(self):
+        optimized = optimize_engine(self.engine, "dynamic")
+        self.assertNotIsInstance(optimized.module[4], torch.nn.Linear)
+        # Le module d'origine n'est pas modifié
+        self.assertIsInstance(self.engine.module[4], torch.nn.Linear)
+        self.assertEqual(evaluate_engine(optimized, self.samples)["accuracy"], 1.0)
+
+    def test_static_quantization_keeps_accuracy(self):
+        optimized, report = gate_optimization(self.engine, "static", self.samples, tolerance=0.01)
+        self.assertEqual(report["mode"], "static")
+        self.assertEqual(report["fp32"]["samples"], 18)
+        self.assertLessEqual(report["accuracy_drop"], 0.01)
+        predictions = optimized.predict_batch([image for image, _ in self.samples[:4]])
+        self.assertEqual([p[0] for p in predictions], ["red", "blue", "red", "blue"])
+
+    def test_static_requires_calibration(self):
+        with self.assertRaises(ValueError):
+            optimize_engine(self.engine, "static")
+
+    def test_gate_refuses_accuracy_drop(self):
+        broken = optimize_engine(self.engine, "channels_last")
+        with torch.no_grad():
+            broken.module[4].weight.neg_()
+        with mock.patch("optimization.optimize_engine", return_value=broken):
+            with self.assertRaises(AccuracyGateError) as ctx:
+                gate_optimization(self.engine, "dynamic", self.samples, tolerance=0.01)
+        self.assertEqual(ctx.exception.report["optimized"]["accuracy"], 0.0)
+        self.assertEqual(ctx.exception.report["accuracy_drop"], 1.0)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            optimize_engine(self.engine, "fp16")
+
+
+class TestLoadValidationSamples(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        for label, count in (("dandelion", 3), ("grass", 1)):
+            os.makedirs(os.path.join(self.data_dir, label))
+            for i in range(count):
+                Image.new("L", (8, 8)).save(os.path.join(self.data_dir, label, f"{i}.png"))
+        open(os.path.join(self.data_dir, "grass", "notes.txt"), "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_interleaves_labels(self):
+        samples = load_validation_samples(self.data_dir, limit=3)
+        self.assertEqual([label for _, label in samples], ["dandelion", "grass", "dandelion"])
+        self.assertEqual(samples[0][0].mode, "RGB")
+
+    def test_no_limit(self):
+        self.assertEqual(len(load_validation_samples(self.data_dir)), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
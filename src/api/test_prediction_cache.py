@@ -0,0 +1,56 @@
+import unittest
+from unittest.mock import patch
+
+from prediction_cache import PredictionCache, content_hash
+
+
+class TestPredictionCache(unittest.TestCase):
+
+    def test_hit_and_miss_counters(self):
+        cache = PredictionCache(max_entries=10, ttl_seconds=60)
+        key = (content_hash(b"image"), "v1")
+
+        self.assertIsNone(cache.get(key))
+        cache.put(key, ("grass", 0.8))
+        self.assertEqual(cache.get(key), ("grass", 0.8))
+
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_model_version_is_part_of_the_key(self):
+        cache = PredictionCache(max_entries=10, ttl_seconds=60)
+        digest = content_hash(b"image")
+        cache.put((digest, "v1"), ("grass", 0.8))
+
+        self.assertIsNone(cache.get((digest, "v2")))
+
+    def test_lru_eviction(self):
+        cache = PredictionCache(max_entries=2, ttl_seconds=60)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")  # "b" devient la moins récemment utilisée
+        cache.put("c", 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_ttl_expiry(self):
+        cache = PredictionCache(max_entries=10, ttl_seconds=5)
+        with patch("prediction_cache.time.monotonic", return_value=100.0):
+            cache.put("a", 1)
+        with patch("prediction_cache.time.monotonic", return_value=104.0):
+            self.assertEqual(cache.get("a"), 1)
+        with patch("prediction_cache.time.monotonic", return_value=106.0):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_disabled_cache(self):
+        cache = PredictionCache(max_entries=0)
+        cache.put("a", 1)
+        self.assertIsNone(cache.get("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
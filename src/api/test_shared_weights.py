@@ -0,0 +1,69 @@
+import os
+
+import torch
+
+from inference import InferenceEngine
+from shared_weights import export_shared_weights, is_exported, load_shared_engine
+
+
+def _engine():
+    torch.manual_seed(0)
+    module = torch.nn.Sequential(
+        torch.nn.Conv2d(3, 4, 3),
+        torch.nn.BatchNorm2d(4),
+        torch.nn.ReLU(),
+        torch.nn.AdaptiveAvgPool2d(1),
+        torch.nn.Flatten(),
+        torch.nn.Linear(4, 2),
+    )
+    return InferenceEngine(
+        module,
+        ["dandelion", "grass"],
+        size=(16, 16),
+        mean=torch.tensor([0.485, 0.456, 0.406]),
+        std=torch.tensor([0.229, 0.224, 0.225]),
+    )
+
+
+def test_export_and_load_roundtrip(tmp_path):
+    engine = _engine()
+    directory = export_shared_weights(engine, str(tmp_path / "model.mmap"))
+    assert is_exported(directory)
+
+    shared = load_shared_engine(directory)
+
+    batch = torch.rand(2, 3, 16, 16)
+    torch.testing.assert_close(shared.forward(batch), engine.forward(batch))
+    assert shared.vocab == engine.vocab
+    assert shared.size == engine.size
+
+
+def test_weights_are_views_of_the_mapped_file(tmp_path):
+    directory = export_shared_weights(_engine(), str(tmp_path / "model.mmap"))
+    shared = load_shared_engine(directory)
+
+    start = shared.shared_weights.ctypes.data
+    end = start + os.path.getsize(os.path.join(directory, "weights.bin"))
+    # Chaque tenseur pointe dans le mapping du fichier, pas dans une copie
+    for tensor in shared.module.state_dict().values():
+        assert start <= tensor.data_ptr() < end
+
+
+def test_export_into_existing_directory_is_a_noop(tmp_path):
+    directory = str(tmp_path / "model.mmap")
+    export_shared_weights(_engine(), directory)
+    export_shared_weights(_engine(), directory)
+
+    assert is_exported(directory)
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".part")] == []
+
+
+def test_export_replaces_incomplete_directory(tmp_path):
+    directory = tmp_path / "model.mmap"
+    directory.mkdir()
+    (directory / "weights.bin").write_bytes(b"truncated")
+
+    export_shared_weights(_engine(), str(directory))
+
+    assert is_exported(str(directory))
+    assert load_shared_engine(str(directory)).module is not None
@@ -1,9 +1,13 @@
 import io
+import json
 from PIL import Image
 import pytest
 import gradio as gr
 from unittest.mock import patch, Mock
-from web import prediction, build_interface
+from concurrent.futures import Future
+from web import prediction, build_interface, encode_image
+import requests
+import web
 
 
 def test_prediction_none():
@@ -11,7 +15,7 @@ def test_prediction_none():
     assert result == "Aucune image reçue. Glissez-déposez une image à gauche."
 
 
-@patch("web.requests.post")
+@patch("web.session.post")
 def test_prediction_success(mock_post):
     # Create a dummy image
     img = Image.new("RGB", (10, 10), color="red")
@@ -24,8 +28,148 @@ def test_prediction_success(mock_post):
     result = prediction(img)
     assert "Prédiction : pissenlit" in result
     assert "(Confiance : 0.95)" in result
+    assert "Temps de réponse" in result
+    # Envoi en JPEG avec des délais d'attente
+    _, kwargs = mock_post.call_args
+    assert kwargs["files"]["file"][2] == "image/jpeg"
+    assert kwargs["timeout"] == (web.API_CONNECT_TIMEOUT, web.API_READ_TIMEOUT)
+
+
+@patch("web.session.post", side_effect=requests.ConnectionError("refused"))
+def test_prediction_api_unreachable(mock_post):
+    result = prediction(Image.new("RGB", (10, 10)))
+    assert result.startswith("Erreur lors de l'appel à l'API")
+
+
+def test_encode_image_downscales_to_model_scale():
+    img = Image.new("RGBA", (4000, 3000), color="green")
+    encoded = Image.open(io.BytesIO(encode_image(img)))
+    assert encoded.format == "JPEG"
+    assert encoded.mode == "RGB"
+    assert encoded.size == (299, 224)
+
+
+def test_encode_image_keeps_small_images():
+    img = Image.new("RGB", (100, 80))
+    assert Image.open(io.BytesIO(encode_image(img))).size == (100, 80)
 
 
 def test_build_interface_returns_blocks():
     interface = build_interface()
     assert isinstance(interface, gr.Blocks)
+
+
+def _batch_response(lines):
+    response = Mock()
+    response.__enter__ = Mock(return_value=response)
+    response.__exit__ = Mock(return_value=False)
+    response.raise_for_status.return_value = None
+    response.iter_lines.return_value = [json.dumps(line).encode() for line in lines]
+    return response
+
+
+def _image_files(tmp_path, count):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"{i}.png"
+        Image.new("RGB", (20, 20)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+@patch("web.GALLERY_CHUNK_SIZE", 2)
+@patch("web.session.post")
+def test_gallery_prediction_fills_rows_progressively(mock_post, tmp_path):
+    paths = _image_files(tmp_path, 3)
+    responses = {
+        2: [
+            {"index": 0, "filename": "0.png", "prediction": "pissenlit", "probability": 0.9},
+            {"index": 1, "filename": "1.png", "error": "Invalid image file"},
+        ],
+        1: [{"index": 0, "filename": "2.png", "prediction": "herbe", "probability": 0.8}],
+    }
+    # Les lots partent en parallèle : réponse choisie selon la taille du lot
+    mock_post.side_effect = lambda url, files, **kwargs: _batch_response(responses[len(files)])
+
+    updates = list(web.gallery_prediction(paths))
+
+    assert updates[0] == [["0.png", "En attente…", ""], ["1.png", "En attente…", ""], ["2.png", "En attente…", ""]]
+    assert len(updates) == 4
+    assert sorted(updates[-1]) == [
+        ["0.png", "pissenlit", "0.90"],
+        ["1.png", "Erreur : Invalid image file", ""],
+        ["2.png", "herbe", "0.80"],
+    ]
+    # Un appel à /predict_batch par lot de GALLERY_CHUNK_SIZE images
+    assert mock_post.call_count == 2
+    assert all(call.kwargs["stream"] for call in mock_post.call_args_list)
+
+
+@patch("web.session.post", side_effect=requests.ConnectionError("refused"))
+def test_gallery_prediction_api_unreachable(mock_post, tmp_path):
+    rows = list(web.gallery_prediction(_image_files(tmp_path, 2)))[-1]
+    assert all(row[1].startswith("Erreur") for row in rows)
+
+
+@patch("web.GALLERY_CHUNK_SIZE", 2)
+@patch("web.session.post")
+def test_gallery_prediction_malformed_response(mock_post, tmp_path):
+    response = _batch_response([{"index": 0, "filename": "0.png", "prediction": "herbe", "probability": 0.8}])
+    response.iter_lines.return_value.append(b"not json")
+    mock_post.return_value = response
+
+    rows = list(web.gallery_prediction(_image_files(tmp_path, 2)))[-1]
+
+    assert rows[0] == ["0.png", "herbe", "0.80"]
+    assert rows[1][0] == "1.png" and rows[1][1].startswith("Erreur : ")
+
+
+def test_gallery_prediction_empty():
+    assert list(web.gallery_prediction([])) == [[]]
+
+
+def _local_api(result=("pissenlit", 0.9)):
+    def submit(image):
+        future = Future()
+        future.set_result(result)
+        return future
+
+    api = Mock()
+    api.batcher.submit.side_effect = submit
+    api.decode.side_effect = lambda contents: Image.open(io.BytesIO(contents))
+    return api
+
+
+@patch("web.INFERENCE_MODE", "local")
+@patch("web.session.post")
+def test_prediction_local_mode_skips_http(mock_post):
+    api = _local_api()
+    with patch("web._api", api):
+        result = prediction(Image.new("RGBA", (10, 10)))
+
+    assert "Prédiction : pissenlit" in result
+    mock_post.assert_not_called()
+    # L'image PIL est passée directement au micro-batcher de l'API
+    assert api.batcher.submit.call_args[0][0].mode == "RGB"
+
+
+@patch("web.INFERENCE_MODE", "local")
+def test_gallery_prediction_local_mode(tmp_path):
+    paths = _image_files(tmp_path, 2)
+    bad = tmp_path / "notes.txt"
+    bad.write_text("not an image")
+
+    with patch("web._api", _local_api(("herbe", 0.75))):
+        rows = list(web.gallery_prediction(paths + [str(bad)]))[-1]
+
+    assert rows == [
+        ["0.png", "herbe", "0.75"],
+        ["1.png", "herbe", "0.75"],
+        ["notes.txt", "Erreur : Invalid image file", ""],
+    ]
+
+
+@patch("web._api", None)
+def test_local_mode_without_api_code(tmp_path):
+    with patch("web.API_SRC_DIR", str(tmp_path)), pytest.raises(RuntimeError, match="outside Docker"):
+        web.local_api()
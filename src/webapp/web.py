@@ -3,33 +3,241 @@ A Gradio web app with drag and drop for image and returns the output of the `pre
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 from typing import Union
 import gradio as gr
 from PIL import Image
 import io
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# "http" : appel de l'API distante ; "local" : modèle chargé dans ce processus
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "http")
+API_SRC_DIR = os.getenv("API_SRC_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "api"
+)
+
+# Configuration de l'appel à l'API
+API_URL = os.getenv("API_URL", "http://localhost:8000")
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "3"))
+API_READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", "30"))
+API_POOL_SIZE = int(os.getenv("API_POOL_SIZE", "8"))
+
+# Côté le plus court des images envoyées (0 : pleine résolution) et qualité JPEG
+UPLOAD_SIZE = int(os.getenv("UPLOAD_SIZE", "224"))
+UPLOAD_JPEG_QUALITY = int(os.getenv("UPLOAD_JPEG_QUALITY", "90"))
+
+# Mode galerie : images envoyées à /predict_batch par lots, quelques lots en parallèle
+GALLERY_CHUNK_SIZE = int(os.getenv("GALLERY_CHUNK_SIZE", "8"))
+GALLERY_CONCURRENCY = int(os.getenv("GALLERY_CONCURRENCY", "2"))
+
+# File d'attente Gradio : traitements simultanés par évènement, et taille maximale
+GRADIO_CONCURRENCY = int(os.getenv("GRADIO_CONCURRENCY", "4"))
+GALLERY_USERS = int(os.getenv("GALLERY_USERS", "2"))
+GRADIO_QUEUE_SIZE = int(os.getenv("GRADIO_QUEUE_SIZE", "64"))
+
+
+def create_session() -> requests.Session:
+    """HTTP session keeping connections to the API open between predictions."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=API_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+session = create_session()
+
+
+def encode_image(img: Image.Image) -> bytes:
+    """Downscale the image to the model input scale and encode it as JPEG."""
+    w, h = img.size
+    scale = UPLOAD_SIZE / min(w, h) if UPLOAD_SIZE else 1
+    # Le modèle recadre puis redimensionne à 224 px : inutile d'envoyer plus de pixels
+    if scale < 1:
+        img = img.resize((max(1, round(w * scale)), max(1, round(h * scale))), Image.BILINEAR)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    img_bytes = io.BytesIO()
+    img.save(img_bytes, format="JPEG", quality=UPLOAD_JPEG_QUALITY)
+    return img_bytes.getvalue()
+
+
+_api = None
+_api_lock = threading.Lock()
+
+
+def local_api():
+    """Import the API module once and load its model, for in-process inference."""
+    global _api
+    with _api_lock:
+        if _api is None:
+            if not os.path.isfile(os.path.join(API_SRC_DIR, "main.py")):
+                # Cas de l'image Docker de la webapp, qui ne contient pas le code de l'API
+                raise RuntimeError(
+                    f"INFERENCE_MODE=local needs the API code in API_SRC_DIR ({API_SRC_DIR}); "
+                    "it is only supported outside Docker, use INFERENCE_MODE=http in the container"
+                )
+            if API_SRC_DIR not in sys.path:
+                sys.path.insert(0, API_SRC_DIR)
+            import main as api
+
+            api.get_model()
+            _api = api
+    return _api
+
+
+def predict_local(img: Image.Image) -> dict:
+    # Même chemin que /predict, sans encodage ni HTTP : le micro-batcher de l'API
+    # regroupe les requêtes des utilisateurs Gradio simultanés
+    class_name, confidence = local_api().batcher.submit(img.convert("RGB")).result()
+    return {"prediction": class_name, "probability": confidence}
 
 
 def prediction(img: Union[Image.Image, None]) -> str:
-    """Return a message based on the provided image.
-    Replace this body with your actual model call.
-    """
+    """Predict the image through the API (or in-process) and return the message."""
     if img is None:
         return "Aucune image reçue. Glissez-déposez une image à gauche."
 
-    # Convert the image to bytes
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format="PNG")
-    img_bytes.seek(0)
+    start = time.perf_counter()
+    if INFERENCE_MODE == "local":
+        try:
+            result = predict_local(img)
+        except Exception as e:
+            return f"Erreur lors de la prédiction : {str(e)}"
+    else:
+        files = {"file": ("image.jpg", encode_image(img), "image/jpeg")}
+        try:
+            response = session.post(
+                f"{API_URL}/predict", files=files, timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT)
+            )
+            response.raise_for_status()
+            result = response.json()
+        except requests.RequestException as e:
+            return f"Erreur lors de l'appel à l'API : {str(e)}"
+
+    # Temps de réponse mesuré côté client (encodage et aller-retour compris)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    logging.info(f"Prediction round trip: {elapsed_ms:.0f} ms")
+    return (
+        f"Prédiction : {result['prediction']} (Confiance : {result['probability']:.2f})\n"
+        f"Temps de réponse : {elapsed_ms:.0f} ms"
+    )
 
-    api_url = "http://localhost:8000/predict"
-    files = {"file": ("image.png", img_bytes, "image/png")}
+
+def read_upload(path: str) -> bytes:
+    """Compact JPEG payload for an image file, or the raw bytes if it is not an image."""
     try:
-        response = requests.post(api_url, files=files)
+        with Image.open(path) as img:
+            return encode_image(img)
+    except OSError:
+        # L'API renverra l'erreur pour ce fichier
+        with open(path, "rb") as f:
+            return f.read()
+
+
+def stream_batch(paths):
+    """Send files to /predict_batch and yield (index, result) as lines arrive."""
+    files = [("files", (os.path.basename(path), read_upload(path), "image/jpeg")) for path in paths]
+    with session.post(
+        f"{API_URL}/predict_batch",
+        files=files,
+        stream=True,
+        timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT),
+    ) as response:
         response.raise_for_status()
-        result = response.json()
-        return f"Prédiction : {result['prediction']} (Confiance : {result['probability']:.2f})"
-    except requests.RequestException as e:
-        return f"Erreur lors de l'appel à l'API : {str(e)}"
+        for line in response.iter_lines():
+            if line:
+                result = json.loads(line)
+                yield result["index"], result
+
+
+def format_row(name: str, result: dict) -> list:
+    if "error" in result:
+        return [name, f"Erreur : {result['error']}", ""]
+    return [name, result["prediction"], f"{result['probability']:.2f}"]
+
+
+def local_results(paths):
+    """Score files in-process, yielding (index, result) as predictions complete."""
+    api = local_api()
+    futures = {}
+    for index, path in enumerate(paths):
+        try:
+            with open(path, "rb") as f:
+                # Décodage JPEG à échelle réduite, comme dans l'API
+                futures[api.batcher.submit(api.decode(f.read()))] = index
+        except Exception:
+            yield index, {"error": "Invalid image file"}
+    for future in as_completed(futures):
+        try:
+            class_name, confidence = future.result()
+            yield futures[future], {"prediction": class_name, "probability": confidence}
+        except Exception as e:
+            yield futures[future], {"error": str(e)}
+
+
+def http_results(paths):
+    """Score files through /predict_batch, yielding (index, result) as lines arrive."""
+    chunks = [paths[i:i + GALLERY_CHUNK_SIZE] for i in range(0, len(paths), GALLERY_CHUNK_SIZE)]
+    results = queue.Queue()
+
+    def score_chunk(offset, chunk):
+        received = set()
+
+        def fail_remaining(message):
+            for index in set(range(len(chunk))) - received:
+                results.put((offset + index, {"error": message}))
+
+        try:
+            for index, result in stream_batch(chunk):
+                received.add(index)
+                results.put((offset + index, result))
+        except requests.RequestException as e:
+            fail_remaining(f"appel à l'API impossible ({e})")
+        except Exception as e:
+            # Fichier illisible, réponse mal formée… : les lignes du lot ne restent pas en attente
+            fail_remaining(str(e) or type(e).__name__)
+        finally:
+            results.put(None)
+
+    # Au plus GALLERY_CONCURRENCY lots en vol : l'API n'est pas saturée par un seul utilisateur
+    with ThreadPoolExecutor(max_workers=GALLERY_CONCURRENCY) as pool:
+        for n, chunk in enumerate(chunks):
+            pool.submit(score_chunk, n * GALLERY_CHUNK_SIZE, chunk)
+        pending = len(chunks)
+        while pending:
+            item = results.get()
+            if item is None:
+                pending -= 1
+                continue
+            yield item
+
+
+def gallery_prediction(paths):
+    """Score several images, yielding the result table each time a prediction arrives."""
+    if not paths:
+        yield []
+        return
+
+    names = [os.path.basename(path) for path in paths]
+    rows = [[name, "En attente…", ""] for name in names]
+    yield list(rows)
+
+    start = time.perf_counter()
+    results = local_results(paths) if INFERENCE_MODE == "local" else http_results(paths)
+    for index, result in results:
+        rows[index] = format_row(names[index], result)
+        yield list(rows)
+
+    logging.info(f"Scored {len(paths)} images in {(time.perf_counter() - start) * 1000:.0f} ms")
 
 
 beige_theme = gr.themes.Soft().set(
@@ -93,23 +301,49 @@ def build_interface() -> gr.Blocks:
             """
         )
 
-        # Layout – input on the left, output on the right
-        with gr.Row(equal_height=True):
-            image_input = gr.Image(type="pil", label="Image")
-            output_text = gr.Textbox(
-                label="Résultat de la prédiction",
-                placeholder="Pissenlit ou herbe ?",
-                lines=2,
-                interactive=False,
-            )
+        with gr.Tab("Une image"):
+            # Layout – input on the left, output on the right
+            with gr.Row(equal_height=True):
+                image_input = gr.Image(type="pil", label="Image")
+                output_text = gr.Textbox(
+                    label="Résultat de la prédiction",
+                    placeholder="Pissenlit ou herbe ?",
+                    lines=2,
+                    interactive=False,
+                )
+
+            # Call for the prediction function
+            image_input.change(fn=prediction, inputs=image_input, outputs=output_text)
+
+            # Utility buttons
+            with gr.Row():
+                clear_btn = gr.Button("Effacer")
+                clear_btn.click(lambda: (None, ""), outputs=[image_input, output_text])
 
-        # Call for the prediction function
-        image_input.change(fn=prediction, inputs=image_input, outputs=output_text)
+        with gr.Tab("Plusieurs images"):
+            with gr.Row(equal_height=True):
+                files_input = gr.File(
+                    file_count="multiple", file_types=["image"], type="filepath", label="Images"
+                )
+                results_table = gr.Dataframe(
+                    headers=["Fichier", "Prédiction", "Confiance"],
+                    label="Résultats",
+                    interactive=False,
+                )
+
+            # Résultats affichés au fil de l'eau ; file d'attente dédiée aux gros lots
+            # pour qu'ils ne bloquent pas les prédictions d'une seule image
+            files_input.upload(
+                fn=gallery_prediction,
+                inputs=files_input,
+                outputs=results_table,
+                concurrency_limit=GALLERY_USERS,
+                concurrency_id="gallery",
+            )
 
-        # Utility buttons
-        with gr.Row():
-            clear_btn = gr.Button("Effacer")
-            clear_btn.click(lambda: (None, ""), outputs=[image_input, output_text])
+            with gr.Row():
+                clear_files_btn = gr.Button("Effacer")
+                clear_files_btn.click(lambda: (None, []), outputs=[files_input, results_table])
 
     return demo
 
@@ -118,7 +352,7 @@ if __name__ == "__main__":
     demo = build_interface()
 
     # Enable the task queue for concurrency
-    demo.queue()
+    demo.queue(default_concurrency_limit=GRADIO_CONCURRENCY, max_size=GRADIO_QUEUE_SIZE)
 
     # Launch the app locally on URL (by default http://localhost:7860)
     demo.launch(server_name="0.0.0.0", server_port=7860)